@@ -51,8 +51,7 @@ async def chat_worker(chain_instance):
         try:
             chat_hist = generator.get_chat_hist_instance(session_id)
             # Use the worker's own chain instance to generate a response.
-            chat_hist = await generator.generate_chat_st(user_input, chain_instance, chat_hist)
-            result = chat_hist.messages[-1].content
+            result, _ = await generator.generate_chat_st(user_input, chain_instance, chat_hist)
             future.set_result(result)
         except Exception as e:
             future.set_exception(e)
@@ -0,0 +1,67 @@
+"""
+Recall@k, memory and latency of the quantized first pass of the local
+vector index, measured against exact float32 search on our corpus.
+
+The local index must be populated (VECTOR_BACKEND=local python preprocess.py preprocess).
+Queries are real questions plus the opening sentence of randomly sampled chunks.
+
+python benchmark_quantization.py [n_sampled_queries] [k]
+"""
+import sys
+import random
+import statistics
+from time import perf_counter
+
+import clients
+from chunk_store import ChunkStore
+from local_vectorstore import LocalVectorIndex
+from compare_vectorstores import DEFAULT_QUERIES, percentile
+
+
+MODES = [("none", 1), ("int8", 2), ("int8", 4), ("binary", 4), ("binary", 10)]
+
+
+def sample_queries(chunk_store, n, seed=0):
+    ids = chunk_store.ids()
+    random.Random(seed).shuffle(ids)
+    queries = []
+    for chunk_id in ids[:n]:
+        text = chunk_store.get(chunk_id).page_content.strip()
+        queries.append(text.split(".")[0][:200])
+    return queries
+
+
+if __name__ == "__main__":
+    n_sampled = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    chunk_store = ChunkStore()
+    embedding_model = clients.get_embedding_model()
+    queries = DEFAULT_QUERIES + sample_queries(chunk_store, n_sampled)
+    vectors = embedding_model.embed_documents(queries)  # embedding excluded from the timings
+
+    exact = None
+    print(f"{len(queries)} queries, k={k}\n")
+    print(f"{'mode':<8} {'rescore':>7} {'recall@k':>9} {'RAM MB':>8} {'float MB':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, factor in MODES:
+        index = LocalVectorIndex(chunk_store=chunk_store, quantization=mode, rescore_factor=factor)
+        stats = index.memory_stats()  # also builds the codes
+        index.search(vectors[0], k=k)  # warm-up (page cache)
+
+        latencies, results = [], []
+        for vector in vectors:
+            start = perf_counter()
+            hits = index.search(vector, k=k)
+            latencies.append((perf_counter() - start) * 1000)
+            results.append({chunk_id for chunk_id, _ in hits})
+
+        if exact is None:
+            exact = results
+        recall = statistics.mean(len(r & e) / max(len(e), 1) for r, e in zip(results, exact))
+        resident = stats["codes_bytes"] if mode != "none" else stats["float32_bytes"]
+        print(f"{mode:<8} {factor:>7} {recall:>9.3f} {resident / 2**20:>8.1f} "
+              f"{stats['float32_bytes'] / 2**20:>9.1f} {percentile(latencies, 0.5):>8.2f} "
+              f"{percentile(latencies, 0.95):>8.2f}")
+
+    print("\nRAM MB: what the first pass keeps resident (the whole float32 matrix for 'none');"
+          "\nwith quantization the float32 rows stay on disk and only candidates are paged in.")
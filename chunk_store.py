@@ -0,0 +1,186 @@
+import paths
+import os
+import json
+import mmap
+import threading
+from langchain_core.documents import Document
+
+
+# a shard is closed once it grows past this size
+SHARD_MAX_BYTES = int(os.getenv("CHUNK_SHARD_MAX_BYTES", 64 * 1024 * 1024))
+
+
+class ChunkStore:
+    """
+    Append-only, sharded on-disk store for chunks.
+
+    Layout (in `directory`):
+    • ``shard-00000.jsonl`` … one JSON record per line ({"id", "text", "metadata"}),
+      never rewritten, read through a memory map;
+    • ``index.jsonl`` – append-only offset index, one line per chunk
+      ({"id", "source", "shard", "offset", "length"}), plus tombstones
+      ({"id", "deleted": true}) and source moves ({"id", "source"}).
+
+    Reading a chunk costs one dictionary lookup and one slice of the mapped
+    shard; the rest of the corpus is never loaded. The index is re-read
+    incrementally by `refresh()`, so other processes' appends become visible.
+    """
+
+    def __init__(self, directory: str = paths.chunks_dir_path):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.entries = {}     # id -> {"source", "shard", "offset", "length"}
+        self.by_source = {}   # source -> [ids]
+        self._index_pos = 0
+        self._maps = {}       # shard -> mmap
+        self._lock = threading.Lock()
+        # remapping closes the old map: readers (worker threads) slice under this lock
+        self._maps_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    # ------------------------------------------------------------------ #
+    # index
+    # ------------------------------------------------------------------ #
+    def refresh(self):
+        """Apply the index lines appended since the last call (possibly by another process)."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written line: pick it up next time
+                self._index_pos += len(line)
+                self._apply(json.loads(line))
+
+    def _apply(self, rec):
+        chunk_id = rec["id"]
+        old = self.entries.get(chunk_id)
+        if old is not None:
+            self.by_source.get(old["source"], []).remove(chunk_id)
+        if rec.get("deleted"):
+            self.entries.pop(chunk_id, None)
+            return
+        if "shard" not in rec and old is None:
+            return
+        entry = {**old, "source": rec["source"]} if "shard" not in rec else {
+            "source": rec["source"],
+            "shard": rec["shard"],
+            "offset": rec["offset"],
+            "length": rec["length"],
+        }
+        self.entries[chunk_id] = entry
+        self.by_source.setdefault(entry["source"], []).append(chunk_id)
+
+    def _append_index(self, records):
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records))
+        self.refresh()
+
+    # ------------------------------------------------------------------ #
+    # shards
+    # ------------------------------------------------------------------ #
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:05d}.jsonl")
+
+    def _current_shard(self) -> int:
+        shards = sorted(
+            int(name[6:11]) for name in os.listdir(self.directory)
+            if name.startswith("shard-") and name.endswith(".jsonl")
+        )
+        if not shards:
+            return 0
+        last = shards[-1]
+        if os.path.getsize(self._shard_path(last)) >= SHARD_MAX_BYTES:
+            return last + 1
+        return last
+
+    def _map(self, shard: int, end: int):
+        """Memory map of `shard` covering at least `end` bytes (remapped after appends; `_maps_lock` held)."""
+        mm = self._maps.get(shard)
+        if mm is None or len(mm) < end:
+            if mm is not None:
+                mm.close()
+            with open(self._shard_path(shard), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = mm
+        return mm
+
+    # ------------------------------------------------------------------ #
+    # public API
+    # ------------------------------------------------------------------ #
+    def append(self, docs, ids):
+        """Append Documents under the given chunk ids."""
+        if not docs:
+            return
+        with self._lock:
+            shard = self._current_shard()
+            records = []
+            with open(self._shard_path(shard), "ab") as f:
+                offset = f.tell()
+                for doc, chunk_id in zip(docs, ids):
+                    line = json.dumps(
+                        {"id": chunk_id, "text": doc.page_content, "metadata": doc.metadata},
+                        ensure_ascii=False,
+                    ).encode("utf-8") + b"\n"
+                    f.write(line)
+                    records.append({
+                        "id": chunk_id,
+                        "source": doc.metadata.get("source"),
+                        "shard": shard,
+                        "offset": offset,
+                        "length": len(line),
+                    })
+                    offset += len(line)
+            # data first, index second: a crash in between only leaves unreachable bytes
+            self._append_index(records)
+
+    def delete(self, ids):
+        """Tombstone chunks (the bytes stay in their shard)."""
+        ids = [i for i in ids if i in self.entries]
+        if ids:
+            with self._lock:
+                self._append_index([{"id": i, "deleted": True} for i in ids])
+
+    def set_source(self, ids, source: str):
+        """Move chunks to a new source (renamed file) without rewriting them."""
+        ids = [i for i in ids if i in self.entries]
+        if ids:
+            with self._lock:
+                self._append_index([{"id": i, "source": source} for i in ids])
+
+    def get(self, chunk_id: str):
+        """Read one chunk, or None if unknown/deleted."""
+        entry = self.entries.get(chunk_id)
+        if entry is None:
+            return None
+        end = entry["offset"] + entry["length"]
+        with self._maps_lock:
+            raw = self._map(entry["shard"], end)[entry["offset"]:end]
+        rec = json.loads(raw)
+        metadata = {**rec["metadata"], "source": entry["source"]}
+        return Document(id=chunk_id, page_content=rec["text"], metadata=metadata)
+
+    def ids(self, source: str = None):
+        """Live chunk ids, optionally restricted to one source."""
+        if source is not None:
+            return list(self.by_source.get(source, []))
+        return list(self.entries)
+
+    def iter_chunks(self, source: str = None):
+        """Yield (id, Document) one chunk at a time."""
+        for chunk_id in self.ids(source):
+            yield chunk_id, self.get(chunk_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.entries
+
+    def close(self):
+        with self._maps_lock:
+            for mm in self._maps.values():
+                mm.close()
+            self._maps = {}
@@ -0,0 +1,100 @@
+import paths
+import os
+import threading
+from time import monotonic
+
+import chromadb
+from chromadb.config import Settings
+from embedding_cache import CachedEmbeddings, cached_embedding_model
+
+
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8010))
+# seconds between two heartbeats of a cached Chroma client
+CHROMA_HEALTHCHECK_INTERVAL = float(os.getenv("CHROMA_HEALTHCHECK_INTERVAL", 30))
+
+
+_lock = threading.Lock()
+_embedding_models = {}   # model path -> CachedEmbeddings
+_chroma_clients = {}     # (host, port) -> [client, last successful heartbeat]
+_async_chroma_clients = {}  # (host, port) -> [async client, last successful heartbeat]
+
+
+def get_embedding_model(model_name: str = paths.bert_model_path) -> CachedEmbeddings:
+    """The process-wide sentence embedder (loaded once, calls go through the embedding cache)."""
+    with _lock:
+        model = _embedding_models.get(model_name)
+        if model is None:
+            model = _embedding_models[model_name] = cached_embedding_model(model_name)
+        return model
+
+
+def get_chroma_client(host: str = CHROMA_HOST, port: int = CHROMA_PORT):
+    """
+    The process-wide Chroma HTTP client for (host, port).
+
+    A single client keeps one pooled HTTP session, so connections are kept
+    alive and reused across calls. It is checked with a heartbeat at most
+    every CHROMA_HEALTHCHECK_INTERVAL seconds and rebuilt if the server
+    stopped answering (e.g. it was restarted).
+    """
+    key = (host, port)
+    with _lock:
+        entry = _chroma_clients.get(key)
+    if entry is not None and monotonic() - entry[1] < CHROMA_HEALTHCHECK_INTERVAL:
+        return entry[0]
+    # network calls run outside the lock: a slow server must not block the other getters
+    if entry is not None:
+        try:
+            entry[0].heartbeat()
+            entry[1] = monotonic()
+            return entry[0]
+        except Exception as e:
+            print(f"Chroma heartbeat failed on {host}:{port}, reconnecting: {e}")
+    client = chromadb.HttpClient(host=host, port=port, settings=Settings(anonymized_telemetry=False))
+    with _lock:
+        current = _chroma_clients.get(key)
+        if current is not None and current is not entry:
+            return current[0]  # another thread reconnected meanwhile
+        _chroma_clients[key] = [client, monotonic()]
+    return client
+
+
+async def get_async_chroma_client(host: str = CHROMA_HOST, port: int = CHROMA_PORT):
+    """Async counterpart of `get_chroma_client` (one `AsyncHttpClient` per server and event loop)."""
+    key = (host, port)
+    entry = _async_chroma_clients.get(key)
+    if entry is not None and monotonic() - entry[1] < CHROMA_HEALTHCHECK_INTERVAL:
+        return entry[0]
+    if entry is not None:
+        try:
+            await entry[0].heartbeat()
+            entry[1] = monotonic()
+            return entry[0]
+        except Exception as e:
+            print(f"Chroma heartbeat failed on {host}:{port}, reconnecting: {e}")
+    client = await chromadb.AsyncHttpClient(host=host, port=port, settings=Settings(anonymized_telemetry=False))
+    _async_chroma_clients[key] = [client, monotonic()]
+    return client
+
+
+async def get_async_collection(name: str = "rag_docs", host: str = CHROMA_HOST, port: int = CHROMA_PORT):
+    """Async handle on a Chroma collection; queries must pass embeddings (no server-side model)."""
+    client = await get_async_chroma_client(host, port)
+    return await client.get_or_create_collection(name, metadata={"hnsw:space": "cosine"}, embedding_function=None)
+
+
+def health() -> dict:
+    """Reachability of the cached Chroma clients and the loaded embedding models."""
+    chroma = {}
+    for (host, port), entry in list(_chroma_clients.items()):
+        try:
+            entry[0].heartbeat()
+            entry[1] = monotonic()
+            chroma[f"{host}:{port}"] = "ok"
+        except Exception as e:
+            chroma[f"{host}:{port}"] = f"unreachable: {e}"
+    return {
+        "chroma": chroma,
+        "embedding_models": [os.path.basename(os.path.normpath(m)) for m in _embedding_models],
+    }
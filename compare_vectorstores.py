@@ -0,0 +1,72 @@
+"""
+Side-by-side query latency of the vector backends (Chroma HTTP vs local index).
+
+Both backends must be populated, e.g.:
+    python preprocess.py preprocess                       # Chroma
+    VECTOR_BACKEND=local python preprocess.py preprocess  # local index
+
+python compare_vectorstores.py [runs] ["query" ...]
+"""
+import sys
+import statistics
+from time import perf_counter
+
+import clients
+from chunk_store import ChunkStore
+from semantic_cache import chunk_key
+import retriever as rt
+
+
+DEFAULT_QUERIES = [
+    "central architecture",
+    "how to install the HSM",
+    "key ceremony procedure",
+    "certificate renewal",
+    "backup and restore of the database",
+]
+K = 20
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def time_backend(vectorstore, vectors, runs):
+    latencies, results = [], []
+    vectorstore.similarity_search_by_vector(vectors[0], k=K)  # warm-up (connection / page cache)
+    for _ in range(runs):
+        for vector in vectors:
+            start = perf_counter()
+            docs = vectorstore.similarity_search_by_vector(vector, k=K)
+            latencies.append((perf_counter() - start) * 1000)
+            results.append([chunk_key(d) for d in docs])
+    return latencies, results[:len(vectors)]
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    queries = sys.argv[2:] or DEFAULT_QUERIES
+
+    embedding_model = clients.get_embedding_model()
+    vectors = [embedding_model.embed_query(q) for q in queries]  # embedding excluded from the timings
+    chunk_store = ChunkStore()
+
+    backends = {
+        "chroma": rt.load_vectorstore(embedding_model, backend="chroma"),
+        "local": rt.load_vectorstore(embedding_model, backend="local", chunk_store=chunk_store),
+    }
+
+    rankings = {}
+    print(f"{len(queries)} queries × {runs} runs, k={K}\n")
+    print(f"{'backend':<8} {'chunks':>8} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, vectorstore in backends.items():
+        latencies, rankings[name] = time_backend(vectorstore, vectors, runs)
+        print(f"{name:<8} {vectorstore._collection.count():>8} {statistics.mean(latencies):>9.2f} "
+              f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.95):>8.2f} {max(latencies):>8.2f}")
+
+    overlaps = [
+        len(set(a) & set(b)) / max(len(a), 1)
+        for a, b in zip(rankings["chroma"], rankings["local"])
+    ]
+    print(f"\nTop-{K} overlap (local vs chroma HNSW): {statistics.mean(overlaps):.1%}")
@@ -0,0 +1,158 @@
+import paths
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from time import time
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+
+# on-disk budget of the cache; least recently used vectors are evicted beyond it
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of embeddings keyed by (model id, kind, text hash).
+
+    Vectors are kept as float32 blobs. When the stored vectors exceed
+    `max_bytes`, the least recently used ones are evicted down to 90 % of
+    the budget. Hit / miss counters are kept for the lifetime of the object.
+    """
+
+    def __init__(self, path: str = paths.embedding_cache_path, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT, kind TEXT, hash TEXT, vector BLOB, nbytes INTEGER, last_used REAL,"
+            " PRIMARY KEY (model, kind, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, kind: str, hashes):
+        """Return {hash: vector} for the hashes present in the cache."""
+        found = {}
+        hashes = list(set(hashes))
+        with self._lock:
+            # stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model=? AND kind=? "
+                    f"AND hash IN ({','.join('?' * len(part))})",
+                    [model, kind, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+            if found:
+                now = time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used=? WHERE model=? AND kind=? AND hash=?",
+                    [(now, model, kind, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, kind: str, items):
+        """Store (hash, vector) pairs, then evict if over budget."""
+        now = time()
+        rows = []
+        for h, vector in items:
+            blob = array("f", vector).tobytes()
+            rows.append((model, kind, h, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._size += sum(r[4] for r in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used vectors down to 90 % of the budget (lock held)."""
+        target = int(self.max_bytes * 0.9)
+        self._size = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+        freed, victims = 0, []
+        for model, kind, h, nbytes in self._conn.execute(
+                "SELECT model, kind, hash, nbytes FROM embeddings ORDER BY last_used"):
+            if self._size - freed <= target:
+                break
+            victims.append((model, kind, h))
+            freed += nbytes
+        self._conn.executemany("DELETE FROM embeddings WHERE model=? AND kind=? AND hash=?", victims)
+        self._conn.commit()
+        self._size -= freed
+        self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain `Embeddings` wrapper that only runs the underlying model on
+    texts it has never embedded before (with this model).
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache or EmbeddingCache()
+
+    def _embed(self, kind: str, texts, embed_fn):
+        hashes = [text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model_id, kind, hashes)
+
+        missing = {}  # hash -> text, deduplicated
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, t)
+        n_missed = sum(h not in found for h in hashes)
+        self.cache.hits += len(hashes) - n_missed
+        self.cache.misses += n_missed
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self.cache.put_many(self.model_id, kind, computed.items())
+            found.update(computed)
+
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed("doc", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda ts: [self.embeddings.embed_query(ts[0])])[0]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def cached_embedding_model(model_name: str = paths.bert_model_path) -> CachedEmbeddings:
+    """HuggingFace sentence embedder whose calls go through the on-disk embedding cache."""
+    model_id = os.path.basename(os.path.normpath(model_name))
+    return CachedEmbeddings(HuggingFaceEmbeddings(model_name=model_name), model_id)
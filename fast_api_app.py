@@ -1,70 +1,155 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response
 import retriever as rt
 import generator
 import paths
 import redis_db
 import os
 import asyncio
-from langchain_huggingface import HuggingFaceEmbeddings
+import clients
 import json
 import preprocess
-from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import asyncio, shutil
+import ingest_jobs
+import metrics_rollup
+import metrics
+from semantic_cache import SemanticCache
+from loop_monitor import LoopLagMonitor
+import time
 from uuid import uuid4
+from datetime import date, datetime, timedelta
 from typing import Literal
+from functools import partial
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pydantic import BaseModel
+import hashlib
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 
 
 app = FastAPI()
 
-vectorstore_lock = asyncio.Lock()          # protects concurrent writes
+# largest accepted upload, and the block size the body is parsed and written in
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 200 * 1024 * 1024))
+UPLOAD_BLOCK_BYTES = 1024 * 1024
+# room for the multipart headers around a single file in the Content-Length check
+UPLOAD_FORM_OVERHEAD = 64 * 1024
 
 
-# Global chat queue, worker tasks, and a lock to serialize model calls
+# Global chat queue and worker tasks (one worker per generator instance)
 chat_queue = asyncio.Queue()
 worker_tasks = []
-model_lock = asyncio.Lock()  # Ensures only one model call is active at a time
 
 # Load models and initialize chains/clients
-embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
-vectorstore = rt.load_vectorstore(embedding_model)
-generator_model = generator.get_model()
-generator_chain = generator.get_chain_generator(generator_model)
-retriever_chain, retriever, collection = rt.get_retriever(vectorstore, generator_chain)
-redis_client = redis_db.create_redis_client()
+embedding_model = clients.get_embedding_model()
+local_indexes = preprocess.LocalIndexes()
+vectorstore = rt.load_vectorstore(embedding_model, chunk_store=local_indexes.chunk_store)
+generator_pool = generator.GeneratorPool()
+generator_chain = generator_pool.instances[0].chain
+retriever_chain, retriever, collection = rt.get_retriever(
+    vectorstore, generator_chain,
+    bm25=local_indexes.bm25, chunk_store=local_indexes.chunk_store, phrases=local_indexes.phrases,
+)
+# asyncio client for the request path (chat history, semantic cache);
+# the job store stays sync: it is also used by the ingestion worker processes
+redis_client = redis_db.create_async_redis_client()
+semantic_cache = SemanticCache(redis_client, embed_fn=retriever.aembed_query)
+job_store = ingest_jobs.JobStore(redis_db.create_redis_client())
+# ingestion jobs run in worker processes (see ingest_jobs.run_job); spawned,
+# not forked, so they do not inherit the LLMs and threads of this process
+ingest_pool = ProcessPoolExecutor(
+    max_workers=ingest_jobs.INGEST_JOB_WORKERS,
+    mp_context=multiprocessing.get_context("spawn"),
+)
+loop_lag = LoopLagMonitor()
 
 
 @app.on_event("startup")
 async def startup_event():
     global worker_tasks
-    num_workers = 1  # Adjust the number of workers as needed
-    for _ in range(num_workers):
-        task = asyncio.create_task(chat_worker())
+    # async Chroma client for the retrieval path (the local backend needs none)
+    if rt.VECTOR_BACKEND == "chroma":
+        retriever.async_collection = await clients.get_async_collection()
+    # before any new upload is queued: jobs of the previous run died with its worker pool
+    await fail_interrupted_jobs()
+    worker_tasks.append(asyncio.create_task(loop_lag.run()))
+    # fold the pre-rollup per-day dashboard keys into the rollups (once per day)
+    worker_tasks.append(asyncio.create_task(backfill_rollups()))
+    # GENERATOR_INSTANCES sets the number of models, hence of workers
+    for instance in generator_pool.instances:
+        task = asyncio.create_task(chat_worker(instance))
         worker_tasks.append(task)
 
 
+async def fail_interrupted_jobs():
+    try:
+        failed = await asyncio.to_thread(job_store.fail_unfinished, "interrupted by an API restart")
+        if failed:
+            print(f"{failed} unfinished ingestion job(s) of the previous run marked failed")
+    except Exception as e:
+        print(f"Could not check unfinished ingestion jobs: {e}")
+
+
+async def backfill_rollups():
+    try:
+        days = await asyncio.to_thread(metrics_rollup.backfill, job_store.redis_client)
+        if days:
+            print(f"{days} day(s) of legacy metrics folded into the rollups")
+    except Exception as e:
+        print(f"Metrics backfill failed: {e}")
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    ingest_pool.shutdown(wait=False, cancel_futures=True)
     for task in worker_tasks:
         task.cancel()
     await asyncio.gather(*worker_tasks, return_exceptions=True)
 
 
-async def chat_worker():
-    """Worker that continuously processes chat requests from the queue."""
+async def chat_worker(instance):
+    """
+    Worker bound to one generator instance: it only takes a request from the
+    queue when its model is free, so requests go to the first idle instance.
+    A request carrying a `token_queue` is streamed: tokens are pushed to it
+    as they are generated, followed by the final stats dict and `None`.
+    """
     while True:
-        session_id, user_input, future = await chat_queue.get()
+        session_id, user_input, future, token_queue, enqueued_at = await chat_queue.get()
+        waited = time.monotonic() - enqueued_at
+        generator_pool.record_wait(waited)
+        metrics.chat_queue_wait.observe(waited)
         try:
             chat_hist = generator.get_chat_hist_instance(session_id)
-            # Serialize access to the generator chain to avoid connection issues
-            async with model_lock:
-                chat_hist , duration = await generator.generate_chat_st(user_input, retriever_chain, chat_hist)
-            result = ( chat_hist.messages[-1].content , duration )
+            async with instance.busy():
+                if token_queue is None:
+                    result = await generator.generate_chat_st(
+                        user_input, instance.chain, chat_hist,
+                        retriever=retriever, semantic_cache=semantic_cache,
+                        budget=instance.budget, prefill=instance.prefill,
+                    )
+                else:
+                    stats = None
+                    async for item in generator.generate_chat_stream(
+                        user_input, instance.chain, chat_hist,
+                        retriever=retriever, semantic_cache=semantic_cache,
+                        budget=instance.budget, prefill=instance.prefill,
+                    ):
+                        if isinstance(item, dict):
+                            stats = item
+                        await token_queue.put(item)
+                    if stats is None:
+                        raise RuntimeError("Generation ended without its final stats")
+                    result = ( None , stats["duration"] )
             future.set_result(result)
         except Exception as e:
             future.set_exception(e)
         finally:
+            if token_queue is not None:
+                await token_queue.put(None)
             chat_queue.task_done()
 
 
@@ -73,9 +158,14 @@ async def home():
     return {"message": "FastAPI is running!"}
 
 
+@app.get("/health")
+async def health():
+    return await asyncio.to_thread(clients.health)
+
+
 class RetrievePayload(BaseModel):
     query:  str
-    mode:  Literal["vector", "words"] = "vector"
+    mode:  Literal["vector", "words", "hybrid"] = "vector"
 
 @app.post("/retrieve")
 async def retrieve_documents(payload: RetrievePayload):
@@ -94,11 +184,40 @@ async def chat(user_input: str, session_id: str):
     loop = asyncio.get_running_loop()
     future = loop.create_future()
     # Put the task into the queue
-    await chat_queue.put((session_id, user_input, future))
+    await chat_queue.put((session_id, user_input, future, None, time.monotonic()))
     # Wait for the worker to process the task and return the result
     response , duration = await future
     return {"response": response , "duration" : duration}
 
+
+@app.post("/chat/stream")
+async def chat_stream(user_input: str, session_id: str):
+    """
+    Same as /chat but streamed as Server-Sent Events while llama.cpp decodes:
+    ``data: {"token": ...}`` events, then ``data: {"done": true, "duration", "ttft"}``
+    (or ``data: {"error": ...}``).
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    token_queue = asyncio.Queue()
+    await chat_queue.put((session_id, user_input, future, token_queue, time.monotonic()))
+
+    async def events():
+        while True:
+            item = await token_queue.get()
+            if item is None:
+                break
+            if isinstance(item, dict):
+                yield f"data: {json.dumps({'done': True, **item})}\n\n"
+            else:
+                yield f"data: {json.dumps({'token': item})}\n\n"
+        try:
+            await future
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # =====================================================================
 
 @app.get("/chat/history")
@@ -110,7 +229,7 @@ async def chat_history(session_id: str):
     chat_hist = generator.get_chat_hist_instance(session_id)
     key = chat_hist.key  # ex. "chat_history:<session_id>"
     # lrange renvoie les JSON strings {"role","content","duration"?}
-    raw = redis_client.lrange(key, 0, -1)
+    raw = await redis_client.lrange(key, 0, -1)
     # reconvertit en liste de dicts
     history = [json.loads(item) for item in raw]
     # on filtre juste les system, si souhaité
@@ -120,40 +239,273 @@ async def chat_history(session_id: str):
 
 
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@app.get("/retrieve/stats")
+async def retrieval_latency_stats():
+    stats = rt.latency_stats()
+    if hasattr(vectorstore._collection, "memory_stats"):  # local backend
+        stats["index"] = await asyncio.to_thread(vectorstore._collection.memory_stats)
+    return stats
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Per-stage counters and histograms of this process in the Prometheus text
+    format, plus the ingestion totals shared through Redis (left out when
+    Redis is unreachable).
+    """
+    metrics.chat_queue_depth.set(chat_queue.qsize())
+    try:
+        extra = metrics.render_ingest(await redis_client.hgetall(metrics.INGEST_KEY))
+    except Exception as e:
+        # Redis down: still export the metrics of this process
+        print(f"Ingestion metrics unavailable: {e}")
+        extra = []
+    return Response(metrics.render(extra), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/metrics/summary")
+async def metrics_summary(
+    start: date = Query(None, alias="from"),
+    end: date = Query(None, alias="to"),
+    granularity: Literal["day", "week", "month"] = None,
+):
+    """
+    Dashboard metrics over [from, to] (ISO dates, default: the last 7 days):
+    totals plus a series per day/week/month (chosen from the range length
+    when not given), from the rollups in a single pipelined Redis read.
+    """
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' is after 'to'")
+    if (end - start).days + 1 > metrics_rollup.METRICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"range longer than {metrics_rollup.METRICS_MAX_DAYS} days")
+    return await metrics_rollup.read_summary(redis_client, start, end, granularity)
 
-    # Save into the temporary uploads directory
-    tmp_path = os.path.join(paths.upload_dir_path, file.filename)
-    with open(tmp_path, "wb") as f:
-        f.write(await file.read())
 
-    # Extract plain text plus PDF metadata using our new extractor
-    text, meta = preprocess.get_text(tmp_path)
-    if not text:
-        return {"error": "Unable to extract text from PDF."}
+@app.get("/loop/lag")
+async def event_loop_lag():
+    """How late the event loop wakes up: blocking work on the loop shows up here."""
+    return loop_lag.stats()
 
-    # Merge metadata and split into chunks
-    meta_clean = {k: v for k, v in (meta or {}).items() if v}
-    meta_clean["source"] = os.path.join(paths.data_path, file.filename)
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=20_000, chunk_overlap=2_000)
-    docs = splitter.split_documents(
-        [Document(page_content=text, metadata=meta_clean)]
-    )
+@app.get("/retrieve/cache/stats")
+async def retrieval_cache_stats():
+    return rt.cache_stats()
+
+
+@app.get("/chat/pool/stats")
+async def generator_pool_stats():
+    return generator_pool.stats(queued=chat_queue.qsize())
+
+
+@app.get("/chat/cache/stats")
+async def semantic_cache_stats():
+    return await semantic_cache.stats()
+
+
+@app.get("/embedding_cache/stats")
+async def embedding_cache_stats():
+    return embedding_model.stats()
+
+
+class StagedUpload:
+    """One file part of an upload body, hashed and written to the staging folder as it arrives."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.job_id = uuid4().hex
+        self.path = ingest_jobs.staging_path(self.job_id, filename)
+        self.size = 0
+        self.error = None
+        self._hasher = hashlib.sha256()
+        self._f = open(self.path, "wb")
+
+    @property
+    def digest(self) -> str:
+        return self._hasher.hexdigest()
 
-    # Embed and append to the **Chroma** collection (thread‑safe)
-    async with vectorstore_lock:
-        ids = [str(uuid4()) for _ in range(len(docs))]
-        vectorstore.add_documents(docs, ids=ids)
-        # For Chroma (HTTP client) data are immediately persisted server‑side
+    def write(self, data: bytes):
+        if self.error:
+            return
+        self.size += len(data)
+        if self.size > UPLOAD_MAX_BYTES:
+            self.error = f"{self.filename} exceeds {UPLOAD_MAX_BYTES} bytes"
+            self.discard()  # the rest of the part is dropped, not written
+            return
+        self._hasher.update(data)
+        self._f.write(data)
 
-    # Move the PDF from /uploads to the canonical data/ corpus folder
+    def close(self):
+        self._f.close()
+
+    def discard(self):
+        self._f.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadReceiver:
+    """
+    Push parser for the multipart/form-data body of the upload endpoints.
+
+    Starlette's `UploadFile` is only handed over once the whole body has
+    been spooled to a temporary file, so a size check there runs after an
+    oversized upload was received and written to disk. Fed from
+    `request.stream()`, this writes every file part straight to its staging
+    path while the body arrives and stops writing a part as soon as it
+    exceeds UPLOAD_MAX_BYTES. Form fields other than files are ignored.
+    """
+
+    def __init__(self, content_type: str):
+        ctype, params = parse_options_header(content_type)
+        if ctype != b"multipart/form-data" or not params.get(b"boundary"):
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+        self.uploads = []
+        self._part = None
+        self._headers, self._field, self._value = {}, b"", b""
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers, self._field, self._value = {}, b"", b""
+
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = os.path.basename(params.get(b"filename", b"").decode("utf-8"))
+        self._part = StagedUpload(filename) if filename else None
+        if self._part is not None:
+            self.uploads.append(self._part)
+
+    def _on_part_data(self, data, start, end):
+        if self._part is not None:
+            self._part.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._part is not None:
+            self._part.close()
+        self._part = None
+
+    def write(self, block: bytes):
+        self._parser.write(block)
+
+    def finalize(self):
+        self._parser.finalize()
+
+    def discard(self):
+        for upload in self.uploads:
+            upload.discard()
+
+
+async def receive_uploads(request: Request, single: bool = False):
+    """
+    Parse the upload body while it is received, UPLOAD_BLOCK_BYTES at a time
+    (parsing and disk writes run off the event loop). Returns the
+    `StagedUpload`s, oversized ones flagged with an `error`. With `single`,
+    an oversized file aborts the request with 413 at once, and a declared
+    Content-Length beyond the limit is refused before reading anything.
+    """
+    if single and int(request.headers.get("content-length") or 0) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+    receiver = UploadReceiver(request.headers.get("content-type", ""))
     try:
-        shutil.move(tmp_path, os.path.join(paths.data_path, file.filename))
-    except Exception as e:
-        # If move fails, don’t block the API call; just log.
-        print(f"Warning: could not move file {file.filename}: {e}")
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= UPLOAD_BLOCK_BYTES:
+                await asyncio.to_thread(receiver.write, bytes(buffer))
+                buffer.clear()
+                if single and any(upload.error for upload in receiver.uploads):
+                    raise HTTPException(status_code=413, detail=receiver.uploads[-1].error)
+        await asyncio.to_thread(receiver.write, bytes(buffer))
+        await asyncio.to_thread(receiver.finalize)
+    except BaseException:
+        await asyncio.to_thread(receiver.discard)
+        raise
+    if not receiver.uploads:
+        raise HTTPException(status_code=400, detail="No file in the request")
+    if single and receiver.uploads[0].error:
+        raise HTTPException(status_code=413, detail=receiver.uploads[0].error)
+    return receiver.uploads
+
+
+def job_finished(job_id: str, tmp_path: str, future):
+    """Mark the job failed if it never ran (cancelled at shutdown) or its worker process died before reporting."""
+    if future.cancelled():
+        error = "cancelled at API shutdown"
+    elif isinstance(future.exception(), BrokenProcessPool):
+        error = "ingestion worker crashed"
+    else:
+        return
+    job_store.update(job_id, status=ingest_jobs.FAILED, error=error)
+    ingest_jobs.discard_staged(tmp_path)
+
+
+async def enqueue_upload(upload: StagedUpload) -> dict:
+    """Queue the ingestion job of a received upload."""
+    await asyncio.to_thread(job_store.create, upload.filename, upload.job_id, size=upload.size, sha256=upload.digest)
+
+    data_file = os.path.join(paths.data_path, upload.filename)
+    future = asyncio.get_running_loop().run_in_executor(
+        ingest_pool, ingest_jobs.run_job, upload.job_id, upload.path, data_file, upload.digest
+    )
+    future.add_done_callback(partial(job_finished, upload.job_id, upload.path))
+    return {"job_id": upload.job_id, "filename": upload.filename, "size": upload.size, "status": ingest_jobs.QUEUED}
 
-    return {"message": "File uploaded and indexed.", "filename": file.filename}
 
+@app.post("/upload")
+async def upload_file(request: Request):
+    """
+    Store the file (multipart field "file") and return at once: extraction,
+    embedding and indexing run in an ingestion worker process. Poll
+    /upload/jobs/{job_id}.
+    """
+    uploads = await receive_uploads(request, single=True)
+    for extra in uploads[1:]:  # one file per request here, see /upload/bulk
+        await asyncio.to_thread(extra.discard)
+    job = await enqueue_upload(uploads[0])
+    return {"message": "File uploaded, indexing queued.", **job}
+
+
+@app.post("/upload/bulk")
+async def upload_files(request: Request):
+    """Same as /upload for many files in one request (field "files", one job per file)."""
+    jobs = []
+    for upload in await receive_uploads(request):
+        if upload.error:  # one oversized file does not reject the others
+            jobs.append({"filename": upload.filename, "status": "rejected", "error": upload.error})
+        else:
+            jobs.append(await enqueue_upload(upload))
+    return {"message": f"{len(jobs)} file(s) uploaded, indexing queued.", "jobs": jobs}
+
+
+@app.get("/upload/jobs/{job_id}")
+async def upload_job_status(job_id: str):
+    """Job status: queued / extracting / embedding / done / failed, with chunk progress."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+
+@app.get("/upload/jobs")
+async def upload_jobs(limit: int = 50):
+    return {"jobs": await asyncio.to_thread(job_store.recent, limit)}
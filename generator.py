@@ -1,22 +1,36 @@
 import paths
 import redis_db
+import metrics_rollup
+import metrics
 from langchain_community.chat_models import ChatLlamaCpp
-from langchain_core.messages import HumanMessage, SystemMessage, trim_messages
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, trim_messages
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
 import asyncio
+import os
 import time
-import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from prompt_budget import PromptBudget
+from prefix_cache import SharedPrefixCache, enable_prefix_cache, warm_system_prefix
 
 
-# Initialize Redis Client
-redis_client = redis_db.create_redis_client()
+# Initialize Redis Client (asyncio: the chat path runs on the API event loop)
+redis_client = redis_db.create_async_redis_client()
 
+# sessions whose decoded history tail is kept in memory
+HISTORY_SESSIONS = int(os.getenv("HISTORY_SESSIONS", 1024))
+_chat_histories = OrderedDict()  # session_id -> RedisChatMessageHistory
 
+# generator pool sizing (instances x threads should not exceed the physical cores)
+GENERATOR_INSTANCES = int(os.getenv("GENERATOR_INSTANCES", 1))
+GENERATOR_THREADS = int(os.getenv("GENERATOR_THREADS", 2))
 
 
-def get_model():
+
+
+def get_model(n_threads: int = GENERATOR_THREADS):
     """Creates and returns the LlamaCpp model."""
     llm_langchain = ChatLlamaCpp(
         model_path=paths.generator_model_path,
@@ -24,16 +38,91 @@ def get_model():
         temperature=0.01,
         max_tokens=512,
         top_p=1,
-        n_threads=2
+        n_threads=n_threads,
+        use_mmap=True,  # weights are mapped once by the OS and shared by every instance
     )
     return llm_langchain
 
 
 
 
-def get_chain_generator(generator):
-    """Creates the retrieval and response generation pipeline."""
-    SYSTEM_TEMPLATE = """
+class GeneratorInstance:
+    """One llama.cpp model + its document chain, with utilisation counters."""
+
+    def __init__(self, idx: int, n_threads: int = GENERATOR_THREADS, prefix_cache=None):
+        self.idx = idx
+        self.model = get_model(n_threads)
+        self.chain = get_chain_generator(self.model)
+        self.budget = PromptBudget(self.model, SYSTEM_TEMPLATE)
+        self.prefill = enable_prefix_cache(self.model, prefix_cache or SharedPrefixCache())
+        self.created = time.monotonic()
+        self.jobs = 0
+        self.busy_time = 0.0
+        self.busy_since = None
+
+    @asynccontextmanager
+    async def busy(self):
+        self.busy_since = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.busy_time += time.monotonic() - self.busy_since
+            self.busy_since = None
+            self.jobs += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        busy = self.busy_time + (now - self.busy_since if self.busy_since else 0.0)
+        return {
+            "instance": self.idx,
+            "busy": self.busy_since is not None,
+            "jobs": self.jobs,
+            "busy_seconds": round(busy, 3),
+            "utilization": round(busy / max(now - self.created, 1e-9), 4),
+        }
+
+
+class GeneratorPool:
+    """
+    A fixed set of generator instances sharing the mmap'd GGUF weights.
+
+    Scheduling is done by the server: one worker per instance pulls from the
+    shared chat queue, so each job goes to the first instance that is free.
+    The instances share one KV prefix cache, warmed with the static part of
+    the system prompt. The pool keeps the queue-wait statistics of
+    dispatched jobs.
+    """
+
+    def __init__(self, n_instances: int = GENERATOR_INSTANCES, n_threads: int = GENERATOR_THREADS):
+        self.prefix_cache = SharedPrefixCache()
+        self.instances = [
+            GeneratorInstance(i, n_threads, self.prefix_cache) for i in range(max(1, n_instances))
+        ]
+        warm_system_prefix(self.instances[0].model, SYSTEM_TEMPLATE.split("{context}")[0])
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.waits += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self, queued: int = 0) -> dict:
+        return {
+            "instances": [inst.stats() for inst in self.instances],
+            "queued": queued,
+            "queue_wait": {
+                "count": self.waits,
+                "avg_seconds": self.wait_total / self.waits if self.waits else 0.0,
+                "max_seconds": self.wait_max,
+            },
+        }
+
+
+
+
+SYSTEM_TEMPLATE = """
         Answer the user's questions based on the below context. 
         If the context doesn't contain relevant information, just say "I don't know".
 
@@ -42,6 +131,9 @@ def get_chain_generator(generator):
         </context>
     """
 
+
+def get_chain_generator(generator):
+    """Creates the retrieval and response generation pipeline."""
     question_answering_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", SYSTEM_TEMPLATE),
@@ -56,74 +148,221 @@ def get_chain_generator(generator):
 
 
 def get_chat_hist_instance(session_id):
-    """Fetches chat history from Redis for the given session."""
-    return redis_db.get_chat_history(redis_client, session_id)
+    """
+    Chat history of the session in Redis. Instances are kept (LRU) so their
+    decoded tail of messages is reused from one turn to the next.
+    """
+    history = _chat_histories.pop(session_id, None)
+    if history is None:
+        history = redis_db.get_chat_history(redis_client, session_id)
+    _chat_histories[session_id] = history
+    while len(_chat_histories) > HISTORY_SESSIONS:
+        _chat_histories.popitem(last=False)
+    return history
+
+
 
 
+SYSTEM_PROMPT_CONTENT = (
+    "You are a highly helpful assistant, and your name is llama_chat. "
+    "Your answers will be concise and direct. "
+    "If the provided context lacks relevant information, you may answer without it."
+)
 
 
-async def generate_chat_st(user_input, generator_chain, chat_history_instance):
+async def prepare_history(user_input, chat_history_instance, budget=None):
     """
-    Generates chatbot responses asynchronously.
-    Uses history stored in Redis for continuity.
+    Return (trimmed history ending with the new user turn, that user message),
+    token-accurate when a `PromptBudget` is given. Nothing is written here:
+    the user turn is persisted together with the answer (`persist_turn`).
     """
 
-    system_prompt_content = (
-        "You are a highly helpful assistant, and your name is llama_chat. "
-        "Your answers will be concise and direct. "
-        "If the provided context lacks relevant information, you may answer without it."
-    )
-
-    # Add system message if not already present
-    if not any(isinstance(msg, SystemMessage) for msg in chat_history_instance.messages):
-        system_message = SystemMessage(content=system_prompt_content)
-        chat_history_instance.add_message(system_message)
+    # System message first (stored once per session, with the first answer)
+    with metrics.redis_time.time(op="history_read"):
+        messages = await chat_history_instance.aget_messages()
+    if not messages or not isinstance(messages[0], SystemMessage):
+        messages = [SystemMessage(content=SYSTEM_PROMPT_CONTENT)] + messages
 
     # Add user message
     user_message = HumanMessage(content=user_input)
-    chat_history_instance.add_message(user_message)
-
-    # Trim history to manage token limits
-    history = trim_messages(
-        chat_history_instance.messages,
+    messages = messages + [user_message]
+
+    # Trim history to manage token limits (only the tail window is read from Redis);
+    # tokenizing is CPU work, kept off the event loop
+    if budget is not None:
+        return await asyncio.to_thread(budget.trim_history, messages), user_message
+    return trim_messages(
+        messages,
         strategy="last",
         start_on="human",
         end_on=("human", "tool"),
         token_counter=len,
         include_system=True,
         max_tokens=15,
-    )
+    ), user_message
+
+
+async def persist_turn(chat_history_instance, user_message, response, elapsed, stages=None, **extra):
+    """
+    Persist the whole turn in a single MULTI round trip: the system message
+    (once per session), the user message, the answer with its duration and
+    the dashboard rollups. `stages` maps a stage ("retrieval", "generation")
+    to its duration, recorded in the latency histograms with the total.
+    """
+    day = datetime.utcnow().date()
+    turn = [(user_message, {}), (AIMessage(content=response), {"duration": elapsed, **extra})]
+
+    pipe = chat_history_instance.redis_client.pipeline(transaction=True)
+    chat_history_instance.queue_system(pipe, SYSTEM_PROMPT_CONTENT)
+    chat_history_instance.queue_messages(pipe, turn)
+    # dashboard rollups (day/week/month, O(1) per answer)
+    metrics_rollup.record_latency(pipe, "total", elapsed, day)
+    for stage, seconds in (stages or {}).items():
+        if seconds is not None:
+            metrics_rollup.record_latency(pipe, stage, seconds, day)
+    metrics_rollup.record_response(pipe, day)
+    with metrics.redis_time.time(op="turn_write"):
+        replies = await pipe.execute()
+
+    metrics.chat_requests.inc(cached="true" if extra.get("cached") else "false")
+    metrics.chat_stage.observe(elapsed, stage="total")
+    for stage, seconds in (stages or {}).items():
+        if seconds is not None:
+            metrics.chat_stage.observe(seconds, stage=stage)
+    chat_history_instance.record_appends(turn, replies[1:1 + len(turn)])
+
+
+async def cached_answer(semantic_cache, question, docs):
+    """Semantic-cache lookup (None without a cache), timed as Redis time."""
+    if semantic_cache is None:
+        return None
+    with metrics.redis_time.time(op="semantic_cache_lookup"):
+        return await semantic_cache.lookup(question, docs)
+
+
+async def cache_answer(semantic_cache, question, docs, answer):
+    """Semantic-cache store (no-op without a cache), timed as Redis time."""
+    if semantic_cache is None:
+        return
+    with metrics.redis_time.time(op="semantic_cache_store"):
+        await semantic_cache.store(question, docs, answer)
+
+
+def fit_prompt(budget, history, docs):
+    """Fit the retrieved chunks into the prompt budget and log the prompt size."""
+    if budget is None:
+        return docs, None
+    docs, stats = budget.fit_context(history, docs)
+    print(f"Prompt tokens : {stats['total']} (system {stats['system']}, history {stats['history']}, "
+          f"context {stats['context']}, chunks {stats['chunks']})")
+    return docs, stats["total"]
+
+
+def report_prefill(prefill):
+    """Log how much of the last prompt came from the KV cache, and export the prefill/decode metrics."""
+    if prefill is None:
+        return None
+    stats = prefill.last()
+    print(f"Prefill tokens : {stats['new_tokens']} new, {stats['cached_tokens']} cached "
+          f"(prompt {stats['prompt_tokens']})")
+    metrics.prompt_tokens.observe(stats["prompt_tokens"])
+    metrics.prefill_tokens.inc(stats["new_tokens"], kind="new")
+    metrics.prefill_tokens.inc(stats["cached_tokens"], kind="cached")
+    metrics.prefill.observe(stats["prefill_seconds"])
+    metrics.decode_tokens.inc(stats["decode_tokens"])
+    if stats["decode_seconds"] > 0:
+        metrics.decode_rate.observe(stats["decode_tokens"] / stats["decode_seconds"])
+    return stats
+
+
+async def generate_chat_st(user_input, generator_chain, chat_history_instance, retriever=None, semantic_cache=None, budget=None, prefill=None):
+    """
+    Generates chatbot responses asynchronously.
+    Uses history stored in Redis for continuity.
+
+    With a `retriever`, `generator_chain` is the document chain: the context is
+    retrieved here first, so that a `semantic_cache` can serve a stored answer
+    for a near-identical question asked against the same chunks, skipping the
+    LLM entirely. Without it, `generator_chain` is the full retrieval chain.
+    A `budget` (PromptBudget) trims history and context by real token counts;
+    a `prefill` meter reports cached vs new prefill tokens.
+
+    Returns (answer, duration): the answer is already persisted, no need to
+    read it back from Redis.
+    """
+    history, user_message = await prepare_history(user_input, chat_history_instance, budget)
 
     #  Ensure `ainvoke()` is awaited properly
     start = time.time()
-    response_dict = await asyncio.ensure_future(generator_chain.ainvoke({"messages": history}))
+    cached = False
+    prompt_tokens = None
+    prefill_stats = None
+    stages = {}
+    if retriever is None:
+        response_dict = await asyncio.ensure_future(generator_chain.ainvoke({"messages": history}))
+        response = response_dict["answer"]
+    else:
+        docs = await retriever.ainvoke(user_input)
+        stages["retrieval"] = time.time() - start
+        response = await cached_answer(semantic_cache, user_input, docs)
+        cached = response is not None
+        if not cached:
+            context, prompt_tokens = await asyncio.to_thread(fit_prompt, budget, history, docs)
+            generation_start = time.time()
+            response = await generator_chain.ainvoke({"messages": history, "context": context})
+            stages["generation"] = time.time() - generation_start
+            prefill_stats = report_prefill(prefill)
+            await cache_answer(semantic_cache, user_input, docs, response)
     end = time.time()
     elapsed = end - start
-    response = response_dict["answer"]
-
-    # Save response in chat history
-    #chat_history_instance.add_ai_message(response)
-
-    # Persist message assistant *une seule fois* dans Redis,
-    # avec le champ duration en secondes (float).
-    key = chat_history_instance.key  # e.g. "chat_history:<session_id>"
-    data = {
-        "role": "assistant",
-        "content": response,
-        "duration": elapsed
-    }
-    chat_history_instance.redis_client.rpush(key, json.dumps(data))
-
-    # duration store for the dashboard
-    date_str = datetime.utcnow().date().isoformat()
-    chat_history_instance.redis_client.rpush(
-        f"response_times:{date_str}",
-        elapsed
-    )
 
-    # daily user counter AI increase
-    chat_history_instance.redis_client.incr(f"responses:{date_str}")
+    await persist_turn(chat_history_instance, user_message, response, elapsed, stages,
+                   cached=cached or None, prompt_tokens=prompt_tokens, prefill=prefill_stats)
 
+    return response , elapsed
 
-    return chat_history_instance , elapsed
 
+async def generate_chat_stream(user_input, generator_chain, chat_history_instance, retriever, semantic_cache=None, budget=None, prefill=None):
+    """
+    Streaming variant of `generate_chat_st`: yields the answer token by token
+    as llama.cpp produces them. Once the answer is complete it is persisted
+    like in `generate_chat_st`, with the time-to-first-token (``ttft``).
+    The last item yielded is a dict {"duration", "ttft", "cached", "prompt_tokens", "prefill"}.
+    """
+    history, user_message = await prepare_history(user_input, chat_history_instance, budget)
+
+    start = time.time()
+    ttft = None
+    prompt_tokens = None
+    prefill_stats = None
+    stages = {}
+    docs = await retriever.ainvoke(user_input)
+    stages["retrieval"] = time.time() - start
+    response = await cached_answer(semantic_cache, user_input, docs)
+    cached = response is not None
+
+    if cached:
+        ttft = time.time() - start
+        yield response
+    else:
+        parts = []
+        context, prompt_tokens = await asyncio.to_thread(fit_prompt, budget, history, docs)
+        generation_start = time.time()
+        async for token in generator_chain.astream({"messages": history, "context": context}):
+            if not token:
+                continue
+            if ttft is None:
+                ttft = time.time() - start
+            parts.append(token)
+            yield token
+        response = "".join(parts)
+        stages["generation"] = time.time() - generation_start
+        prefill_stats = report_prefill(prefill)
+        await cache_answer(semantic_cache, user_input, docs, response)
+    elapsed = time.time() - start
+
+    await persist_turn(chat_history_instance, user_message, response, elapsed, stages,
+                   ttft=ttft, cached=cached or None, prompt_tokens=prompt_tokens, prefill=prefill_stats)
+
+    yield {"duration": elapsed, "ttft": ttft, "cached": cached,
+           "prompt_tokens": prompt_tokens, "prefill": prefill_stats}
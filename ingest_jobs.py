@@ -0,0 +1,189 @@
+import paths
+import os
+import shutil
+from time import time
+from uuid import uuid4
+
+import clients
+import redis_db
+import metrics
+import preprocess
+from manifest import IngestManifest, NEW, CHANGED
+from retriever import load_vectorstore
+
+
+# processes running ingestion jobs next to the API
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", 2))
+# how long a finished job's status stays queryable
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", 7 * 24 * 3600))
+# ids kept in the "recent jobs" list
+RECENT_JOBS = 200
+
+PREFIX = "ingest"
+
+QUEUED = "queued"
+EXTRACTING = "extracting"
+EMBEDDING = "embedding"
+DONE = "done"
+FAILED = "failed"
+# a job in one of these states is owned by a live worker process
+UNFINISHED = (QUEUED, EXTRACTING, EMBEDDING)
+
+INT_FIELDS = ("chunks", "chunks_done", "chunks_added", "size")
+FLOAT_FIELDS = ("created", "updated")
+
+
+class JobStore:
+    """
+    Status of ingestion jobs in Redis.
+
+    Keys:
+    • ``ingest:job:<id>``  hash {id, filename, size, sha256, status, chunks,
+      chunks_done, chunks_added, error, created, updated}, with a TTL;
+    • ``ingest:jobs``      list of the most recent job ids (newest first).
+    """
+
+    def __init__(self, redis_client, ttl: int = INGEST_JOB_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def create(self, filename: str, job_id: str = None, **fields) -> str:
+        job_id = job_id or uuid4().hex
+        now = time()
+        pipe = self.redis_client.pipeline()
+        pipe.hset(f"{PREFIX}:job:{job_id}", mapping={
+            "id": job_id,
+            "filename": filename,
+            "status": QUEUED,
+            "chunks": 0,
+            "chunks_done": 0,
+            "created": now,
+            "updated": now,
+            **fields,
+        })
+        pipe.expire(f"{PREFIX}:job:{job_id}", self.ttl)
+        pipe.lpush(f"{PREFIX}:jobs", job_id)
+        pipe.ltrim(f"{PREFIX}:jobs", 0, RECENT_JOBS - 1)
+        pipe.execute()
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        self.redis_client.hset(f"{PREFIX}:job:{job_id}", mapping={**fields, "updated": time()})
+
+    def get(self, job_id: str):
+        raw = self.redis_client.hgetall(f"{PREFIX}:job:{job_id}")
+        if not raw:
+            return None
+        job = dict(raw)
+        for field in INT_FIELDS:
+            if field in job:
+                job[field] = int(job[field])
+        for field in FLOAT_FIELDS:
+            if field in job:
+                job[field] = float(job[field])
+        return job
+
+    def recent(self, n: int = 50):
+        ids = self.redis_client.lrange(f"{PREFIX}:jobs", 0, n - 1)
+        return [job for job in (self.get(job_id) for job_id in ids) if job is not None]
+
+    def fail_unfinished(self, error: str) -> int:
+        """
+        Mark failed the recent jobs still queued or running and drop their
+        staged upload. Called at API startup: the worker pool of the previous
+        run is gone, so nothing will ever finish them. Returns their number.
+        """
+        failed = 0
+        for job in self.recent(RECENT_JOBS):
+            if job.get("status") in UNFINISHED:
+                self.update(job["id"], status=FAILED, error=error)
+                discard_staged(staging_path(job["id"], job["filename"]))
+                failed += 1
+        return failed
+
+
+def staging_path(job_id: str, filename: str) -> str:
+    """Where the API stores an upload until its job has indexed it."""
+    os.makedirs(paths.ingest_staging_path, exist_ok=True)
+    return os.path.join(paths.ingest_staging_path, f"{job_id}-{filename}")
+
+
+def discard_staged(tmp_path: str):
+    """Remove the staged upload of a job that will not move it to the data folder."""
+    if os.path.exists(tmp_path):
+        try:
+            os.remove(tmp_path)
+        except OSError as e:
+            print(f"Could not remove staged file {tmp_path}: {e}")
+
+
+# ---------------------------------------------------------------------- #
+# worker-process side
+# ---------------------------------------------------------------------- #
+_worker = {}  # per-process state, built by the first job
+
+
+def _worker_state() -> dict:
+    if not _worker:
+        indexes = preprocess.LocalIndexes()
+        _worker["indexes"] = indexes
+        _worker["vectorstore"] = load_vectorstore(clients.get_embedding_model(), chunk_store=indexes.chunk_store)
+        _worker["jobs"] = JobStore(redis_db.create_redis_client())
+    return _worker
+
+
+def run_job(job_id: str, tmp_path: str, data_file: str, digest: str = None,
+            chunk_size: int = 20000, overlap: int = 2000) -> int:
+    """
+    Process-pool task: index one uploaded file, then move it to `data_file`.
+    `digest` is its SHA-256, computed while it was received.
+
+    Extraction and embedding run without any lock, so several workers make
+    progress at once; embeddings land in the on-disk embedding cache. Only
+    the write (manifest, collection, local indexes) happens under
+    `preprocess.ingest_lock()`, where the batches are served from that cache.
+    The staged file is removed if the job fails. Returns the number of
+    chunks added.
+    """
+    state = _worker_state()
+    jobs = state["jobs"]
+    vectorstore = state["vectorstore"]
+    start = time()
+    try:
+        prepared = {}
+        status, _, _ = IngestManifest().classify(tmp_path, data_file, digest=digest)
+        if status in (NEW, CHANGED):
+            jobs.update(job_id, status=EXTRACTING)
+            chunks = list(preprocess.iter_file_chunks(tmp_path, chunk_size, overlap, source=data_file))
+            prepared[tmp_path] = chunks
+
+            jobs.update(job_id, status=EMBEDDING, chunks=len(chunks))
+            batch = preprocess.EMBED_BATCH_SIZE
+            for offset in range(0, len(chunks), batch):
+                vectorstore.embeddings.embed_documents([d.page_content for d in chunks[offset:offset + batch]])
+                jobs.update(job_id, chunks_done=min(offset + batch, len(chunks)))
+
+        with preprocess.ingest_lock():
+            state["indexes"].refresh()
+            n_chunks = preprocess.sync_files(
+                vectorstore,
+                [tmp_path],
+                IngestManifest(),
+                sources={tmp_path: data_file},
+                workers=1,
+                indexes=state["indexes"],
+                prepared=prepared,
+                digests={tmp_path: digest},
+            )
+        shutil.move(tmp_path, data_file)
+        jobs.update(job_id, status=DONE, chunks_added=n_chunks)
+        metrics.record_ingest(jobs.redis_client, n_chunks, time() - start)
+        print(f"Ingestion job {job_id} ({os.path.basename(data_file)}) : {n_chunks} chunks added")
+        return n_chunks
+    except Exception as e:
+        print(f"Ingestion job {job_id} failed: {e}")
+        jobs.update(job_id, status=FAILED, error=str(e))
+        raise
+    finally:
+        # moved to the data folder on success; a failed upload must not stay staged
+        discard_staged(tmp_path)
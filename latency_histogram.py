@@ -0,0 +1,86 @@
+import os
+import math
+from bisect import bisect_left
+
+
+# chat stages whose latency is recorded per day
+STAGES = ("total", "retrieval", "generation")
+
+# bucket upper bounds in seconds: geometric from 5 ms, each bucket 20 % wider
+# than the previous one (about ±10 % error on a percentile), up to ~10 min;
+# the last bucket catches everything above
+LATENCY_MIN = float(os.getenv("LATENCY_MIN", 0.005))
+LATENCY_GROWTH = float(os.getenv("LATENCY_GROWTH", 1.2))
+LATENCY_BUCKETS = int(os.getenv("LATENCY_BUCKETS", 65))
+BOUNDS = [LATENCY_MIN * LATENCY_GROWTH ** i for i in range(LATENCY_BUCKETS)]
+
+PREFIX = "latency"
+
+
+def histogram_key(stage: str, period: str) -> str:
+    return f"{PREFIX}:{stage}:{period}"
+
+
+def bucket_of(seconds: float) -> int:
+    """Index of the bucket holding `seconds` (len(BOUNDS) for the overflow bucket)."""
+    return bisect_left(BOUNDS, seconds)
+
+
+def record(pipe, stage: str, seconds: float, period: str):
+    """
+    Queue the O(1) update of the `stage` histogram of `period` (a day, week or
+    month label) on a Redis pipeline: one HINCRBY on the bucket, plus the
+    count and sum (for the mean).
+
+    Hash ``latency:<stage>:<period>``: {"<bucket>": count, "count": n, "sum": seconds}.
+    """
+    key = histogram_key(stage, period)
+    pipe.hincrby(key, str(bucket_of(seconds)), 1)
+    pipe.hincrby(key, "count", 1)
+    pipe.hincrbyfloat(key, "sum", seconds)
+
+
+def merge(raws) -> dict:
+    """Sum HGETALL replies of several histograms (e.g. several days) into one."""
+    merged = {}
+    for raw in raws:
+        for field, value in (raw or {}).items():
+            merged[field] = merged.get(field, 0) + float(value)
+    return merged
+
+
+def percentile(raw: dict, q: float):
+    """
+    `q`-quantile of a histogram (HGETALL reply), in seconds: the geometric
+    middle of the bucket it falls in. None when the histogram is empty.
+    """
+    total = float(raw.get("count", 0))
+    if not total:
+        return None
+    counts = sorted((int(field), float(n)) for field, n in raw.items() if field.isdigit())
+    if not counts:
+        return None
+    rank = q * total
+    seen = 0.0
+    for bucket, n in counts:
+        seen += n
+        if seen >= rank:
+            break
+    upper = BOUNDS[bucket] if bucket < len(BOUNDS) else BOUNDS[-1] * LATENCY_GROWTH
+    lower = BOUNDS[bucket - 1] if bucket > 0 else 0.0
+    return math.sqrt(lower * upper) if lower else upper / 2
+
+
+def summarize(raw: dict) -> dict:
+    """{"count", "mean", "p50", "p90", "p99"} of a histogram (HGETALL reply)."""
+    count = int(float(raw.get("count", 0))) if raw else 0
+    if not count:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None}
+    return {
+        "count": count,
+        "mean": float(raw["sum"]) / count,
+        "p50": percentile(raw, 0.5),
+        "p90": percentile(raw, 0.9),
+        "p99": percentile(raw, 0.99),
+    }
+
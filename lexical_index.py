@@ -0,0 +1,400 @@
+import paths
+import os
+import re
+import math
+import heapq
+import pickle
+import threading
+from uuid import uuid4
+from array import array
+from collections import Counter
+
+
+TOKEN_PATTERN = re.compile(r"\w+", flags=re.UNICODE)
+
+# the update log is folded into a new snapshot once it reaches this share of the snapshot size
+LOG_COMPACT_RATIO = float(os.getenv("LEXICAL_LOG_COMPACT_RATIO", 0.25))
+
+
+def tokenize(text: str):
+    """Lower-cased word tokens (the same analyser for indexing and querying)."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class _PickledIndex:
+    """
+    Persistence shared by the lexical indexes: a pickled snapshot plus an
+    append-only log of the updates made since (add / remove / set_source).
+
+    `save()` only appends the pending updates to the log, so an ingest costs
+    its delta, not the corpus; the log is folded into a new snapshot once it
+    outgrows LOG_COMPACT_RATIO of it (or after `clear()` / `rebuild_from()`).
+    `reload_if_changed()` replays what another process appended and reloads
+    the snapshot only when it was replaced. A snapshot names its own log
+    (``<index>.<id>.log``), so the two always match.
+
+    Subclasses implement `_add`, `_remove`, `_set_source`, `_clear` and the
+    snapshot state (`_get_state` / `_set_state`).
+    """
+
+    path: str
+
+    def _init_persistence(self):
+        self._lock = threading.RLock()
+        self._pending = []      # updates not saved yet
+        self._rewrite = False   # cleared / rebuilt: the next save writes a snapshot
+        self._log_name = None   # log of the loaded snapshot
+        self._log_pos = 0
+        self._version = None    # (mtime, inode) of the loaded snapshot
+        self.load()
+
+    def _get_state(self) -> dict:
+        raise NotImplementedError
+
+    def _set_state(self, state: dict):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------ #
+    # updates
+    # ------------------------------------------------------------------ #
+    def _log(self, op):
+        if not self._rewrite:  # a full snapshot is due anyway
+            self._pending.append(op)
+
+    def add(self, chunk_id: str, text: str, source: str = None):
+        with self._lock:
+            self._add(chunk_id, text, source)
+            self._log(("add", chunk_id, text, source))
+
+    def add_documents(self, docs, ids):
+        for doc, chunk_id in zip(docs, ids):
+            self.add(chunk_id, doc.page_content, doc.metadata.get("source"))
+
+    def remove(self, ids):
+        ids = list(ids)
+        with self._lock:
+            self._remove(ids)
+            self._log(("remove", ids))
+
+    def set_source(self, ids, source: str):
+        ids = list(ids)
+        with self._lock:
+            self._set_source(ids, source)
+            self._log(("source", ids, source))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+            self._pending = []
+            self._rewrite = True
+
+    def rebuild_from(self, chunk_store):
+        """Index every live chunk of a `ChunkStore` (one chunk in memory at a time)."""
+        self.clear()
+        for chunk_id, doc in chunk_store.iter_chunks():
+            self.add(chunk_id, doc.page_content, doc.metadata.get("source"))
+
+    def _apply(self, op):
+        if op[0] == "add":
+            self._add(*op[1:])
+        elif op[0] == "remove":
+            self._remove(op[1])
+        elif op[0] == "source":
+            self._set_source(*op[1:])
+
+    # ------------------------------------------------------------------ #
+    # persistence
+    # ------------------------------------------------------------------ #
+    def _log_path(self) -> str:
+        return os.path.join(os.path.dirname(self.path), self._log_name)
+
+    def load(self):
+        """(Re)load the snapshot, then replay its log."""
+        try:
+            st = os.stat(self.path)
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Unreadable index {self.path}, starting from scratch: {e}")
+            return
+        with self._lock:
+            self._set_state(state)
+            self._log_name = state.get("log")
+            self._log_pos = 0
+            self._version = (st.st_mtime_ns, st.st_ino)
+            self._pending = []
+            self._rewrite = False
+            self._replay()
+
+    def _replay(self):
+        """Apply the log records appended since the last call (possibly by another process)."""
+        if self._log_name is None:
+            return
+        try:
+            if os.path.getsize(self._log_path()) == self._log_pos:
+                return
+            f = open(self._log_path(), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self._log_pos)
+            while True:
+                try:
+                    ops = pickle.load(f)
+                except Exception:
+                    break  # end of the log, or a record still being written: next time
+                for op in ops:
+                    self._apply(op)
+                self._log_pos = f.tell()
+
+    def save(self):
+        """Append the pending updates to the log (writers hold `ingest_lock`, after a refresh)."""
+        with self._lock:
+            if self._rewrite or self._log_name is None or not os.path.exists(self.path):
+                self._write_snapshot()
+                return
+            if not self._pending:
+                return
+            with open(self._log_path(), "ab") as f:
+                pickle.dump(self._pending, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self._log_pos = f.tell()
+            self._pending = []
+            if self._log_pos > LOG_COMPACT_RATIO * os.path.getsize(self.path):
+                self._write_snapshot()
+
+    def _write_snapshot(self):
+        """Fold everything into a new snapshot with an empty log, replacing the old pair."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._log_name = f"{os.path.basename(self.path)}.{uuid4().hex[:12]}.log"
+        open(self._log_path(), "wb").close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({**self._get_state(), "log": self._log_name}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._version = (st.st_mtime_ns, st.st_ino)
+        self._log_pos = 0
+        self._pending = []
+        self._rewrite = False
+        # logs of the previous snapshots are never read again
+        prefix = f"{os.path.basename(self.path)}."
+        for name in os.listdir(os.path.dirname(self.path)):
+            if name.startswith(prefix) and name.endswith(".log") and name != self._log_name:
+                try:
+                    os.remove(os.path.join(os.path.dirname(self.path), name))
+                except OSError:
+                    pass  # still open by a reader (Windows): removed by a later snapshot
+
+    def reload_if_changed(self):
+        """Pick up another process's updates: replay its appends, reload a replaced snapshot."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (st.st_mtime_ns, st.st_ino) != self._version:
+            self.load()
+        else:
+            with self._lock:
+                self._replay()
+
+
+class BM25Index(_PickledIndex):
+    """
+    In-process BM25 inverted index over the chunk store.
+
+    Postings map a term to {chunk_id: term frequency}; documents can be added
+    and removed one at a time, so ingestion updates it incrementally instead
+    of rebuilding. It is persisted to `path` as a snapshot plus an update log
+    (see `_PickledIndex`), and `reload_if_changed()` lets a long-running
+    process pick up what another one (the ingest CLI) wrote.
+    """
+
+    def __init__(self, path: str = paths.bm25_index_path, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings = {}     # term -> {chunk_id: tf}
+        self.doc_len = {}      # chunk_id -> number of tokens
+        self.doc_terms = {}    # chunk_id -> distinct terms (for removal)
+        self.doc_source = {}   # chunk_id -> source
+        self.total_len = 0
+        self._init_persistence()
+
+    # ------------------------------------------------------------------ #
+    # persistence
+    # ------------------------------------------------------------------ #
+    def _get_state(self) -> dict:
+        return {
+            "postings": self.postings,
+            "doc_len": self.doc_len,
+            "doc_terms": self.doc_terms,
+            "doc_source": self.doc_source,
+        }
+
+    def _set_state(self, state: dict):
+        self.postings = state["postings"]
+        self.doc_len = state["doc_len"]
+        self.doc_terms = state["doc_terms"]
+        self.doc_source = state["doc_source"]
+        self.total_len = sum(self.doc_len.values())
+
+    # ------------------------------------------------------------------ #
+    # updates
+    # ------------------------------------------------------------------ #
+    def _add(self, chunk_id: str, text: str, source: str = None):
+        if chunk_id in self.doc_len:
+            self._remove([chunk_id])
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(counts.values())
+        self.doc_len[chunk_id] = length
+        self.doc_terms[chunk_id] = list(counts)
+        self.doc_source[chunk_id] = source
+        self.total_len += length
+
+    def _remove(self, ids):
+        for chunk_id in ids:
+            if chunk_id not in self.doc_len:
+                continue
+            for term in self.doc_terms.pop(chunk_id):
+                plist = self.postings.get(term)
+                if plist is not None:
+                    plist.pop(chunk_id, None)
+                    if not plist:
+                        del self.postings[term]
+            self.total_len -= self.doc_len.pop(chunk_id)
+            self.doc_source.pop(chunk_id, None)
+
+    def _set_source(self, ids, source: str):
+        for chunk_id in ids:
+            if chunk_id in self.doc_source:
+                self.doc_source[chunk_id] = source
+
+    def _clear(self):
+        self.postings, self.doc_len, self.doc_terms, self.doc_source = {}, {}, {}, {}
+        self.total_len = 0
+
+    # ------------------------------------------------------------------ #
+    # search
+    # ------------------------------------------------------------------ #
+    def search(self, query: str, k: int = 20):
+        """Return [(chunk_id, score)] of the `k` best chunks for `query`."""
+        with self._lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return []
+            avgdl = self.total_len / n_docs
+            scores = {}
+            for term in set(tokenize(query)):
+                plist = self.postings.get(term)
+                if not plist:
+                    continue
+                idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+                for chunk_id, tf in plist.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[chunk_id] / avgdl)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self.doc_len)
+
+
+class PhraseIndex(_PickledIndex):
+    """
+    Positional inverted index over the lower-cased chunk texts, for literal
+    search: term -> {chunk_id: token positions}.
+
+    A phrase query intersects the posting lists starting from the rarest
+    term, then checks that the positions follow each other, so only the
+    chunks containing every word are looked at and no text is scanned nor
+    embedded. Matching is on whole tokens (the same analyser as BM25).
+    """
+
+    def __init__(self, path: str = paths.phrase_index_path):
+        self.path = path
+        self.postings = {}     # term -> {chunk_id: array of positions}
+        self.doc_terms = {}    # chunk_id -> distinct terms (for removal)
+        self.doc_source = {}   # chunk_id -> source
+        self._init_persistence()
+
+    def _get_state(self) -> dict:
+        return {"postings": self.postings, "doc_terms": self.doc_terms, "doc_source": self.doc_source}
+
+    def _set_state(self, state: dict):
+        self.postings = state["postings"]
+        self.doc_terms = state["doc_terms"]
+        self.doc_source = state["doc_source"]
+
+    # ------------------------------------------------------------------ #
+    # updates
+    # ------------------------------------------------------------------ #
+    def _add(self, chunk_id: str, text: str, source: str = None):
+        positions = {}
+        for pos, term in enumerate(tokenize(text)):
+            positions.setdefault(term, array("I")).append(pos)
+        if chunk_id in self.doc_terms:
+            self._remove([chunk_id])
+        for term, plist in positions.items():
+            self.postings.setdefault(term, {})[chunk_id] = plist
+        self.doc_terms[chunk_id] = list(positions)
+        self.doc_source[chunk_id] = source
+
+    def _remove(self, ids):
+        for chunk_id in ids:
+            if chunk_id not in self.doc_terms:
+                continue
+            for term in self.doc_terms.pop(chunk_id):
+                plist = self.postings.get(term)
+                if plist is not None:
+                    plist.pop(chunk_id, None)
+                    if not plist:
+                        del self.postings[term]
+            self.doc_source.pop(chunk_id, None)
+
+    def _set_source(self, ids, source: str):
+        for chunk_id in ids:
+            if chunk_id in self.doc_source:
+                self.doc_source[chunk_id] = source
+
+    def _clear(self):
+        self.postings, self.doc_terms, self.doc_source = {}, {}, {}
+
+    # ------------------------------------------------------------------ #
+    # search
+    # ------------------------------------------------------------------ #
+    def search(self, phrase: str, k: int = 20):
+        """
+        Return [(chunk_id, occurrences)] of the `k` chunks containing
+        `phrase` most often.
+        """
+        terms = tokenize(phrase)
+        if not terms:
+            return []
+        with self._lock:
+            plists = [self.postings.get(term) for term in terms]
+            if not all(plists):
+                return []
+            # candidates: chunks holding every term, starting from the rarest one
+            by_size = sorted(set(terms), key=lambda t: len(self.postings[t]))
+            candidates = set(self.postings[by_size[0]])
+            for term in by_size[1:]:
+                candidates.intersection_update(self.postings[term])
+                if not candidates:
+                    return []
+
+            counts = {}
+            for chunk_id in candidates:
+                starts = set(plists[0][chunk_id])
+                for offset, plist in enumerate(plists[1:], start=1):
+                    starts.intersection_update(p - offset for p in plist[chunk_id])
+                    if not starts:
+                        break
+                if starts:
+                    counts[chunk_id] = len(starts)
+        return heapq.nlargest(k, counts.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self.doc_terms)
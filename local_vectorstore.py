@@ -0,0 +1,402 @@
+import paths
+import os
+import json
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from chunk_store import ChunkStore
+
+
+# a compaction rewrites the vectors once this share of rows is dead
+COMPACT_DEAD_RATIO = 0.3
+
+# first-pass codes kept in RAM: "none" (search the float32 map) | "int8" | "binary"
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# candidates re-scored exactly per requested result when quantized
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", 4))
+# rows quantized at once (bounds the float32 pages touched per step)
+QUANTIZE_BLOCK = 8192
+
+# number of set bits of every byte value, for Hamming distances
+POPCOUNT = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+
+
+def quantize_int8(vectors: np.ndarray):
+    """Per-row scalar quantization: (int8 codes, float32 scales) with v ≈ codes * scale."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits, packed 8 dimensions per byte."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+class QuantizedCodes:
+    """
+    Compact in-memory copy of the index rows used for the first pass.
+
+    • ``int8``: one byte per dimension plus a scale per row (4× smaller than
+      float32); scored by an asymmetric dot product with the float query.
+    • ``binary``: one bit per dimension (32× smaller); scored by Hamming
+      distance between sign bits.
+
+    Codes are computed from the float32 memory map, block by block, and
+    extended when rows are appended.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.codes = None
+        self.scales = None
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    def extend(self, matrix: np.ndarray):
+        """Quantize the rows of `matrix` not coded yet."""
+        parts, scales = [], []
+        for start in range(len(self), len(matrix), QUANTIZE_BLOCK):
+            block = np.asarray(matrix[start:start + QUANTIZE_BLOCK])
+            if self.mode == "int8":
+                codes, block_scales = quantize_int8(block)
+                parts.append(codes)
+                scales.append(block_scales)
+            else:
+                parts.append(quantize_binary(block))
+        if not parts:
+            return
+        self.codes = np.concatenate(([self.codes] if self.codes is not None else []) + parts)
+        if scales:
+            self.scales = np.concatenate(([self.scales] if self.scales is not None else []) + scales)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate similarity of every coded row to `query` (higher is closer)."""
+        if self.mode == "int8":
+            out = np.empty(len(self.codes), dtype=np.float32)
+            for start in range(0, len(self.codes), QUANTIZE_BLOCK):
+                block = self.codes[start:start + QUANTIZE_BLOCK].astype(np.float32)
+                out[start:start + QUANTIZE_BLOCK] = (block @ query) * self.scales[start:start + QUANTIZE_BLOCK]
+            return out
+        distances = POPCOUNT[np.bitwise_xor(self.codes, quantize_binary(query[None, :])[0])].sum(axis=1, dtype=np.int32)
+        return -distances.astype(np.float32)
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.codes, self.scales) if a is not None)
+
+
+class LocalVectorIndex:
+    """
+    In-process, memory-mapped vector index (cosine similarity, float32).
+    With `quantization` set to "int8" or "binary", the first pass runs on
+    compact codes held in RAM and only the best `rescore_factor × k`
+    candidates are re-scored against the float32 rows of the memory map.
+
+    Layout (in `directory`):
+    • ``vectors-<gen>.f32`` – normalised vectors, one row per upsert, appended
+      and read through a NumPy memory map;
+    • ``rows.jsonl`` – append-only row log: a header ({"vectors", "dim"}),
+      then {"id", "row"} per stored vector and {"id", "deleted": true}
+      tombstones.
+
+    Like the `ChunkStore` index, the row log is re-read incrementally by
+    `refresh()` so vectors written by another process (ingest CLI / API) are
+    seen. `compact()` writes a new generation of the vectors file and swaps
+    the row log atomically; readers notice the new log and reload.
+
+    The methods used by the ingestion code (`upsert`, `get`, `update`,
+    `delete`, `count`) follow the Chroma collection API, so this class can
+    stand in for `vectorstore._collection`.
+    """
+
+    def __init__(
+        self,
+        directory: str = paths.vector_index_dir_path,
+        chunk_store: ChunkStore = None,
+        quantization: str = VECTOR_QUANTIZATION,
+        rescore_factor: int = RESCORE_FACTOR,
+    ):
+        self.directory = directory
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.log_path = os.path.join(directory, "rows.jsonl")
+        self.chunk_store = chunk_store or ChunkStore()
+        self.dim = None
+        self.vectors_file = None
+        self.row_of = {}        # chunk id -> row
+        self.row_ids = []       # row -> chunk id (None once deleted)
+        self._log_pos = 0
+        self._log_ino = None
+        self._matrix = None
+        self._dead = None       # cached array of deleted rows
+        self._codes = None      # QuantizedCodes, when quantized
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    # ------------------------------------------------------------------ #
+    # row log
+    # ------------------------------------------------------------------ #
+    def refresh(self):
+        """Apply the row-log lines appended since the last call (possibly by another process)."""
+        with self._lock:
+            try:
+                ino = os.stat(self.log_path).st_ino
+            except FileNotFoundError:
+                return
+            if ino != self._log_ino:  # first load, or compacted by someone else
+                self._reset()
+                self._log_ino = ino
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partially written line: pick it up next time
+                    self._log_pos += len(line)
+                    self._apply(json.loads(line))
+
+    def _reset(self):
+        self.dim, self.vectors_file = None, None
+        self.row_of, self.row_ids = {}, []
+        self._log_pos, self._matrix, self._dead = 0, None, None
+        self._codes = None
+
+    def _apply(self, rec):
+        if "vectors" in rec:
+            self.vectors_file, self.dim = rec["vectors"], rec["dim"]
+            return
+        self._dead = None
+        old = self.row_of.pop(rec["id"], None)
+        if old is not None:
+            self.row_ids[old] = None
+        if not rec.get("deleted"):
+            row = rec["row"]
+            self.row_ids.extend([None] * (row + 1 - len(self.row_ids)))
+            self.row_ids[row] = rec["id"]
+            self.row_of[rec["id"]] = row
+
+    def _append_log(self, records):
+        with open(self.log_path, "ab") as f:
+            f.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records))
+        self.refresh()
+
+    def _vectors_path(self, name: str = None) -> str:
+        return os.path.join(self.directory, name or self.vectors_file)
+
+    def matrix(self) -> np.ndarray:
+        """Memory map of every stored row (remapped after appends)."""
+        n_rows = len(self.row_ids)
+        if self._matrix is None or self._matrix.shape[0] != n_rows:
+            if not n_rows:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(self._vectors_path(), dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+        return self._matrix
+
+    def dead_rows(self) -> np.ndarray:
+        if self._dead is None:
+            self._dead = np.fromiter((r for r, i in enumerate(self.row_ids) if i is None), dtype=np.int64)
+        return self._dead
+
+    # ------------------------------------------------------------------ #
+    # Chroma-collection-like API
+    # ------------------------------------------------------------------ #
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        """Store the vectors of `ids` (texts and metadata live in the chunk store)."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._lock:
+            self.refresh()
+            header = []
+            if self.vectors_file is None:
+                self.vectors_file, self.dim = "vectors-00000.f32", vectors.shape[1]
+                header = [{"vectors": self.vectors_file, "dim": self.dim}]
+            first_row = len(self.row_ids)
+            with open(self._vectors_path(), "ab") as f:
+                f.truncate(first_row * self.dim * 4)  # drop bytes of an interrupted append
+                f.write(vectors.tobytes())
+            # data first, log second: a crash in between only leaves unreachable bytes
+            self._append_log(header + [{"id": i, "row": first_row + n} for n, i in enumerate(ids)])
+
+    def delete(self, ids):
+        with self._lock:
+            self.refresh()
+            ids = [i for i in ids if i in self.row_of]
+            if ids:
+                self._append_log([{"id": i, "deleted": True} for i in ids])
+            if len(self.row_ids) and 1 - len(self.row_of) / len(self.row_ids) > COMPACT_DEAD_RATIO:
+                self.compact()
+
+    def get(self, ids, include=("metadatas",)):
+        self.chunk_store.refresh()
+        found = [i for i in ids if i in self.row_of and i in self.chunk_store]
+        docs = [self.chunk_store.get(i) for i in found]
+        res = {"ids": found}
+        if "metadatas" in include:
+            res["metadatas"] = [d.metadata for d in docs]
+        if "documents" in include:
+            res["documents"] = [d.page_content for d in docs]
+        return res
+
+    def update(self, ids, metadatas=None):
+        """Metadata is owned by the chunk store (`LocalIndexes.set_source`); vectors are unchanged."""
+        return None
+
+    def count(self) -> int:
+        self.refresh()
+        return len(self.row_of)
+
+    # ------------------------------------------------------------------ #
+    # search / maintenance
+    # ------------------------------------------------------------------ #
+    def codes(self) -> "QuantizedCodes":
+        if self._codes is None:
+            self._codes = QuantizedCodes(self.quantization)
+        self._codes.extend(self.matrix())
+        return self._codes
+
+    def search(self, vector, k: int = 20) -> List[Tuple[str, float]]:
+        """Return [(chunk_id, cosine similarity)] of the `k` nearest live rows."""
+        with self._lock:
+            self.refresh()
+            if not self.row_of:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1)
+            matrix, row_ids = self.matrix(), self.row_ids
+            k = min(k, len(self.row_of))
+            if self.quantization == "none":
+                scores = np.asarray(matrix @ query)
+            else:
+                scores = self.codes().scores(query)
+            scores[self.dead_rows()] = -np.inf
+
+        if self.quantization == "none":
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            # first pass on the codes, exact re-scoring of the candidates on the memory map
+            n_candidates = min(k * self.rescore_factor, len(self.row_of))
+            candidates = np.sort(np.argpartition(-scores, n_candidates - 1)[:n_candidates])
+            scores = np.full(len(matrix), -np.inf, dtype=np.float32)
+            scores[candidates] = np.asarray(matrix[candidates]) @ query
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(row_ids[r], float(scores[r])) for r in top]
+
+    def memory_stats(self) -> dict:
+        """Bytes of the float32 rows (on disk) and of the in-memory codes."""
+        with self._lock:
+            return {
+                "rows": len(self.row_ids),
+                "live_rows": len(self.row_of),
+                "float32_bytes": len(self.row_ids) * (self.dim or 0) * 4,
+                "quantization": self.quantization,
+                "codes_bytes": self.codes().nbytes() if self.quantization != "none" else 0,
+            }
+
+    def compact(self):
+        """Rewrite the live rows into a new vectors file and swap the row log."""
+        with self._lock:
+            self.refresh()
+            live = [(i, r) for r, i in enumerate(self.row_ids) if i is not None]
+            gen = int(self.vectors_file[8:13]) + 1
+            name = f"vectors-{gen:05d}.f32"
+            matrix = self.matrix()
+            with open(self._vectors_path(name), "wb") as f:
+                for start in range(0, len(live), 4096):
+                    f.write(np.ascontiguousarray(matrix[[r for _, r in live[start:start + 4096]]]).tobytes())
+            tmp_path = f"{self.log_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                records = [{"vectors": name, "dim": self.dim}] + [{"id": i, "row": n} for n, (i, _) in enumerate(live)]
+                f.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records))
+            # drop our own map of the old generation before deleting it
+            del matrix
+            self._matrix = None
+            os.replace(tmp_path, self.log_path)
+            self._log_ino = None
+            self.refresh()
+            self._remove_old_generations()
+            print(f"Compacted vector index: {len(live)} live rows")
+
+    def _remove_old_generations(self):
+        """
+        Delete the vectors files of previous generations. On Windows a file
+        still mapped (by another process, until it refreshes) cannot be
+        removed: it is left for the next compaction.
+        """
+        for name in os.listdir(self.directory):
+            if name.startswith("vectors-") and name.endswith(".f32") and name != self.vectors_file:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    print(f"Old vectors file {name} still in use, removed at the next compaction: {e}")
+
+
+class LocalVectorStore(VectorStore):
+    """
+    LangChain vector store over a `LocalVectorIndex`, returning the chunks
+    from the `ChunkStore`. Queries run in-process on the memory map, with no
+    HTTP round-trip nor payload (de)serialisation.
+    """
+
+    def __init__(self, embedding_function: Embeddings, index: LocalVectorIndex = None, chunk_store: ChunkStore = None):
+        self.embedding_function = embedding_function
+        self._collection = index or LocalVectorIndex(chunk_store=chunk_store)
+        self.chunk_store = self._collection.chunk_store
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid4()) for _ in texts]
+        self.chunk_store.append([Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)], ids)
+        self._collection.upsert(ids=ids, embeddings=self.embedding_function.embed_documents(texts))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        self._collection.delete(ids or [])
+        return True
+
+    def get_by_ids(self, ids) -> List[Document]:
+        self.chunk_store.refresh()
+        return [d for d in (self.chunk_store.get(i) for i in ids) if d is not None]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any):
+        hits = self._collection.search(embedding, k=k)
+        self.chunk_store.refresh()
+        results = []
+        for chunk_id, score in hits:
+            doc = self.chunk_store.get(chunk_id)
+            if doc is not None:
+                results.append((doc, score))
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k=k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score  # already a cosine similarity
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,50 @@
+import os
+import asyncio
+from collections import deque
+
+
+# how often the event loop is probed (seconds)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: a task asks to wake up every `interval` seconds
+    and records how late it actually runs. Any blocking call on the loop
+    (sync I/O, CPU work) shows up directly as lag.
+    Percentiles are computed over the last `window` samples.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = 3000):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.samples.append(lag)
+            self.count += 1
+            self.max = max(self.max, lag)
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+
+        def pct(q):
+            return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+
+        return {
+            "samples": self.count,
+            "window_seconds": len(samples) * self.interval,
+            "avg_ms": sum(samples) / len(samples) * 1000,
+            "p50_ms": pct(0.5),
+            "p99_ms": pct(0.99),
+            "window_max_ms": samples[-1] * 1000,
+            "max_ms": self.max * 1000,
+        }
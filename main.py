@@ -1,25 +1,17 @@
-import chromadb
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-import paths
+import clients
 from uuid import uuid4
-from chromadb.utils import embedding_functions
 import os
 
 # Pour éviter les warnings de TensorFlow
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"  # 0=default, 1=info, 2=warning, 3=error
 
-# Connexion au client Chroma
-client = chromadb.HttpClient(host="localhost", port=8010)
+# Connexion au client Chroma (partagé)
+client = clients.get_chroma_client()
 
-# Définition de l'embedder LangChain
-embedder = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
-
-# Embedding function compatible avec Chroma (via chromadb directement)
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=paths.bert_model_path
-)
+# Définition de l'embedder LangChain (chargé une seule fois, via le cache d'embeddings)
+embedder = clients.get_embedding_model()
 
 # Récupération ou création de la collection
 collection = client.get_or_create_collection(
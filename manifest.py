@@ -0,0 +1,164 @@
+import paths
+import os
+import json
+import hashlib
+
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# status returned by IngestManifest.classify
+UNCHANGED = "unchanged"   # same content already indexed under this source
+NEW = "new"               # never seen
+CHANGED = "changed"       # same source, different content → stale chunks
+RENAMED = "renamed"       # content indexed under a source that no longer exists
+DUPLICATE = "duplicate"   # content already indexed under another live source
+
+
+def file_hash(filepath: str) -> str:
+    """SHA-256 of a file, read block by block."""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IngestManifest:
+    """
+    Persistent record of what has been indexed.
+
+    One entry per source (absolute path of the PDF in the data folder):
+    ``{"sha256", "size", "mtime", "chunk_ids", "model"}``. Size + mtime give a
+    cheap "unchanged" answer, the hash settles everything else, and the chunk
+    ids let us delete the stale vectors of a replaced file. A duplicate is
+    recorded without chunk ids: it is served by the chunks of the source
+    that owns its content, and inherits them when that source goes away
+    (`heir_of` / `hand_over`).
+    """
+
+    def __init__(self, path: str = paths.manifest_path, model_id: str = paths.bert_model_path):
+        self.path = path
+        self.model_id = os.path.basename(os.path.normpath(model_id))
+        self.entries = {}
+        self.load()
+
+    # ------------------------------------------------------------------ #
+    # persistence
+    # ------------------------------------------------------------------ #
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            print(f"Unreadable manifest {self.path}, starting from scratch: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Atomic write (tmp file + rename) so a crash never leaves half a manifest."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.entries}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """Forget everything (e.g. the vector collection was wiped)."""
+        self.entries = {}
+
+    # ------------------------------------------------------------------ #
+    # lookups
+    # ------------------------------------------------------------------ #
+    def find_by_hash(self, digest: str, exclude: str = None):
+        """
+        Return the source already indexed with this content (same model), if
+        any; the one owning the chunks first, before its duplicates.
+        """
+        found = None
+        for source, entry in self.entries.items():
+            if source != exclude and entry["sha256"] == digest and entry["model"] == self.model_id:
+                if entry["chunk_ids"]:
+                    return source
+                found = found or source
+        return found
+
+    def classify(self, filepath: str, source: str = None, digest: str = None):
+        """
+        Decide what ingestion has to do with `filepath`, which will be indexed
+        under `source` (defaults to its absolute path). `digest` is the file's
+        SHA-256 when the caller already knows it (e.g. hashed while uploading).
+
+        Returns (status, digest, other_source). `digest` is None when the cheap
+        size/mtime check was enough; `other_source` is set for RENAMED/DUPLICATE.
+        """
+        source = source or os.path.abspath(filepath)
+        st = os.stat(filepath)
+        entry = self.entries.get(source)
+
+        if entry and entry["model"] == self.model_id \
+                and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return UNCHANGED, None, None
+
+        digest = digest or file_hash(filepath)
+        if entry and entry["model"] == self.model_id and entry["sha256"] == digest:
+            # touched but identical: refresh the cheap keys only
+            entry["size"], entry["mtime"] = st.st_size, st.st_mtime
+            return UNCHANGED, digest, None
+
+        other = self.find_by_hash(digest, exclude=source)
+        if other is not None and not entry:
+            if os.path.exists(other):
+                return DUPLICATE, digest, other
+            return RENAMED, digest, other
+
+        return (CHANGED if entry else NEW), digest, None
+
+    # ------------------------------------------------------------------ #
+    # updates
+    # ------------------------------------------------------------------ #
+    def record(self, source: str, filepath: str, chunk_ids, digest: str = None):
+        """Store (or replace) the entry of `source` once its chunks are indexed."""
+        st = os.stat(filepath)
+        self.entries[source] = {
+            "sha256": digest or file_hash(filepath),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "chunk_ids": list(chunk_ids),
+            "model": self.model_id,
+        }
+
+    def forget(self, source: str):
+        """Drop `source` and return the chunk ids that belonged to it."""
+        entry = self.entries.pop(source, None)
+        return entry["chunk_ids"] if entry else []
+
+    def rename(self, old_source: str, new_source: str):
+        """Move an entry to its new source; returns its chunk ids."""
+        entry = self.entries.pop(old_source)
+        self.entries[new_source] = entry
+        return entry["chunk_ids"]
+
+    def heir_of(self, source: str):
+        """
+        A live duplicate of `source` (same content, recorded without chunks)
+        that can take over its chunks, or None.
+        """
+        entry = self.entries.get(source)
+        if not entry or not entry["chunk_ids"]:
+            return None
+        for other, e in self.entries.items():
+            if other != source and not e["chunk_ids"] and e["sha256"] == entry["sha256"] \
+                    and e["model"] == entry["model"] and os.path.exists(other):
+                return other
+        return None
+
+    def hand_over(self, source: str, heir: str):
+        """Give the chunks of `source` to its duplicate `heir` and drop `source`; returns the chunk ids."""
+        ids = self.entries.pop(source)["chunk_ids"]
+        self.entries[heir]["chunk_ids"] = ids
+        return ids
+
+    def stale_sources(self):
+        """Sources whose file disappeared from disk."""
+        return [s for s in self.entries if not os.path.exists(s)]
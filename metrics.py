@@ -0,0 +1,176 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+
+# histogram buckets: seconds (from a cache hit to a long generation), tokens, tokens/s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 200)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ingestion runs in other processes (job workers, CLI): its totals live in Redis
+INGEST_KEY = "metrics:ingest"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines += [f"{name}{_labels(pairs)} {_number(value)}" for name, pairs, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic total (`inc`)."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, list(zip(self.label_names, key)), value
+
+
+class Gauge(_Metric):
+    """Current value (`set`)."""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, list(zip(self.label_names, key)), value
+
+
+class Histogram(_Metric):
+    """
+    Cumulative fixed-bucket histogram (`observe`): per label set, one count
+    per bucket plus the sum and count, as Prometheus expects.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labels=()):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.bounds) + 1), 0.0, 0]
+            entry[0][bisect_left(self.bounds, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block (also around awaits)."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, (counts, total, count) in self._values.items():
+            pairs = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.bounds + (float("inf"),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket", pairs + [("le", _number(bound))], cumulative
+            yield f"{self.name}_sum", pairs, total
+            yield f"{self.name}_count", pairs, count
+
+
+REGISTRY = []
+
+
+def render(extra=()) -> str:
+    """Every registered metric (then the `extra` families) in the Prometheus text format."""
+    return "\n".join([metric.render() for metric in REGISTRY] + list(extra)) + "\n"
+
+
+# ---------------------------------------------------------------------- #
+# metrics of the API process
+# ---------------------------------------------------------------------- #
+chat_queue_wait = Histogram("rag_chat_queue_wait_seconds", "Time a chat request waits in the queue for a free generator.")
+chat_queue_depth = Gauge("rag_chat_queue_depth", "Chat requests waiting for a generator.")
+chat_requests = Counter("rag_chat_requests_total", "Answered chat requests.", labels=("cached",))
+chat_stage = Histogram("rag_chat_stage_seconds", "Chat latency per stage (retrieval, generation, total).", labels=("stage",))
+
+query_embedding = Histogram("rag_query_embedding_seconds", "Query embedding time (embedding-cache misses only).")
+vector_search = Histogram("rag_vector_search_seconds", "Vector search time, embedding excluded.", labels=("backend",))
+
+prompt_tokens = Histogram("rag_prompt_tokens", "Prompt size of a generation, in tokens.", buckets=TOKEN_BUCKETS)
+prefill_tokens = Counter("rag_prefill_tokens_total", "Prompt tokens, prefilled (new) or reused from the KV cache (cached).", labels=("kind",))
+prefill = Histogram("rag_prefill_seconds", "Prefill (prompt evaluation) time of a generation.")
+decode_tokens = Counter("rag_decode_tokens_total", "Generated tokens.")
+decode_rate = Histogram("rag_decode_tokens_per_second", "Decode speed of a generation.", buckets=RATE_BUCKETS)
+
+redis_time = Histogram("rag_redis_seconds", "Redis round trips of the chat path.", labels=("op",))
+
+
+# ---------------------------------------------------------------------- #
+# ingestion (other processes, through Redis)
+# ---------------------------------------------------------------------- #
+def record_ingest(redis_client, chunks: int, seconds: float):
+    """Add one ingestion run (job or CLI) to the shared totals (sync client)."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hincrby(INGEST_KEY, "runs", 1)
+    pipe.hincrby(INGEST_KEY, "chunks", chunks)
+    pipe.hincrbyfloat(INGEST_KEY, "seconds", seconds)
+    pipe.hset(INGEST_KEY, "last_chunks_per_second", chunks / seconds if seconds > 0 else 0.0)
+    pipe.execute()
+
+
+def render_ingest(raw: dict) -> list:
+    """Families for the HGETALL of INGEST_KEY (rate: chunks_total / seconds_total)."""
+    raw = raw or {}
+    families = [
+        ("rag_ingest_runs_total", "counter", "Ingestion runs (upload jobs and CLI).", raw.get("runs", 0)),
+        ("rag_ingest_chunks_total", "counter", "Chunks written by ingestion.", raw.get("chunks", 0)),
+        ("rag_ingest_seconds_total", "counter", "Time spent ingesting.", raw.get("seconds", 0)),
+        ("rag_ingest_last_chunks_per_second", "gauge", "Throughput of the last ingestion run.",
+         raw.get("last_chunks_per_second", 0)),
+    ]
+    return [f"# HELP {name} {help}\n# TYPE {name} {kind}\n{name} {_number(value)}"
+            for name, kind, help, value in families]
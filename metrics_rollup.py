@@ -0,0 +1,230 @@
+import os
+from datetime import date, datetime, timedelta
+
+import latency_histogram
+
+
+# longest range /metrics/summary accepts (days)
+METRICS_MAX_DAYS = int(os.getenv("METRICS_MAX_DAYS", 3660))
+
+GRANULARITIES = ("day", "week", "month")
+COUNTERS = ("responses", "feedback_positive", "feedback_negative")
+
+PREFIX = "rollup"
+# days of the legacy per-day keys already folded into the rollups
+BACKFILLED_KEY = f"{PREFIX}:backfilled"
+# legacy per-day keys (before the rollups): prefix -> kind
+LEGACY_PREFIXES = {
+    "responses:": "responses",
+    "feedback:positive:": "feedback_positive",
+    "feedback:negative:": "feedback_negative",
+    "users:": "users",
+    "response_times:": "response_times",
+}
+
+
+# ---------------------------------------------------------------------- #
+# periods
+# ---------------------------------------------------------------------- #
+def period_label(granularity: str, day: date) -> str:
+    """Label of the day/ISO week/month holding `day`: 2025-03-14, 2025-W11, 2025-03."""
+    if granularity == "day":
+        return day.isoformat()
+    if granularity == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{day.year}-{day.month:02d}"
+
+
+def period_end(granularity: str, day: date) -> date:
+    """Last day of the period holding `day`."""
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day + timedelta(days=6 - day.weekday())
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+
+def cover(start: date, end: date):
+    """
+    Fewest periods exactly covering [start, end]: whole months, then whole
+    ISO weeks, then single days at the edges (a year is ~30 keys, not 365).
+    """
+    labels = []
+    day = start
+    while day <= end:
+        for granularity in ("month", "week", "day"):
+            last = period_end(granularity, day)
+            starts_period = granularity == "day" or (
+                day.day == 1 if granularity == "month" else day.weekday() == 0)
+            if starts_period and last <= end:
+                labels.append(period_label(granularity, day))
+                day = last + timedelta(days=1)
+                break
+    return labels
+
+
+def buckets(start: date, end: date, granularity: str):
+    """[(label, first day, last day)] of the `granularity` periods over [start, end], clipped."""
+    out = []
+    day = start
+    while day <= end:
+        last = min(period_end(granularity, day), end)
+        out.append((period_label(granularity, day), day, last))
+        day = last + timedelta(days=1)
+    return out
+
+
+def auto_granularity(start: date, end: date) -> str:
+    """Series resolution keeping the number of points bounded (≤ ~31)."""
+    days = (end - start).days + 1
+    if days <= 31:
+        return "day"
+    if days <= 26 * 7:
+        return "week"
+    return "month"
+
+
+# ---------------------------------------------------------------------- #
+# incremental updates (queued on the caller's pipeline, O(1) each)
+# ---------------------------------------------------------------------- #
+def _labels(day: date = None):
+    day = day or datetime.utcnow().date()
+    return [period_label(granularity, day) for granularity in GRANULARITIES]
+
+
+def record_response(pipe, day: date = None):
+    for label in _labels(day):
+        pipe.hincrby(f"{PREFIX}:{label}", "responses", 1)
+
+
+def record_feedback(pipe, positive: bool, day: date = None):
+    field = "feedback_positive" if positive else "feedback_negative"
+    for label in _labels(day):
+        pipe.hincrby(f"{PREFIX}:{label}", field, 1)
+
+
+def record_user(pipe, user_id: str, day: date = None):
+    """Distinct users per period, as HyperLogLogs (mergeable over any range, ~1 % error)."""
+    for label in _labels(day):
+        pipe.pfadd(f"{PREFIX}:users:{label}", user_id)
+
+
+def record_latency(pipe, stage: str, seconds: float, day: date = None):
+    for label in _labels(day):
+        latency_histogram.record(pipe, stage, seconds, label)
+
+
+# ---------------------------------------------------------------------- #
+# one-shot migration of the legacy per-day keys
+# ---------------------------------------------------------------------- #
+def legacy_days(redis_client):
+    """Days having at least one legacy key (responses:, feedback:*:, users:, response_times:<date>)."""
+    days = set()
+    for prefix in LEGACY_PREFIXES:
+        for key in redis_client.scan_iter(match=f"{prefix}*", count=1000):
+            try:
+                days.add(date.fromisoformat(key[len(prefix):]))
+            except ValueError:
+                continue
+    return sorted(days)
+
+
+def backfill_day(redis_client, day: date) -> bool:
+    """
+    Fold the legacy keys of `day` into the day/week/month rollups (sync
+    client). Each day is claimed first in BACKFILLED_KEY, so running it
+    again, or from two processes, never counts a day twice. Returns False
+    when the day was already done.
+    """
+    iso = day.isoformat()
+    if not redis_client.sadd(BACKFILLED_KEY, iso):
+        return False
+    responses = int(redis_client.get(f"responses:{iso}") or 0)
+    positive = int(redis_client.get(f"feedback:positive:{iso}") or 0)
+    negative = int(redis_client.get(f"feedback:negative:{iso}") or 0)
+    users = list(redis_client.smembers(f"users:{iso}"))
+    durations = [float(v) for v in redis_client.lrange(f"response_times:{iso}", 0, -1)]
+
+    pipe = redis_client.pipeline(transaction=True)
+    for label in _labels(day):
+        for field, n in (("responses", responses), ("feedback_positive", positive),
+                         ("feedback_negative", negative)):
+            if n:
+                pipe.hincrby(f"{PREFIX}:{label}", field, n)
+        if users:
+            pipe.pfadd(f"{PREFIX}:users:{label}", *users)
+    for seconds in durations:
+        record_latency(pipe, "total", seconds, day)
+    pipe.execute()
+    return True
+
+
+def backfill(redis_client) -> int:
+    """Fold every legacy day not done yet into the rollups; returns the number of days folded."""
+    return sum(backfill_day(redis_client, day) for day in legacy_days(redis_client))
+
+
+# ---------------------------------------------------------------------- #
+# reads
+# ---------------------------------------------------------------------- #
+def _aggregate(labels, counters, latencies, users):
+    totals = {name: sum(counters[label][i] for label in labels) for i, name in enumerate(COUNTERS)}
+    feedbacks = totals["feedback_positive"] + totals["feedback_negative"]
+    totals["users"] = users
+    totals["feedback_rate"] = feedbacks / totals["responses"] if totals["responses"] else 0.0
+    totals["latency"] = {
+        stage: latency_histogram.summarize(latency_histogram.merge(latencies[stage][label] for label in labels))
+        for stage in latency_histogram.STAGES
+    }
+    return totals
+
+
+async def read_summary(redis_client, start: date, end: date, granularity: str = None) -> dict:
+    """
+    Totals over [start, end] and a series at `granularity` (auto when None),
+    read from the rollups in one pipelined round trip.
+
+    Each range is answered from its `cover` (whole months and weeks, edge
+    days), so the cost depends on the number of points, not of days.
+    """
+    granularity = granularity or auto_granularity(start, end)
+    groups = [("total", start, end)] + buckets(start, end, granularity)
+    covers = [cover(first, last) for _, first, last in groups]
+    labels = list(dict.fromkeys(label for labels in covers for label in labels))
+
+    pipe = redis_client.pipeline(transaction=False)
+    for label in labels:
+        pipe.hmget(f"{PREFIX}:{label}", *COUNTERS)
+        for stage in latency_histogram.STAGES:
+            pipe.hgetall(latency_histogram.histogram_key(stage, label))
+    for labels_of_group in covers:
+        pipe.pfcount(*[f"{PREFIX}:users:{label}" for label in labels_of_group])
+    replies = iter(await pipe.execute())
+
+    counters, latencies = {}, {stage: {} for stage in latency_histogram.STAGES}
+    for label in labels:
+        counters[label] = [int(value or 0) for value in next(replies)]
+        for stage in latency_histogram.STAGES:
+            latencies[stage][label] = next(replies)
+    users = [next(replies) for _ in covers]
+
+    summaries = []
+    for (name, first, last), labels_of_group, n_users in zip(groups, covers, users):
+        summary = {"period": name, "from": first.isoformat(), "to": last.isoformat()}
+        summary.update(_aggregate(labels_of_group, counters, latencies, n_users))
+        summaries.append(summary)
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "total": summaries[0],
+        "series": summaries[1:],
+    }
+
+
+if __name__ == "__main__":
+    import redis_db
+
+    print(f"{backfill(redis_db.create_redis_client())} day(s) of legacy metrics folded into the rollups")
@@ -9,6 +9,28 @@ preprocessed_data = os.path.join(base_dir, "preprocessed_data")
 upload_dir_path = os.path.join(base_dir, "uploads")
 chunks_dir_path = os.path.join(preprocessed_data, "chunks")
 
+# ingestion manifest (hash / size / mtime / chunk ids per indexed file)
+manifest_path = os.path.join(preprocessed_data, "manifest.json")
+
+# on-disk embedding cache keyed by (model id, chunk hash)
+embedding_cache_path = os.path.join(preprocessed_data, "embedding_cache.sqlite")
+
+# BM25 inverted index over the chunk store
+bm25_index_path = os.path.join(preprocessed_data, "bm25_index.pkl")
+# positional index for literal / phrase search
+phrase_index_path = os.path.join(preprocessed_data, "phrase_index.pkl")
+
+# in-process vector index (alternative to the Chroma server)
+vector_index_dir_path = os.path.join(preprocessed_data, "vector_index")
+
+# inter-process lock serialising index writes (CLI, ingestion workers)
+ingest_lock_path = os.path.join(preprocessed_data, "ingest.lock")
+# files received by the API, waiting for their ingestion job
+ingest_staging_path = os.path.join(preprocessed_data, "ingest_staging")
+
+# touched on every write to the collection (invalidates retrieval caches)
+index_version_path = os.path.join(preprocessed_data, "index.version")
+
 # model encoder for text
 bert_model_path = os.path.join(base_dir, "models" , "all-mpnet-base-v2")
 
@@ -0,0 +1,110 @@
+import os
+import threading
+from time import perf_counter
+from llama_cpp import LlamaRAMCache
+
+
+# memory allowed for saved llama.cpp KV states (shared by every generator instance)
+KV_CACHE_BYTES = int(os.getenv("KV_CACHE_BYTES", 2 * 1024 ** 3))
+
+
+class SharedPrefixCache(LlamaRAMCache):
+    """
+    llama.cpp state cache keyed by token prefix, LRU-bounded in bytes.
+
+    `Llama.create_completion` looks up the saved state with the longest
+    common token prefix before prefilling and stores its state afterwards,
+    so a session's follow-up turn only prefills what changed since its
+    previous prompt. One cache is shared by the whole generator pool (states
+    can be loaded into any context of the same model), hence the lock.
+    """
+
+    def __init__(self, capacity_bytes: int = KV_CACHE_BYTES):
+        super().__init__(capacity_bytes=capacity_bytes)
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return super().__getitem__(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return super().__contains__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+
+
+class PrefillMeter:
+    """
+    Counts, for the last generation of one llama.cpp instance, the prompt
+    tokens and how many of them really had to be prefilled (the rest came
+    from the KV state: current context or prefix cache), and times the
+    prefill and the decode steps that follow it.
+    """
+
+    def __init__(self, llama):
+        self.prompt_tokens = 0
+        self.new_tokens = 0
+        self.prefill_seconds = 0.0
+        self.decode_tokens = 0
+        self.decode_seconds = 0.0
+        self._first_eval = False
+        self._decode_start = 0.0
+        generate, evaluate = llama.generate, llama.eval
+
+        def metered_generate(tokens, *args, **kwargs):
+            self.prompt_tokens = len(tokens)
+            self.new_tokens = 0
+            self.prefill_seconds = 0.0
+            self.decode_tokens = 0
+            self.decode_seconds = 0.0
+            self._first_eval = True
+            return generate(tokens, *args, **kwargs)
+
+        def metered_eval(tokens):
+            start = perf_counter()
+            result = evaluate(tokens)
+            # the first eval of a generation is the prefill of the uncached suffix,
+            # the next ones feed back one sampled token each
+            if self._first_eval:
+                self.new_tokens = len(tokens)
+                self.prefill_seconds = perf_counter() - start
+                self._decode_start = perf_counter()
+                self._first_eval = False
+            else:
+                self.decode_tokens += len(tokens)
+                self.decode_seconds = perf_counter() - self._decode_start
+            return result
+
+        # instance attributes shadow the methods `create_completion` calls
+        llama.generate = metered_generate
+        llama.eval = metered_eval
+
+    def last(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.prompt_tokens - self.new_tokens,
+            "new_tokens": self.new_tokens,
+            "prefill_seconds": self.prefill_seconds,
+            "decode_tokens": self.decode_tokens,
+            "decode_seconds": self.decode_seconds,
+        }
+
+
+def enable_prefix_cache(chat_model, cache: SharedPrefixCache) -> PrefillMeter:
+    """Attach the shared prefix cache to a ChatLlamaCpp model and meter its prefills."""
+    chat_model.client.set_cache(cache)
+    return PrefillMeter(chat_model.client)
+
+
+def warm_system_prefix(chat_model, system_text: str):
+    """
+    Prefill the static part of the system prompt once, so its KV state is in
+    the cache before the first request.
+    """
+    chat_model.client.create_chat_completion(
+        messages=[{"role": "system", "content": system_text}],
+        max_tokens=1,
+    )
@@ -1,18 +1,34 @@
 import paths
 import os
 import shutil
-import pickle
 import re
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from time import time
 import sys
-import chromadb
-from langchain_chroma import Chroma
-from chromadb.config import Settings
 from uuid import uuid4
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice, chain
+from contextlib import contextmanager
 import pymupdf
+from manifest import IngestManifest, UNCHANGED, CHANGED, RENAMED, DUPLICATE
+from chunk_store import ChunkStore
+from lexical_index import BM25Index, PhraseIndex
+import clients
+from retriever import bump_index_version, load_vectorstore, VECTOR_BACKEND
+import redis_db
+import semantic_cache
+import metrics
+
+
+# number of processes used to parse / clean PDFs (1 = sequential)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+
+# number of chunks embedded and upserted to Chroma at once
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 128))
+
+# pages read, cleaned and split together by the streaming chunker
+PAGE_WINDOW = int(os.getenv("PAGE_WINDOW", 8))
 
 
 def load_doc(filepath):
@@ -66,25 +82,12 @@ def strip_sections(raw_txt: str) -> str:
 
 
 # ────────────────────────────────────────────────────────────
-# Core extractor (minimal changes)
+# Core extractor (streams one page at a time)
 # ────────────────────────────────────────────────────────────
 
-def extract_text_with_layout(
-    filepath,
-    images_dir="images",
-    space_multiplier=0.5,
-):
-    """Extract text with rudimentary layout, skipping TOC/History pages."""
-    doc = load_doc(filepath)
-    if doc is None:
-        return ""
-
-    meta = doc.metadata
-
-    #print(f"\n\nDocument metadata : \n{doc.metadata}\n\n")
-
+def iter_page_texts(doc, images_dir="images", space_multiplier=0.5):
+    """Yield (page_number, text) for every retained page, skipping TOC/History pages."""
     os.makedirs(images_dir, exist_ok=True)
-    full_lines = []
 
     for pno in range(doc.page_count):
         page = doc.load_page(pno)
@@ -96,7 +99,7 @@ def extract_text_with_layout(
             continue  # jump to next page
 
         # page delimiter (only for retained pages)
-        full_lines.append(f"--- Page {pno + 1} ---")
+        page_lines = [f"--- Page {pno + 1} ---"]
 
         page_dict = page.get_text("dict")
 
@@ -118,14 +121,33 @@ def extract_text_with_layout(
                         line_text += ' ' * n_spaces
                     line_text += txt
                     cursor_x = x1
-                full_lines.append(line_text.rstrip())
+                page_lines.append(line_text.rstrip())
             # blank line after block
-            full_lines.append("")
+            page_lines.append("")
+
+        yield pno + 1, "\n".join(page_lines)
 
-    doc.close()
 
-    # join lines & collapse 3+ newlines to 2
-    text = "\n".join(full_lines)
+def extract_text_with_layout(
+    filepath,
+    images_dir="images",
+    space_multiplier=0.5,
+):
+    """Extract the whole text of a PDF with rudimentary layout (see `iter_file_chunks` for the streaming path)."""
+    doc = load_doc(filepath)
+    if doc is None:
+        return "", {}
+
+    meta = doc.metadata
+
+    #print(f"\n\nDocument metadata : \n{doc.metadata}\n\n")
+
+    try:
+        text = "\n".join(txt for _, txt in iter_page_texts(doc, images_dir, space_multiplier))
+    finally:
+        doc.close()
+
+    # collapse 3+ newlines to 2
     text = re.sub(r"\n{3,}", "\n\n", text)
     return strip_sections(text) , meta
 
@@ -137,98 +159,488 @@ def get_text(path):
         return extract_text_with_layout(path)
     except Exception as e:
         print(f"Error reading file {path}: {e}")
-        return ""
+        return "", {}
+
+
+def _clean_window(carry: str, pages) -> str:
+    """Lower-case / clean a page window, prefixed by the unfinished chunk of the previous one."""
+    text = "\n".join(pages).lower()
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = strip_sections(text)
+    return f"{carry}\n{text}" if carry else text
+
+
+def iter_file_chunks(
+    filepath,
+    chunk_size=20000,
+    overlap=2000,
+    source=None,
+    window_pages=PAGE_WINDOW,
+):
+    """
+    Lazily yield the chunks (Documents) of one PDF.
+
+    Pages are read `window_pages` at a time; each window is cleaned and split,
+    every finished chunk is yielded, and only the last (possibly incomplete)
+    one is carried over to the next window. Peak memory is therefore one page
+    window, whatever the size of the document.
+    """
+    doc = load_doc(filepath)
+    if doc is None:
+        return
+
+    # Merge absolute path with PDF metadata
+    meta = {k: v for k, v in (doc.metadata or {}).items() if v}  # drop Nones
+    meta["source"] = source or os.path.abspath(filepath)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+
+    carry, window = "", []
+    try:
+        for _, page_txt in iter_page_texts(doc):
+            window.append(page_txt)
+            if len(window) < window_pages:
+                continue
+            pieces = splitter.split_text(_clean_window(carry, window))
+            carry = pieces.pop() if pieces else ""
+            window = []
+            for piece in pieces:
+                yield Document(page_content=piece, metadata=dict(meta))
+
+        for piece in splitter.split_text(_clean_window(carry, window)):
+            yield Document(page_content=piece, metadata=dict(meta))
+    finally:
+        doc.close()
+
+
+def _chunk_file(fpath, source, chunk_size, overlap):
+    """
+    Process-pool task: parse, clean and split one PDF.
+
+    Returns (fpath, chunks, seconds). Runs in a child process, so it must stay
+    a top-level function and only return picklable objects; memory is bounded
+    by one document per in-flight task.
+    """
+    start = time()
+    try:
+        chunks = list(iter_file_chunks(fpath, chunk_size, overlap, source=source))
+    except Exception as e:
+        print(f"Error reading file {fpath}: {e}")
+        chunks = []
+    return fpath, chunks, time() - start
 
 
-def get_all_files(directory=paths.data_path, skip_existing=True):
-    """Returns only new files that have not been processed before."""
+def iter_chunks(files, chunk_size=20000, overlap=2000, workers=INGEST_WORKERS, sources=None):
+    """
+    Yield the chunks of every file as a stream.
+
+    With ``workers > 1`` the PDFs are parsed in a process pool so extraction is
+    no longer bound to a single core, and each file's chunks are yielded as
+    soon as it completes. With one worker the pipeline is fully lazy, page
+    window by page window. Per-file timings and a files/sec summary are
+    printed as files finish. `sources` optionally maps a file path to the
+    `source` stored in metadata.
+    """
+    files = list(files)
+    if not files:
+        return
+
+    sources = sources or {}
+    start = time()
+    workers = max(1, min(workers, len(files)))
+    done = 0
+
+    if workers == 1:
+        for fpath in files:
+            t0 = time()
+            try:
+                yield from iter_file_chunks(fpath, chunk_size, overlap, source=sources.get(fpath))
+            except Exception as e:
+                print(f"Error reading file {fpath}: {e}")
+            done += 1
+            print(f"[{done}/{len(files)}] {os.path.basename(fpath)} : {time() - t0:.2f}s")
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending_files = iter(files)
+            in_flight = set()
+            while True:
+                # at most two files per worker in flight, so finished-but-unconsumed
+                # results never pile up beyond a few documents
+                for fpath in islice(pending_files, 2 * workers - len(in_flight)):
+                    in_flight.add(pool.submit(_chunk_file, fpath, sources.get(fpath), chunk_size, overlap))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    fpath, chunks, elapsed = future.result()
+                    done += 1
+                    print(f"[{done}/{len(files)}] {os.path.basename(fpath)} : {elapsed:.2f}s")
+                    yield from chunks
+
+    total = time() - start
+    print(f"Extracted {done} file(s) in {total:.2f}s with {workers} worker(s) "
+          f"({done / total if total else 0:.2f} files/sec)")
+
+
+def get_all_files(directory=paths.data_path, skip_existing=True, manifest=None):
+    """
+    Returns the files of `directory`. With `skip_existing` and a manifest,
+    files already indexed with the same content are left out (cheap size/mtime
+    check first, content hash only when those differ).
+    """
     all_files = []
     try:
-        processed_files = set(os.listdir(paths.preprocessed_data)) if skip_existing else set()
         for root, _, files in os.walk(directory):
             for file in files:
-                if file not in processed_files:
-                    all_files.append(os.path.join(root, file))
+                fpath = os.path.join(root, file)
+                if skip_existing and manifest is not None \
+                        and manifest.classify(fpath)[0] == UNCHANGED:
+                    continue
+                all_files.append(fpath)
     except Exception as e:
         print(f"Error accessing directory {directory}: {e}")
     return all_files
 
 
-def get_chunks(chunk_size=20000, overlap=2000):
-    """To get chunks from text"""
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    docs = []
-    files = get_all_files()
-    
-    for fpath in files:
-        text, meta = get_text(fpath)
-        text = text.lower()
-        if not text:
-            continue
-        # Merge absolute path with PDF metadata
-        meta_clean = {k: v for k, v in meta.items() if v}  # drop Nones
-        meta_clean["source"] = os.path.abspath(fpath)
-        docs.append(Document(page_content=text, metadata=meta_clean))
-    
-    all_splits = text_splitter.split_documents(docs)
-    
-    directory_path = paths.chunks_dir_path
-    file_path = f"{directory_path}/all_splits.pkl"
-    try:
-        os.makedirs(directory_path, exist_ok=True)
-        with open(file_path, 'wb') as f:
-            pickle.dump(all_splits, f)
-    except Exception as e:
-        print(f"Error saving chunks to {file_path}: {e}")
-    
-    return all_splits
+def get_chunks(chunk_size=20000, overlap=2000, workers=INGEST_WORKERS, files=None, sources=None):
+    """
+    To get chunks from text, as a list (see `iter_chunks` for the streaming
+    version; indexed chunks are persisted in the `ChunkStore`). `sources`
+    optionally maps a file path to the `source` stored in metadata
+    (e.g. an upload that will be moved into the data folder).
+    """
+    files = get_all_files() if files is None else files
+    return list(iter_chunks(files, chunk_size, overlap, workers, sources))
 
 
-def get_vectorizer(
-    save_path: str = paths.preprocessed_data,
-    collection_name: str = "rag_docs",
-    host: str = "localhost",
-    port: int = 8010,
+def add_in_batches(vectorstore, docs, ids=None, batch_size: int = EMBED_BATCH_SIZE, on_batch=None):
+    """
+    Embed and upsert `docs` (any iterable of Documents) `batch_size` at a time,
+    so only one batch of chunks/embeddings is held in memory and each HTTP
+    payload to Chroma stays small. The upsert of batch N runs on a background
+    thread while batch N+1 is being embedded. `on_batch(docs, ids)` is called
+    for every batch once it has been queued. Returns the ids, in `docs` order.
+    """
+    collection = vectorstore._collection
+    embedder = vectorstore.embeddings
+    docs = iter(docs)
+    ids = iter(ids) if ids is not None else None
+    all_ids = []
+    done = 0
+    start = time()
+
+    def upsert(batch_ids, texts, vectors, metadatas):
+        collection.upsert(ids=batch_ids, documents=texts, embeddings=vectors, metadatas=metadatas)
+        return len(batch_ids)
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = None
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            batch_ids = [next(ids) if ids is not None else str(uuid4()) for _ in batch]
+            texts = [d.page_content for d in batch]
+            vectors = embedder.embed_documents(texts)
+
+            # wait for the previous write before queuing the next one
+            if pending is not None:
+                done += pending.result()
+                print(f"  {done} chunks upserted ({done / (time() - start):.1f} chunks/sec)")
+            pending = writer.submit(upsert, batch_ids, texts, vectors, [d.metadata for d in batch])
+            all_ids.extend(batch_ids)
+            if on_batch is not None:
+                on_batch(batch, batch_ids)
+
+        if pending is not None:
+            done += pending.result()
+
+    elapsed = time() - start
+    if done:
+        print(f"Upserted {done} chunks in {elapsed:.2f}s ({done / elapsed:.1f} chunks/sec)")
+    return all_ids
+
+
+@contextmanager
+def ingest_lock(path: str = paths.ingest_lock_path):
+    """
+    Inter-process lock held while the manifest, the collection and the local
+    indexes are written, so the CLI and ingestion workers never interleave
+    their updates.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after ~10 s, keep waiting
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class LocalIndexes:
+    """
+    The on-disk indexes kept in step with the vector collection:
+    the chunk store (texts), the BM25 inverted index and the positional
+    index used by literal search.
+    """
+
+    def __init__(self, chunk_store: ChunkStore = None, bm25: BM25Index = None, phrases: PhraseIndex = None):
+        self.chunk_store = chunk_store or ChunkStore()
+        self.bm25 = bm25 or BM25Index()
+        self.phrases = phrases or PhraseIndex()
+
+    @property
+    def lexical(self):
+        return (self.bm25, self.phrases)
+
+    def add(self, docs, ids):
+        self.chunk_store.append(docs, ids)
+        for index in self.lexical:
+            index.add_documents(docs, ids)
+
+    def delete(self, ids):
+        self.chunk_store.delete(ids)
+        for index in self.lexical:
+            index.remove(ids)
+
+    def set_source(self, ids, source):
+        self.chunk_store.set_source(ids, source)
+        for index in self.lexical:
+            index.set_source(ids, source)
+
+    def clear(self):
+        self.chunk_store.delete(self.chunk_store.ids())
+        for index in self.lexical:
+            index.clear()
+
+    def refresh(self):
+        """Pick up what another process (API / CLI) wrote since we loaded."""
+        self.chunk_store.refresh()
+        for index in self.lexical:
+            index.reload_if_changed()
+
+    def ensure_built(self):
+        """Build the lexical indexes from the chunk store if they were never built."""
+        if not len(self.chunk_store):
+            return
+        for index in self.lexical:
+            if not len(index):
+                print(f"Building {type(index).__name__} over {len(self.chunk_store)} chunks …")
+                index.rebuild_from(self.chunk_store)
+
+    def save(self):
+        for index in self.lexical:
+            index.save()
+
+
+def _set_chunk_source(collection, indexes, ids, source):
+    """Point already-embedded chunks at a new `source` (renamed file)."""
+    if not ids:
+        return
+    res = collection.get(ids=ids, include=["metadatas"])
+    metas = [{**(m or {}), "source": source} for m in res["metadatas"]]
+    collection.update(ids=res["ids"], metadatas=metas)
+    indexes.set_source(ids, source)
+    bump_index_version()
+
+
+def delete_chunks(collection, indexes, ids):
+    """Remove chunks from the vector collection and the local indexes."""
+    if ids:
+        collection.delete(ids=ids)
+        indexes.delete(ids)
+        bump_index_version()
+        try:
+            semantic_cache.invalidate_chunks(redis_db.create_redis_client(), ids)
+        except Exception as e:
+            print(f"Could not invalidate cached answers: {e}")
+
+
+def release_source(collection, indexes, manifest, source):
+    """
+    Drop `source` from the manifest. Its chunks move to a live duplicate of
+    the same content when there is one (recorded without chunks), and are
+    deleted otherwise. Returns the number of chunks deleted.
+    """
+    heir = manifest.heir_of(source)
+    if heir is not None:
+        ids = manifest.hand_over(source, heir)
+        _set_chunk_source(collection, indexes, ids, heir)
+        print(f"{len(ids)} chunks of {source} kept for its duplicate {heir}")
+        return 0
+    stale = manifest.forget(source)
+    delete_chunks(collection, indexes, stale)
+    return len(stale)
+
+
+def report_ingest(n_chunks: int, seconds: float):
+    """Print the ingestion throughput and add it to the totals the API exports (/metrics)."""
+    print(f"Ingestion : {n_chunks} chunks in {seconds:.1f}s "
+          f"({n_chunks / seconds if seconds > 0 else 0.0:.1f} chunks/s)")
+    try:
+        metrics.record_ingest(redis_db.create_redis_client(), n_chunks, seconds)
+    except Exception as e:
+        print(f"Could not record ingestion metrics: {e}")
+
+
+def sync_files(
+    vectorstore,
+    files,
+    manifest,
+    sources=None,
+    workers: int = INGEST_WORKERS,
+    chunk_size: int = 20000,
+    overlap: int = 2000,
+    batch_size: int = EMBED_BATCH_SIZE,
+    indexes: LocalIndexes = None,
+    prepared=None,
+    digests=None,
 ):
     """
-    Connects to (or starts) the Chroma collection that holds your vectors.
-    If the collection is empty it populates it from the PDF corpus.
-    Returns a LangChain-wrapped Chroma vector store so the rest of the
-    codebase continues to work unchanged.
+    Index `files` incrementally using the ingestion manifest:
+    unchanged files are skipped, renamed files keep their vectors (only the
+    `source` metadata moves), changed files have their stale chunks deleted
+    from the collection before being re-embedded.
+    `sources` maps a file path to the source it is indexed under
+    (defaults to its absolute path). Embedding/insertion is batched
+    (see `add_in_batches`) and every indexed chunk is added to the local
+    indexes (chunk store, BM25, phrases). Returns the number of chunks added.
+    `prepared` maps a file path to its already extracted chunks (not parsed
+    again) and `digests` to its known SHA-256 (not hashed again).
+    Callers sharing the data folder should hold `ingest_lock()`.
     """
-    embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
+    sources = sources or {}
+    prepared = prepared or {}
+    digests = digests or {}
+    collection = vectorstore._collection
+    indexes = indexes or LocalIndexes()
+    to_embed = {}  # fpath -> (source, digest)
 
-    # 1) Connect to the running Chroma server
-    client = chromadb.HttpClient(
-        host=host,
-        port=port,
-        settings=Settings(anonymized_telemetry=False),
-    )
+    for fpath in files:
+        source = sources.get(fpath, os.path.abspath(fpath))
+        status, digest, other = manifest.classify(fpath, source, digest=digests.get(fpath))
 
-    # 2) Re-use or create the collection (server-side metadata knows if it exists)
-    collection = client.get_or_create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"},          # optional tuning
-    )
+        if status == UNCHANGED:
+            continue
+        if status == RENAMED:
+            ids = manifest.rename(other, source)
+            _set_chunk_source(collection, indexes, ids, source)
+            manifest.record(source, fpath, ids, digest)
+            print(f"Renamed {other} → {source} ({len(ids)} chunks kept)")
+            continue
+        if status == DUPLICATE:
+            manifest.record(source, fpath, [], digest)
+            print(f"{source} is identical to {other}, not re-embedded")
+            continue
+        if status == CHANGED:
+            n_stale = release_source(collection, indexes, manifest, source)
+            if n_stale:
+                print(f"Deleted {n_stale} stale chunks of {source}")
+        to_embed[fpath] = (source, digest)
+
+    n_chunks = 0
+    if to_embed:
+        # stream chunks straight from the PDFs to the batched embedder;
+        # each batch is added to the local indexes as it goes
+        ids_by_source = {}
+
+        def on_batch(docs, ids):
+            indexes.add(docs, ids)
+            for doc, chunk_id in zip(docs, ids):
+                ids_by_source.setdefault(doc.metadata["source"], []).append(chunk_id)
+
+        chunks = chain(
+            chain.from_iterable(prepared[fpath] for fpath in to_embed if fpath in prepared),
+            iter_chunks(
+                [fpath for fpath in to_embed if fpath not in prepared],
+                chunk_size=chunk_size,
+                overlap=overlap,
+                workers=workers,
+                sources={fpath: source for fpath, (source, _) in to_embed.items()},
+            ),
+        )
+        ids = add_in_batches(vectorstore, chunks, batch_size=batch_size, on_batch=on_batch)
+        n_chunks = len(ids)
+        if n_chunks:
+            bump_index_version()
 
-    # 3) Wrap it in the LangChain adapter
-    vectorstore = Chroma(
-        client=client,
-        collection_name=collection_name,
-        embedding_function=embedding_model,
-    )
+        for fpath, (source, digest) in to_embed.items():
+            manifest.record(source, fpath, ids_by_source.get(source, []), digest)
 
-    # 4) First-run bootstrap: load documents only if the DB is still empty
-    if collection.count() == 0:
-        print("Creating Chroma collection and embedding all documents …")
-        all_splits = get_chunks()
-        ids = [str(uuid4()) for _ in range(len(all_splits))]
-        vectorstore.add_documents(all_splits, ids=ids)
-        print(f"{len(all_splits)} chunks inserted in collection ‹{collection_name}›")
+    manifest.save()
+    indexes.save()
+    return n_chunks
 
-    else:
-        print(f"Using existing Chroma collection ‹{collection_name}› "
-              f"({collection.count()} chunks)")
+
+def get_vectorizer(
+    save_path: str = paths.preprocessed_data,
+    collection_name: str = "rag_docs",
+    host: str = clients.CHROMA_HOST,
+    port: int = clients.CHROMA_PORT,
+    workers: int = INGEST_WORKERS,
+    backend: str = VECTOR_BACKEND,
+):
+    """
+    Connects to (or starts) the collection that holds your vectors
+    (Chroma server or local index, see `retriever.load_vectorstore`).
+    The collection is synchronised with the PDF corpus through the ingestion
+    manifest: only new or modified files are embedded, and the chunks of
+    modified or deleted files are removed.
+    Returns a LangChain vector store so the rest of the codebase continues
+    to work unchanged.
+    """
+    embedding_model = clients.get_embedding_model()
+    indexes = LocalIndexes()
+
+    # 1) Connect to the Chroma server (or open the local index) and re-use or
+    #    create the collection, wrapped in its LangChain adapter
+    vectorstore = load_vectorstore(embedding_model, collection_name, backend=backend,
+                                   host=host, port=port, chunk_store=indexes.chunk_store)
+    collection = vectorstore._collection
+
+    # 2) Incremental sync driven by the manifest
+    #    (under the ingest lock: the API workers may be writing too)
+    start = time()
+    with ingest_lock():
+        manifest = IngestManifest()
+        indexes.refresh()
+        if collection.count() == 0:
+            print("Creating the collection and embedding all documents …")
+            manifest.reset()
+            indexes.clear()
+        indexes.ensure_built()
+
+        n_chunks = sync_files(vectorstore, get_all_files(skip_existing=False), manifest,
+                              workers=workers, indexes=indexes)
+
+        # only now purge the files gone from the data folder: a renamed file
+        # has just taken over its old entry in sync_files
+        stale_sources = manifest.stale_sources()
+        for source in stale_sources:
+            n_stale = release_source(collection, indexes, manifest, source)
+            if n_stale:
+                print(f"Removed {n_stale} chunks of deleted file {source}")
+        if stale_sources:
+            manifest.save()
+            indexes.save()
+    report_ingest(n_chunks, time() - start)
+    print(f"{n_chunks} chunks inserted in collection ‹{collection_name}› "
+          f"({collection.count()} chunks)")
+    print(f"Embedding cache : {embedding_model.stats()}")
 
     return vectorstore
 
@@ -237,67 +649,54 @@ def get_vectorizer(
 def add_documents(
     upload_directory: str = paths.upload_dir_path,
     collection_name: str = "rag_docs",
-    host: str = "localhost",
-    port: int = 8010,
+    host: str = clients.CHROMA_HOST,
+    port: int = clients.CHROMA_PORT,
+    workers: int = INGEST_WORKERS,
+    backend: str = VECTOR_BACKEND,
 ):
     """
-    Embeds only the *new* PDFs present in `upload_directory`
-    and appends them to the shared Chroma collection.
+    Embeds the PDFs present in `upload_directory` that are new or modified
+    (according to the ingestion manifest) and appends them to the shared
+    collection. A modified file replaces the chunks of its previous
+    version.
     """
     try:
-        existing_files = set(os.listdir(paths.data_path)) \
-                         if os.path.exists(paths.data_path) else set()
-        new_files = [f for f in os.listdir(upload_directory) if f not in existing_files]
+        upload_files = [os.path.join(upload_directory, f) for f in os.listdir(upload_directory)]
 
-        if not new_files:
+        if not upload_files:
             print("No new documents to process.")
             return
 
-        print(f"Processing {len(new_files)} new documents …")
+        print(f"Processing {len(upload_files)} uploaded documents …")
 
-        # ------------------------------------------------------------------ #
-        # 1) Read & split the new PDFs
-        # ------------------------------------------------------------------ #
-        splitter = RecursiveCharacterTextSplitter(chunk_size=20000, chunk_overlap=2000)
-        new_docs = []
-        for fname in new_files:
-            raw = get_text(os.path.join(upload_directory, fname))
-            if raw:
-                new_docs.append(
-                    Document(page_content=raw, metadata={"source": fname})
-                )
-
-        if not new_docs:
-            print("No readable text found in the uploaded files.")
-            return
-
-        new_splits = splitter.split_documents(new_docs)
+        embedding_model = clients.get_embedding_model()
+        indexes = LocalIndexes()
+        vectorstore = load_vectorstore(embedding_model, collection_name, backend=backend,
+                                       host=host, port=port, chunk_store=indexes.chunk_store)
 
         # ------------------------------------------------------------------ #
-        # 2) Connect to Chroma and append embeddings
+        # 1) Read, split & embed what the manifest does not know yet
         # ------------------------------------------------------------------ #
-        embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
-        client = chromadb.HttpClient(host=host, port=port,
-                                     settings=Settings(anonymized_telemetry=False))
-        vectorstore = Chroma(
-            client=client,
-            collection_name=collection_name,
-            embedding_function=embedding_model,
-        )
-
-        ids = [str(uuid4()) for _ in range(len(new_splits))]
-        vectorstore.add_documents(new_splits, ids=ids)
-        print(f"Added {len(new_splits)} chunks from {len(new_docs)} file(s) to Chroma.")
+        sources = {
+            fpath: os.path.abspath(os.path.join(paths.data_path, os.path.basename(fpath)))
+            for fpath in upload_files
+        }
+        start = time()
+        with ingest_lock():
+            indexes.refresh()
+            n_chunks = sync_files(vectorstore, upload_files, IngestManifest(),
+                                  sources=sources, workers=workers, indexes=indexes)
+        report_ingest(n_chunks, time() - start)
+        print(f"Added {n_chunks} chunks from {len(upload_files)} file(s) to the collection.")
+        print(f"Embedding cache : {embedding_model.stats()}")
 
         # ------------------------------------------------------------------ #
-        # 3) Move the PDFs into your long-term data folder
+        # 2) Move the PDFs into your long-term data folder
         # ------------------------------------------------------------------ #
-        for fname in new_files:
+        for fpath in upload_files:
+            fname = os.path.basename(fpath)
             try:
-                shutil.move(
-                    os.path.join(upload_directory, fname),
-                    os.path.join(paths.data_path, fname)
-                )
+                shutil.move(fpath, os.path.join(paths.data_path, fname))
             except Exception as e:
                 print(f"Error moving file {fname} → {paths.data_path}: {e}")
 
@@ -305,27 +704,30 @@ def add_documents(
         print(f"Error adding documents: {e}")
 
 
-execution_type = sys.argv[1]
+if __name__ == "__main__":
+    # the guard matters: pool workers re-import this module on spawn platforms
+    execution_type = sys.argv[1] if len(sys.argv) > 1 else ""
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else INGEST_WORKERS
 
-if execution_type == "preprocess" :
-    start = time() 
-    get_vectorizer()
-    end = time()
-    duration = end -start 
-    m, s = divmod(duration, 60)
-    print(f"Time for preprocessing : {int(m)}:{int(s):02d}")
+    if execution_type == "preprocess" :
+        start = time() 
+        get_vectorizer(workers=workers)
+        end = time()
+        duration = end -start 
+        m, s = divmod(duration, 60)
+        print(f"Time for preprocessing : {int(m)}:{int(s):02d}")
 
 
-elif execution_type == "add_doc" : 
-    start = time() 
-    add_documents()
-    end = time()
-    duration = end -start 
-    m, s = divmod(duration, 60)
-    print(f"Time for adding documents : {int(m)}:{int(s):02d}")
-    
+    elif execution_type == "add_doc" : 
+        start = time() 
+        add_documents(workers=workers)
+        end = time()
+        duration = end -start 
+        m, s = divmod(duration, 60)
+        print(f"Time for adding documents : {int(m)}:{int(s):02d}")
+        
 
 
-else : 
-    print("Parameter would be 'preprocess' or 'add_doc'" \
-    "\n\nExample : for data preprocessing -------->  python preprocess.py preprocess")
\ No newline at end of file
+    else : 
+        print("Parameter would be 'preprocess' or 'add_doc' (optionally followed by the number of workers)" \
+        "\n\nExample : for data preprocessing -------->  python preprocess.py preprocess 8")
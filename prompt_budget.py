@@ -0,0 +1,117 @@
+import os
+import hashlib
+from langchain_core.documents import Document
+from langchain_core.messages import trim_messages
+from retriever import LRUCache
+from semantic_cache import chunk_key
+
+
+# prompt size allowed per request (prefill is the dominant CPU cost)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 4096))
+# share of it reserved for the conversation history (system message included)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1024))
+# a chunk is truncated to fit only if at least this many tokens are left
+MIN_CHUNK_TOKENS = 128
+# role header / end-of-turn tokens the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 8
+
+
+class PromptBudget:
+    """
+    Assembles the prompt within a fixed token budget, counted with the GGUF
+    model's own tokenizer:
+    system template (fixed) + history (≤ `history_budget`, most recent turns
+    first) + retrieved chunks (in ranking order, the last one truncated or
+    dropped when it does not fit). Per-chunk token counts are cached and
+    written to the chunk metadata as ``n_tokens``; per-message counts are
+    cached too, so trimming the history does not re-tokenize every turn at
+    each step. Tokenization is CPU work: call it off the event loop.
+    """
+
+    def __init__(
+        self,
+        llm,
+        system_template: str,
+        total_budget: int = PROMPT_TOKEN_BUDGET,
+        history_budget: int = HISTORY_TOKEN_BUDGET,
+    ):
+        self.llm = llm
+        self.total_budget = total_budget
+        self.history_budget = history_budget
+        self._chunk_tokens = LRUCache(maxsize=50_000, ttl=float("inf"))
+        self._message_tokens = LRUCache(maxsize=10_000, ttl=float("inf"))
+        self.system_tokens = self.count(system_template.replace("{context}", "")) + MESSAGE_OVERHEAD_TOKENS
+
+    def tokenize(self, text: str):
+        return self.llm.client.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenize(text))
+
+    def message_tokens(self, message) -> int:
+        key = hashlib.sha1(message.content.encode("utf-8")).hexdigest()
+        n = self._message_tokens.get(key)
+        if n is None:
+            n = self.count(message.content)
+            self._message_tokens.put(key, n)
+        return n + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages) -> int:
+        return sum(self.message_tokens(m) for m in messages)
+
+    def trim_history(self, messages):
+        """Keep the latest turns that fit in the history budget."""
+        return trim_messages(
+            messages,
+            strategy="last",
+            start_on="human",
+            end_on=("human", "tool"),
+            token_counter=self.count_messages,
+            include_system=True,
+            max_tokens=self.history_budget,
+        )
+
+    def chunk_tokens(self, doc) -> int:
+        n = doc.metadata.get("n_tokens")
+        if n is None:
+            key = chunk_key(doc)
+            n = self._chunk_tokens.get(key)
+            if n is None:
+                n = self.count(doc.page_content)
+                self._chunk_tokens.put(key, n)
+            doc.metadata["n_tokens"] = n
+        return n
+
+    def fit_context(self, history, docs):
+        """
+        Return (docs that fit, prompt stats). The stats hold the token counts
+        of the system part, the history, the context and their total.
+        """
+        history_tokens = self.count_messages(history)
+        remaining = self.total_budget - self.system_tokens - history_tokens
+        kept = []
+        for doc in docs:
+            n = self.chunk_tokens(doc)
+            if n <= remaining:
+                kept.append(doc)
+                remaining -= n
+            elif remaining >= MIN_CHUNK_TOKENS:
+                tokens = self.tokenize(doc.page_content)[:remaining]
+                text = self.llm.client.detokenize(tokens).decode("utf-8", errors="ignore")
+                kept.append(Document(
+                    id=getattr(doc, "id", None),
+                    page_content=text,
+                    metadata={**doc.metadata, "n_tokens": len(tokens), "truncated": True},
+                ))
+                remaining -= len(tokens)
+            # else: dropped, nothing useful fits anymore
+
+        context_tokens = sum(d.metadata["n_tokens"] for d in kept)
+        stats = {
+            "system": self.system_tokens,
+            "history": history_tokens,
+            "context": context_tokens,
+            "total": self.system_tokens + history_tokens + context_tokens,
+            "chunks": f"{len(kept)}/{len(docs)}",
+        }
+        return kept, stats
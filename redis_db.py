@@ -1,65 +1,200 @@
 from redis import Redis, ConnectionPool
+import redis.asyncio as aioredis
+import os
 import json
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage  # Assurez-vous que AIMessage est défini
 
 # Configuration de la connexion Redis.
 # Pour la confidentialité, vous pouvez activer TLS ou utiliser des ACLs dans votre configuration Redis.
 
+_pool = None        # one connection pool per process, shared by every client
+_async_pool = None  # same for the asyncio clients of the API
+
+
 def create_redis_client():
-    pool = ConnectionPool(host='127.0.0.1', port=6379, max_connections=100, decode_responses=True)
-    return Redis(connection_pool=pool)
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(host='127.0.0.1', port=6379, max_connections=100, decode_responses=True,
+                               health_check_interval=30)
+    return Redis(connection_pool=_pool)
+
+
+def create_async_redis_client():
+    """`redis.asyncio` client on the shared async pool (for code running on the event loop)."""
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = aioredis.ConnectionPool(host='127.0.0.1', port=6379, max_connections=100,
+                                              decode_responses=True, health_check_interval=30)
+    return aioredis.Redis(connection_pool=_async_pool)
+
+
+# messages read back for the prompt: the tail of the session (the system
+# message is stored apart, once per session)
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", 20))
+
+
+def decode_message(message_json):
+    data = json.loads(message_json)
+    role = data.get("role")
+    content = data.get("content")
+    if role == "system":
+        msg = SystemMessage(content=content)
+    elif role == "user":
+        msg = HumanMessage(content=content)
+    elif role == "assistant":
+        msg = AIMessage(content=content)
+        # si on a enregistré la durée, on l’attache à l’objet
+        if "duration" in data:
+            setattr(msg, "duration", data["duration"])
+    else:
+        msg = HumanMessage(content=content)
+    return msg
+
+
+def encode_message(message, **extra) -> str:
+    if isinstance(message, SystemMessage):
+        role = "system"
+    elif isinstance(message, HumanMessage):
+        role = "user"
+    elif isinstance(message, AIMessage):
+        role = "assistant"
+    else:
+        role = "unknown"
+    data = {"role": role, "content": message.content}
+    data.update({k: v for k, v in extra.items() if v is not None})
+    return json.dumps(data)
 
 
 class RedisChatMessageHistory:
     """
     Classe pour gérer l’historique des messages d’une session via Redis.
-    Chaque message est stocké dans une liste sous la clé "chat_history:<session_id>".
+    Chaque message est stocké dans une liste sous la clé "chat_history:<session_id>" ;
+    le message système est stocké une seule fois sous "chat_system:<session_id>".
+
+    Only the last `window` messages are read for the prompt (LRANGE -N -1)
+    and kept decoded in the instance. The cached tail is tagged with the
+    list length it was read at, so one LLEN tells whether anything was
+    appended since (our own appends update the cache directly).
+
+    With a `redis.asyncio` client use the ``a*`` methods: reads take one
+    pipelined round trip (two when the cached tail is stale), and writes can
+    be queued on the caller's MULTI pipeline (`queue_messages`).
     """
-    def __init__(self, session_id: str, redis_client: Redis):
+    def __init__(self, session_id: str, redis_client: Redis, window: int = HISTORY_WINDOW):
         self.session_id = session_id
         self.redis_client = redis_client
         self.key = f"chat_history:{session_id}"
-    
+        self.system_key = f"chat_system:{session_id}"
+        self.window = window
+        self._tail = []        # decoded last messages
+        self._length = None    # list length `_tail` was read at
+        self._system = None    # SystemMessage, or False once known to be absent
+
     def get_messages(self):
-        """Récupère l’ensemble des messages depuis Redis."""
-        messages = []
-        for message_json in self.redis_client.lrange(self.key, 0, -1):
-            data = json.loads(message_json)
-            role = data.get("role")
-            content = data.get("content")
-            if role == "system":
-                msg = SystemMessage(content=content)
-            elif role == "user":
-                msg = HumanMessage(content=content)
-            elif role == "assistant":
-                msg = AIMessage(content=content)
-                # si on a enregistré la durée, on l’attache à l’objet
-                if "duration" in data:
-                    setattr(msg, "duration", data["duration"])
-            else:
-                msg = HumanMessage(content=content)
-            messages.append(msg)
-        return messages
+        """Récupère l’ensemble des messages depuis Redis (historique complet, sans cache)."""
+        return [decode_message(m) for m in self.redis_client.lrange(self.key, 0, -1)]
+
+    def tail(self, n: int = None):
+        """The last `n` messages (default: the window), from the cache when the list has not grown."""
+        n = n or self.window
+        length = self.redis_client.llen(self.key)
+        if length != self._length or (n > len(self._tail) and len(self._tail) < length):
+            fetch = max(n, self.window)
+            self._tail = [decode_message(m) for m in self.redis_client.lrange(self.key, -fetch, -1)]
+            self._length = length
+        return self._tail[-n:]
+
+    def last_message(self):
+        tail = self.tail(1)
+        return tail[-1] if tail else None
+
+    def system_message(self):
+        if self._system is None:
+            content = self.redis_client.get(self.system_key)
+            self._system = SystemMessage(content=content) if content is not None else False
+        return self._system or None
+
+    def ensure_system(self, content: str):
+        """Store the system message once per session (no-op when it exists)."""
+        if self.system_message() is None:
+            self.redis_client.set(self.system_key, content, nx=True)
+            self._system = None  # re-read: another worker may have set it first
 
     @property
     def messages(self):
-        """Permet d’accéder aux messages comme à une propriété (pour compatibilité avec votre code existant)."""
-        return self.get_messages()
-    
-    def add_message(self, message):
-        """Ajoute un message à l’historique dans Redis."""
+        """Message système + fenêtre des derniers messages (ce que le prompt utilise)."""
+        system = self.system_message()
+        # sessions written before the system key existed keep it in the list
+        turns = [m for m in self.tail() if not isinstance(m, SystemMessage)]
+        return ([system] if system is not None else []) + turns
+
+    def add_message(self, message, **extra):
+        """Ajoute un message à l’historique dans Redis (`extra`: champs stockés avec, ex. duration)."""
         if isinstance(message, SystemMessage):
-            role = "system"
-        elif isinstance(message, HumanMessage):
-            role = "user"
-        elif isinstance(message, AIMessage):
-            role = "assistant"
+            self.redis_client.set(self.system_key, message.content)
+            self._system = message
+            return
+        # La commande RPush est atomique sur Redis ; elle renvoie la nouvelle longueur.
+        length = self.redis_client.rpush(self.key, encode_message(message, **extra))
+        self._appended(message, length, **extra)
+
+    def _appended(self, message, length, **extra):
+        """Keep the cached tail in step with an append that made the list `length` long."""
+        if self._length is not None and length == self._length + 1:
+            if "duration" in extra:
+                setattr(message, "duration", extra["duration"])
+            self._tail = (self._tail + [message])[-max(self.window, len(self._tail)):]
+            self._length = length
         else:
-            role = "unknown"
-        data = {"role": role, "content": message.content}
-        # La commande RPush est atomique sur Redis.
-        self.redis_client.rpush(self.key, json.dumps(data))
-    
+            self._length = None  # someone else appended too: re-read next time
+
+    # async API (redis.asyncio client) -----------------------------------
+
+    async def atail(self, n: int = None):
+        n = n or self.window
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.llen(self.key)
+        if self._system is None:
+            pipe.get(self.system_key)
+        results = await pipe.execute()
+        length = results[0]
+        if self._system is None:
+            self._system = SystemMessage(content=results[1]) if results[1] is not None else False
+        if length != self._length or (n > len(self._tail) and len(self._tail) < length):
+            fetch = max(n, self.window)
+            self._tail = [decode_message(m) for m in await self.redis_client.lrange(self.key, -fetch, -1)]
+            self._length = length
+        return self._tail[-n:]
+
+    async def alast_message(self):
+        tail = await self.atail(1)
+        return tail[-1] if tail else None
+
+    async def aget_messages(self):
+        """Async `messages`: system message (if stored) + the tail window."""
+        turns = [m for m in await self.atail() if not isinstance(m, SystemMessage)]
+        system = self._system or None
+        return ([system] if system is not None else []) + turns
+
+    async def aget_all_messages(self):
+        return [decode_message(m) for m in await self.redis_client.lrange(self.key, 0, -1)]
+
+    def queue_system(self, pipe, content: str):
+        """Queue the once-per-session SET NX of the system message."""
+        pipe.set(self.system_key, content, nx=True)
+
+    def queue_messages(self, pipe, messages):
+        """Queue the RPUSH of each (message, extra) pair; hand the replies to `record_appends`."""
+        for message, extra in messages:
+            pipe.rpush(self.key, encode_message(message, **extra))
+
+    def record_appends(self, messages, lengths):
+        """Update the cached tail from the RPUSH replies of `queue_messages`."""
+        for (message, extra), length in zip(messages, lengths):
+            self._appended(message, length, **extra)
+        if self._system is False:
+            self._system = None  # the system message was just stored: re-read it
+
     def add_ai_message(self, content: str):
         """Méthode utilitaire pour ajouter un message de l'assistant."""
         ai_msg = AIMessage(content=content)
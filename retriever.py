@@ -1,56 +1,359 @@
 import os
 import paths
 from langchain_core.runnables import RunnablePassthrough
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Tuple
 import asyncio
 import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_chroma import Chroma
-import chromadb
-from chromadb.utils import embedding_functions
+import clients
+import metrics
 
 from langchain.vectorstores.base import VectorStoreRetriever
+from langchain_core.documents import Document
+from semantic_cache import chunk_key
 
 
 
 NB_DOCS = 2
 OPTIMIZED_INDEX_PATH = paths.faiss_index_path
 
+# query-embedding / retrieval-result caches
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+
+# vector backend: "chroma" (HTTP server) | "local" (in-process memory-mapped index)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# retrieval mode of the chat retriever: "vector" | "hybrid" (BM25 + vector)
+CHAT_RETRIEVAL_MODE = os.getenv("CHAT_RETRIEVAL_MODE", "vector")
+# reciprocal-rank-fusion constant
+RRF_K = 60
+
+# threads embedding queries for the async path (bounded: the model is CPU-bound)
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", 2))
+
+
+
+# Index version & caches -------------------------------------------------------
+
+def index_version() -> int:
+    """Version stamp of the indexed corpus (mtime of the version file, 0 if never written)."""
+    try:
+        return os.stat(paths.index_version_path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_index_version():
+    """Called after every write to the collection; works across processes (API / CLI)."""
+    os.makedirs(os.path.dirname(paths.index_version_path), exist_ok=True)
+    with open(paths.index_version_path, "w") as f:
+        f.write(str(time.time_ns()))
+
+
+class LRUCache:
+    """
+    Small LRU cache with per-entry TTL and hit/miss counters. Thread-safe: it
+    is used from the event loop, the search legs pool and `asyncio.to_thread`.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+query_embedding_cache = LRUCache()   # query -> embedding (independent of the corpus)
+result_cache = LRUCache()            # (query, mode, k) -> results, dropped on index change
+_seen_version = index_version()
+
+
+def _fresh_result_cache() -> LRUCache:
+    """Return the result cache, emptied first if the collection changed since last look."""
+    global _seen_version
+    version = index_version()
+    if version != _seen_version:
+        result_cache.clear()
+        _seen_version = version
+    return result_cache
+
+
+def cache_stats() -> Dict:
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "results": result_cache.stats(),
+        "index_version": _seen_version,
+    }
+
+
+
+# Hybrid retrieval -------------------------------------------------------------
+
+# both legs of a hybrid query run side by side on this pool
+_legs_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval-leg")
+# query embeddings of the async path, off the event loop
+embedding_pool = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+
+# per-leg latency (seconds): count / total / last / max
+leg_latency = {leg: {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0} for leg in ("vector", "bm25")}
+# legs of concurrent queries finish on several threads at once
+_leg_latency_lock = threading.Lock()
+
+
+def _record_leg(leg: str, elapsed: float):
+    with _leg_latency_lock:
+        stats = leg_latency[leg]
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["last"] = elapsed
+        stats["max"] = max(stats["max"], elapsed)
+
+
+def _timed_leg(leg: str, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        _record_leg(leg, time.perf_counter() - start)
+
+
+async def _atimed_leg(leg: str, awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        _record_leg(leg, time.perf_counter() - start)
+
+
+def latency_stats() -> Dict:
+    with _leg_latency_lock:
+        return {
+            leg: {**stats, "avg": stats["total"] / stats["count"] if stats["count"] else 0.0}
+            for leg, stats in leg_latency.items()
+        }
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse several rankings (lists of ids, best first) into one [(id, score)] list."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
 
 
 class VectorStoreRetrieverChromaWorkAround(VectorStoreRetriever):
     actual_k: int = NB_DOCS
-
-    def invoke(self, query: str):
-        docs = super().invoke(query)
+    search_mode: str = "vector"   # "vector" | "hybrid"
+    bm25: Any = None              # lexical_index.BM25Index, for hybrid mode
+    chunk_store: Any = None       # chunk_store.ChunkStore, to load BM25-only hits
+    phrases: Any = None           # lexical_index.PhraseIndex, for literal search
+    async_collection: Any = None  # Chroma collection of an AsyncHttpClient (async path)
+
+    def embed_query(self, query: str):
+        """Query embedding, served from the in-memory LRU when possible."""
+        vector = query_embedding_cache.get(query)
+        if vector is None:
+            vector = self.vectorstore.embeddings.embed_query(query)
+            query_embedding_cache.put(query, vector)
+        return vector
+
+    def vector_search(self, query: str):
+        docs = self.vectorstore.similarity_search_by_vector(
+            self.embed_query(query), **self.search_kwargs
+        )
         # Trie les documents par score décroissant (par exemple en supposant que le score est dans metadata['score'])
-        sorted_docs = sorted(docs, key=lambda doc: doc.metadata.get("score", 0), reverse=True)
-        return sorted_docs[: self.actual_k]
+        return sorted(docs, key=lambda doc: doc.metadata.get("score", 0), reverse=True)
+
+    def bm25_search(self, query: str):
+        self.bm25.reload_if_changed()
+        return self.bm25.search(query, k=self.search_kwargs.get("k", 20))
+
+    def hybrid_search(self, query: str):
+        """
+        BM25 and vector rankings fetched concurrently, fused with reciprocal
+        rank fusion. Each leg's latency is recorded in `leg_latency`.
+        """
+        vector_future = _legs_pool.submit(_timed_leg, "vector", self.vector_search, query)
+        bm25_future = _legs_pool.submit(_timed_leg, "bm25", self.bm25_search, query)
+        return self._fuse(vector_future.result(), bm25_future.result())
+
+    def _fuse(self, vector_docs, bm25_hits):
+        docs_by_id = {chunk_key(d): d for d in vector_docs}
+        fused = reciprocal_rank_fusion([list(docs_by_id), [chunk_id for chunk_id, _ in bm25_hits]])
+
+        self.chunk_store.refresh()
+        docs = []
+        for chunk_id, score in fused:
+            doc = docs_by_id.get(chunk_id) or self.chunk_store.get(chunk_id)
+            if doc is not None:
+                doc.metadata["rrf_score"] = score
+                docs.append(doc)
+        return docs
+
+    def phrase_search(self, query: str, k: int):
+        """Chunks containing `query` literally, most occurrences first (no embedding)."""
+        self.phrases.reload_if_changed()
+        self.chunk_store.refresh()
+        docs = []
+        for chunk_id, occurrences in self.phrases.search(query, k=k):
+            doc = self.chunk_store.get(chunk_id)
+            if doc is not None:
+                doc.metadata["occurrences"] = occurrences
+                docs.append(doc)
+        return docs
+
+    def _search(self, query: str):
+        cache = _fresh_result_cache()
+        key = (query, self.search_mode, self.search_type, self.search_kwargs.get("k"), self.actual_k)
+        docs = cache.get(key)
+        if docs is None:
+            if self.search_mode == "hybrid":
+                docs = self.hybrid_search(query)[: self.actual_k]
+            else:
+                docs = _timed_leg("vector", self.vector_search, query)[: self.actual_k]
+            cache.put(key, docs)
+        return list(docs)
+
+    def invoke(self, query: str, config=None, **kwargs):
+        return self._search(query)
+
+    # async path: nothing below blocks the event loop ------------------------
+
+    async def aembed_query(self, query: str):
+        vector = query_embedding_cache.get(query)
+        if vector is None:
+            loop = asyncio.get_running_loop()
+            with metrics.query_embedding.time():
+                vector = await loop.run_in_executor(embedding_pool, self.vectorstore.embeddings.embed_query, query)
+            query_embedding_cache.put(query, vector)
+        return vector
+
+    async def avector_search(self, query: str):
+        vector = await self.aembed_query(query)
+        if self.async_collection is None:  # local backend (in-process, releases the GIL in NumPy)
+            with metrics.vector_search.time(backend="local"):
+                docs = await asyncio.to_thread(self.vectorstore.similarity_search_by_vector, vector, **self.search_kwargs)
+        else:
+            with metrics.vector_search.time(backend="chroma"):
+                res = await self.async_collection.query(
+                    query_embeddings=[vector],
+                    n_results=self.search_kwargs.get("k", 4),
+                    include=["documents", "metadatas"],
+                )
+            docs = [
+                Document(id=chunk_id, page_content=text, metadata=meta or {})
+                for chunk_id, text, meta in zip(res["ids"][0], res["documents"][0], res["metadatas"][0])
+            ]
+        return sorted(docs, key=lambda doc: doc.metadata.get("score", 0), reverse=True)
+
+    async def ahybrid_search(self, query: str):
+        vector_docs, bm25_hits = await asyncio.gather(
+            _atimed_leg("vector", self.avector_search(query)),
+            _atimed_leg("bm25", asyncio.to_thread(self.bm25_search, query)),
+        )
+        return await asyncio.to_thread(self._fuse, vector_docs, bm25_hits)
 
-    async def ainvoke(self, query: str):
-        docs = await super().ainvoke(query)
-        sorted_docs = sorted(docs, key=lambda doc: doc.metadata.get("score", 0), reverse=True)
-        return sorted_docs[: self.actual_k]
+    async def _asearch(self, query: str):
+        cache = _fresh_result_cache()
+        key = (query, self.search_mode, self.search_type, self.search_kwargs.get("k"), self.actual_k)
+        docs = cache.get(key)
+        if docs is None:
+            if self.search_mode == "hybrid":
+                docs = (await self.ahybrid_search(query))[: self.actual_k]
+            else:
+                docs = (await _atimed_leg("vector", self.avector_search(query)))[: self.actual_k]
+            cache.put(key, docs)
+        return list(docs)
+
+    async def ainvoke(self, query: str, config=None, **kwargs):
+        return await self._asearch(query)
 
 
 
  
 # Vector store helpers
 
-def load_vectorstore(embedding_model, collection_name: str = "rag_docs"):
-    
-    client = chromadb.HttpClient(host="localhost", port=8010)
+def load_vectorstore(
+    embedding_model,
+    collection_name: str = "rag_docs",
+    backend: str = VECTOR_BACKEND,
+    host: str = clients.CHROMA_HOST,
+    port: int = clients.CHROMA_PORT,
+    chunk_store=None,
+):
+    """
+    Vector store for `backend`: the Chroma collection served over HTTP, or
+    the in-process `LocalVectorStore` (texts read from `chunk_store`).
+    Both expose the Chroma-collection methods used by ingestion as
+    `vectorstore._collection`.
+    """
+    if backend == "local":
+        from local_vectorstore import LocalVectorStore
+        return LocalVectorStore(embedding_model, chunk_store=chunk_store)
+
     return Chroma(
-        client=client,
+        client=clients.get_chroma_client(host, port),
         collection_name=collection_name,
         embedding_function=embedding_model,
+        collection_metadata={"hnsw:space": "cosine"},
     )
 
 
 
 # Retriever & chain
 
-def get_retriever(vectorstore, generator_chain, k: int = NB_DOCS):
+def get_retriever(
+    vectorstore,
+    generator_chain,
+    k: int = NB_DOCS,
+    mode: str = CHAT_RETRIEVAL_MODE,
+    bm25=None,
+    chunk_store=None,
+    phrases=None,
+):
 
     def parse_retriever_input(params: Dict):
         return params["messages"][-1].content
@@ -61,6 +364,10 @@ def get_retriever(vectorstore, generator_chain, k: int = NB_DOCS):
         search_kwargs={"k": 20},
         search_type="similarity",
         actual_k=k,  # final number of docs returned
+        search_mode=mode,
+        bm25=bm25,
+        chunk_store=chunk_store,
+        phrases=phrases,
     )
 
     collection = vectorstore._collection  # underlying Chroma collection
@@ -85,34 +392,39 @@ def verification(filepath: str) -> str:
 async def get_best_files(
     query: str,
     retriever,
-    mode: str = "vector",  # "vector" | "words"
+    mode: str = "vector",  # "vector" | "words" | "hybrid"
     k: int = 5,
 ) -> Tuple[List[str], List[Dict]]:
     """Return (list_of_file_paths, list_of_metadatas) for the *k* best docs."""
 
-    docs = await retriever.ainvoke(query)  # async embed‑&‑search
+    cache = _fresh_result_cache()
+    key = (query, mode, k)
+    cached = cache.get(key)
+    if cached is not None:
+        return list(cached[0]), list(cached[1])
+
+    doc_paths, metas = await _search_best_files(query, retriever, mode, k)
+    cache.put(key, (doc_paths, metas))
+    return doc_paths, metas
 
+
+async def _search_best_files(query: str, retriever, mode: str, k: int):
     if mode == "vector":
+        docs = await retriever.ainvoke(query)  # async embed‑&‑search
+
         doc_paths, metas = [], []
         for d in docs[:k]:
             doc_paths.append(d.metadata.get("source"))
             metas.append(d.metadata)
 
-    else:  # -------- literal “Words” mode --------
-        query_lower = query.lower()
+    elif mode == "hybrid":  # -------- BM25 + vector, fused --------
+        docs = await retriever.ahybrid_search(query)
+        doc_paths = [d.metadata.get("source") for d in docs[:k]]
+        metas = [d.metadata for d in docs[:k]]
 
-        collection = retriever.vectorstore._collection
-        collection._embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=paths.bert_model_path
-        )
-
-        res = await asyncio.to_thread(
-            collection.query,
-            query_texts=[query_lower],
-            n_results=k,
-            where_document={"$contains": query_lower},
-        )
-        doc_paths = [m.get("source") for m in res["metadatas"][0]]
-        metas = res["metadatas"][0]
+    else:  # -------- literal “Words” mode --------
+        docs = await asyncio.to_thread(retriever.phrase_search, query, k)
+        doc_paths = [d.metadata.get("source") for d in docs]
+        metas = [d.metadata for d in docs]
 
     return doc_paths, metas
\ No newline at end of file
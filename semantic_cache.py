@@ -0,0 +1,193 @@
+import os
+import json
+import math
+import hashlib
+import time
+from uuid import uuid4
+
+
+# cosine similarity above which a cached answer is reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 24 * 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 5000))
+
+PREFIX = "semcache"
+
+
+def chunk_key(doc) -> str:
+    """Stable id of a retrieved chunk (vector-store id, or content hash as a fallback)."""
+    doc_id = getattr(doc, "id", None)
+    if doc_id:
+        return str(doc_id)
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def context_key(chunk_ids) -> str:
+    return hashlib.sha1("|".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+
+
+def cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class SemanticCache:
+    """
+    Redis-backed cache of answers, reused for near-paraphrases asked against
+    the same retrieved context.
+
+    Keys:
+    • ``semcache:entry:<id>``  hash {question, vector, chunks, answer}, with a TTL;
+    • ``semcache:ctx:<hash>``  set of entry ids sharing one retrieved context
+      (only those are compared with a new question);
+    • ``semcache:chunk:<id>``  set of context hashes using a chunk, to invalidate
+      entries when the chunk is deleted or replaced;
+    • ``semcache:lru``         zset entry id → last use, for size-based eviction.
+
+    It runs on the API event loop: `redis_client` is a ``redis.asyncio``
+    client and `embed_fn` a coroutine function.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        embed_fn,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.redis_client = redis_client
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    async def lookup(self, question: str, docs):
+        """Return a cached answer for `question` given the retrieved `docs`, or None."""
+        ctx = context_key([chunk_key(d) for d in docs])
+        entry_ids = list(await self.redis_client.smembers(f"{PREFIX}:ctx:{ctx}"))
+        if not entry_ids:
+            self.misses += 1
+            return None
+
+        pipe = self.redis_client.pipeline()
+        for entry_id in entry_ids:
+            pipe.hmget(f"{PREFIX}:entry:{entry_id}", "vector", "answer")
+        rows = await pipe.execute()
+
+        vector = await self.embed_fn(question)
+        best, best_id, expired = None, None, []
+        best_score = self.threshold
+        for entry_id, (raw_vector, answer) in zip(entry_ids, rows):
+            if raw_vector is None:
+                expired.append(entry_id)
+                continue
+            score = cosine(vector, json.loads(raw_vector))
+            if score >= best_score:
+                best, best_id, best_score = answer, entry_id, score
+
+        pipe = self.redis_client.pipeline()
+        if expired:
+            pipe.srem(f"{PREFIX}:ctx:{ctx}", *expired)
+            pipe.zrem(f"{PREFIX}:lru", *expired)
+        if best_id is not None:
+            pipe.zadd(f"{PREFIX}:lru", {best_id: time.time()})
+        await pipe.execute()
+
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return best
+
+    async def store(self, question: str, docs, answer: str):
+        """Cache `answer` for `question` asked against `docs`."""
+        chunk_ids = [chunk_key(d) for d in docs]
+        ctx = context_key(chunk_ids)
+        entry_id = uuid4().hex
+        vector = await self.embed_fn(question)
+
+        pipe = self.redis_client.pipeline()
+        pipe.hset(f"{PREFIX}:entry:{entry_id}", mapping={
+            "question": question,
+            "vector": json.dumps(list(vector)),
+            "chunks": json.dumps(chunk_ids),
+            "ctx": ctx,
+            "answer": answer,
+        })
+        pipe.expire(f"{PREFIX}:entry:{entry_id}", self.ttl)
+        pipe.sadd(f"{PREFIX}:ctx:{ctx}", entry_id)
+        pipe.expire(f"{PREFIX}:ctx:{ctx}", self.ttl)
+        for chunk_id in chunk_ids:
+            pipe.sadd(f"{PREFIX}:chunk:{chunk_id}", ctx)
+            pipe.expire(f"{PREFIX}:chunk:{chunk_id}", self.ttl)
+        pipe.zadd(f"{PREFIX}:lru", {entry_id: time.time()})
+        pipe.zcard(f"{PREFIX}:lru")
+        size = (await pipe.execute())[-1]
+
+        if size > self.max_entries:
+            await self._evict(size - self.max_entries)
+
+    async def _evict(self, n: int):
+        """Drop the `n` least recently used entries."""
+        victims = [entry_id for entry_id, _ in await self.redis_client.zpopmin(f"{PREFIX}:lru", n)]
+        await self._delete_entries(victims)
+
+    async def _delete_entries(self, entry_ids):
+        if not entry_ids:
+            return
+        pipe = self.redis_client.pipeline()
+        for entry_id in entry_ids:
+            pipe.hget(f"{PREFIX}:entry:{entry_id}", "ctx")
+        contexts = await pipe.execute()
+
+        pipe = self.redis_client.pipeline()
+        for entry_id, ctx in zip(entry_ids, contexts):
+            pipe.delete(f"{PREFIX}:entry:{entry_id}")
+            pipe.zrem(f"{PREFIX}:lru", entry_id)
+            if ctx:
+                pipe.srem(f"{PREFIX}:ctx:{ctx}", entry_id)
+        await pipe.execute()
+
+    async def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": await self.redis_client.zcard(f"{PREFIX}:lru"),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def invalidate_chunks(redis_client, chunk_ids):
+    """
+    Forget every cached answer whose context used one of `chunk_ids`
+    (sync: called by the ingestion code, outside the event loop).
+    """
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return 0
+    pipe = redis_client.pipeline()
+    for chunk_id in chunk_ids:
+        pipe.smembers(f"{PREFIX}:chunk:{chunk_id}")
+    contexts = set().union(*pipe.execute())
+
+    pipe = redis_client.pipeline()
+    for ctx in contexts:
+        pipe.smembers(f"{PREFIX}:ctx:{ctx}")
+    entry_ids = set().union(*pipe.execute()) if contexts else set()
+
+    pipe = redis_client.pipeline()
+    for entry_id in entry_ids:
+        pipe.delete(f"{PREFIX}:entry:{entry_id}")
+        pipe.zrem(f"{PREFIX}:lru", entry_id)
+    for ctx in contexts:
+        pipe.delete(f"{PREFIX}:ctx:{ctx}")
+    for chunk_id in chunk_ids:
+        pipe.delete(f"{PREFIX}:chunk:{chunk_id}")
+    pipe.execute()
+    return len(entry_ids)
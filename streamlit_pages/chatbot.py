@@ -2,9 +2,10 @@
 import streamlit as st
 import requests
 import uuid
+import json
 import time
-from datetime import datetime
 import redis_db
+import metrics_rollup
 from streamlit_cookies_manager import EncryptedCookieManager
 
 
@@ -30,15 +31,42 @@ def save_feedback(msg_index):
     st.session_state.history[msg_index]["feedback"] = fb
 
     
-    date_str = datetime.utcnow().date().isoformat()
-    key = f"feedback:{'positive' if fb else 'negative'}:{date_str}"
-    redis_client.incr(key)
-
-def stream_data_with_time(text, duration_str):
-    """Streaming mot-à-mot + affichage de la durée à la fin."""
-    for word in (text + f" \n\n*⏱️ {duration_str}*").split(" "):
-        yield word + " "
-        time.sleep(0.05)
+    pipe = redis_client.pipeline(transaction=False)
+    metrics_rollup.record_feedback(pipe, bool(fb))
+    pipe.execute()
+
+def stream_chat(user_input, session_id, result):
+    """
+    Yield the tokens of /chat/stream as they arrive (Server-Sent Events), then
+    the duration. `result` is filled with the final text, duration and ttft.
+    """
+    start = time.time()
+    parts = []
+    with requests.post(
+        f"{FASTAPI_URL}/chat/stream",
+        params={"user_input": user_input, "session_id": session_id},
+        headers=headers,
+        stream=True,
+    ) as resp:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "token" in event:
+                if not parts:
+                    # client-side time to first token (includes queueing)
+                    result["ttft"] = time.time() - start
+                parts.append(event["token"])
+                yield event["token"]
+            elif event.get("done"):
+                result["duration"] = event.get("duration", 0.0)
+                result["server_ttft"] = event.get("ttft")
+            elif "error" in event:
+                st.error(event["error"])
+
+    result["content"] = "".join(parts)
+    m, s = divmod(result.get("duration", time.time() - start), 60)
+    yield f"  \n\n*⏱️ {int(m)}:{int(s):02d}*"
 
 # ========================================================================
 # Manage persistent session_id via cookie
@@ -124,37 +152,16 @@ if user_input :
         st.write(user_input)
     st.session_state.history.append({"role": "user", "content": user_input})
 
-    # save (stats) for daily users
-    date_str = datetime.utcnow().date().isoformat()
-    redis_client.sadd(f"users:{date_str}", session_id)
-
-    # call API +  time
-    with st.spinner("Génération en cours…", show_time=True):
-        resp = requests.post(
-            f"{FASTAPI_URL}/chat",
-            params={"user_input": user_input, "session_id": session_id},
-            headers=headers
-        ).json()
-
-    # calculation and duration storing
-    elapsed = resp.get("duration",0.0)
-    m, s = divmod(elapsed, 60)
-    formatted = f"{int(m)}:{int(s):02d}"
-
-    # add AI response on chat history
-    ai_text = resp["response"]
-    st.session_state.history.append({
-        "role": "assistant",
-        "content": ai_text,
-        "duration": elapsed
-    })
-
-   
+    # save (stats) for daily / weekly / monthly users
+    pipe = redis_client.pipeline(transaction=False)
+    metrics_rollup.record_user(pipe, session_id)
+    pipe.execute()
 
-    # display ai response and feedbacks widget
+    # call API and render the tokens as they are generated
+    result = {}
     with st.chat_message("assistant"):
-        st.write_stream(stream_data_with_time(ai_text, formatted))
-        idx = len(st.session_state.history) - 1
+        st.write_stream(stream_chat(user_input, session_id, result))
+        idx = len(st.session_state.history)
         st.session_state[f"feedback_{idx}"] = None
         st.feedback(
             options="thumbs",
@@ -162,6 +169,14 @@ if user_input :
             on_change=save_feedback,
             args=[idx],
         )
+
+    # add AI response on chat history
+    st.session_state.history.append({
+        "role": "assistant",
+        "content": result.get("content", ""),
+        "duration": result.get("duration", 0.0),
+        "ttft": result.get("ttft"),
+    })
     
     st.session_state.disable_button = False
     st.session_state.disable = False
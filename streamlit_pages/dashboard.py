@@ -2,7 +2,7 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-import redis_db
+import requests
 
 
 # --- AUTHENTIFICATION ---
@@ -26,76 +26,87 @@ if not st.session_state.authed:
     st.stop()
 
 
-# Redis client
-r = redis_db.create_redis_client()
+FASTAPI_URL = "http://127.0.0.1:8000"
+# seconds a summary is reused before asking the API again
+SUMMARY_TTL = 60
+
+RANGES = {"7 days": 7, "30 days": 30, "365 days": 365}
 
-# 7 last days
-today = datetime.utcnow().date()
-days = [today - timedelta(days=i) for i in range(6, -1, -1)]
-dates = [d.isoformat() for d in days]
 
-# Retrieve data from redis
-user_counts = [r.scard(f"users:{date}") for date in dates]
-pos = [int(r.get(f"feedback:positive:{date}") or 0) for date in dates]
-neg = [int(r.get(f"feedback:negative:{date}") or 0) for date in dates]
-responses = [int(r.get(f"responses:{date}") or 0) for date in dates]
+@st.cache_data(ttl=SUMMARY_TTL, show_spinner=False)
+def fetch_summary(start: str, end: str):
+    """Rollup summary of the API (one pipelined Redis read server-side), cached."""
+    resp = requests.get(f"{FASTAPI_URL}/metrics/summary", params={"from": start, "to": end})
+    resp.raise_for_status()
+    return resp.json()
 
 
+days = RANGES[st.radio("Period", list(RANGES), horizontal=True)]
+today = datetime.utcnow().date()
+try:
+    summary = fetch_summary((today - timedelta(days=days - 1)).isoformat(), today.isoformat())
+except requests.RequestException as e:
+    st.error(f"Metrics unavailable: {e}")
+    st.stop()
 
-# the mean of duration
-avg_response_times = []
-for date in dates:
-    # list string converted to float
-    lst = r.lrange(f"response_times:{date}", 0, -1)
-    floats = [float(v) for v in lst] if lst else []
-    avg = sum(floats) / len(floats) if floats else 0
-    avg_response_times.append(round(avg, 2))
+series = summary["series"]
+periods = [point["period"] for point in series]
 
-# DataFrame for duration
-df_rt = pd.DataFrame({"Temps de réponse moyen (s)": avg_response_times}, index=dates)
 
+def latency_frame(stage):
+    """DataFrame p50/p90/p99 (s) of a stage over the periods."""
+    return pd.DataFrame({
+        q: [round(point["latency"][stage][q] or 0, 2) for point in series]
+        for q in ("p50", "p90", "p99")
+    }, index=periods)
 
-# Calculation of all feedbacks and percentage
-total_fb = [pos[i] + neg[i] for i in range(len(dates))]
-rates = [(total_fb[i] / responses[i]) if responses[i] > 0 else 0 for i in range(len(dates))]
 
-# Dataframe for daily users
+# Dataframe for users per period
 df_users = pd.DataFrame({
-    "Date": dates,
-    "Utilisateurs": user_counts
+    "Date": periods,
+    "Utilisateurs": [point["users"] for point in series]
 }).set_index("Date")
 
-# DataFrame for daily feedbacks
+# DataFrame for feedbacks per period
 df_fb = pd.DataFrame({
-    "Positifs": pos,
-    "Négatifs": neg
-}, index=dates)
+    "Positifs": [point["feedback_positive"] for point in series],
+    "Négatifs": [point["feedback_negative"] for point in series]
+}, index=periods)
 
 # DataFrame for  feedback percentage
 df_rate = pd.DataFrame({
-    "Taux de feedback (%)": [round(rate * 100, 2) for rate in rates]
-}, index=dates)
+    "Taux de feedback (%)": [round(point["feedback_rate"] * 100, 2) for point in series]
+}, index=periods)
 
 st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
 
 # Streamlit UI
 st.title("📊 Dashboard RAG")
 
-st.subheader("Users per day")
+st.subheader(f"Users per {summary['granularity']}")
+st.metric("Distinct users over the period", summary["total"]["users"])
 st.bar_chart(df_users)
 
-st.subheader("Positives vs négatives feedbacks (per day)")
+st.subheader(f"Positives vs négatives feedbacks (per {summary['granularity']})")
 st.bar_chart(df_fb)
 
 st.subheader("Feedbacks rate (feedbacks / réponses IA)")
 
-# KPI for most recent percentage of feedbacks
-dernier_taux = df_rate["Taux de feedback (%)"].iloc[-1]
-st.metric("Current feedbacks rate (%)", f"{dernier_taux}%")
+# KPI for the percentage of feedbacks over the period
+taux = round(summary["total"]["feedback_rate"] * 100, 2)
+st.metric("Feedbacks rate over the period (%)", f"{taux}%")
 
-# Graph for the feedbacks of the week
+# Graph for the feedbacks of the period
 st.area_chart(df_rate)
 
-# Graph for the duration 
-st.subheader("⏱️ average response time per day in seconds")
-st.line_chart(df_rt)
+# Graphs for the durations
+st.subheader(f"⏱️ response time per {summary['granularity']} in seconds (p50 / p90 / p99)")
+st.line_chart(latency_frame("total"))
+
+col_retrieval, col_generation = st.columns(2)
+with col_retrieval:
+    st.caption("Retrieval")
+    st.line_chart(latency_frame("retrieval"))
+with col_generation:
+    st.caption("Generation")
+    st.line_chart(latency_frame("generation"))
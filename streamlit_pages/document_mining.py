@@ -19,7 +19,7 @@ show_meta = st.sidebar.checkbox("Afficher les métadonnées", value=False)
 # ---------- 2b.  Mode de recherche ------------------------
 mode = st.sidebar.radio(
     "Mécanisme de recherche",
-    ["Vector", "Words"],
+    ["Vector", "Words", "Hybrid"],
     index=0,
     horizontal=True,
 ).lower()   
@@ -1,12 +1,80 @@
 import streamlit as st
-import os
+import requests
+import time
+import uuid
+
+FASTAPI_URL = "http://127.0.0.1:8000"
+# size of the blocks the upload body is streamed in
+UPLOAD_BLOCK_BYTES = 1024 * 1024
+
+
+def iter_multipart(files, boundary):
+    """
+    multipart/form-data body of `files` (field "files"), produced block by
+    block so requests sends it chunked instead of building it in memory.
+    """
+    for f in files:
+        yield (f"--{boundary}\r\n"
+               f'Content-Disposition: form-data; name="files"; filename="{f.name}"\r\n'
+               f"Content-Type: application/pdf\r\n\r\n").encode("utf-8")
+        f.seek(0)
+        for block in iter(lambda: f.read(UPLOAD_BLOCK_BYTES), b""):
+            yield block
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
+
+
+def upload(files):
+    boundary = uuid.uuid4().hex
+    resp = requests.post(
+        f"{FASTAPI_URL}/upload/bulk",
+        data=iter_multipart(files, boundary),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    resp.raise_for_status()
+    return resp.json()["jobs"]
+
 
 st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
 st.header("Dataset PDF Documents :file_folder:")
 
-uploaded_file = st.file_uploader("Upload a PDF document", type=["pdf"])
-if uploaded_file is not None:
-    file_path = os.path.join("uploads", uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    st.success("File uploaded successfully!")
+uploaded_files = st.file_uploader("Upload PDF documents", type=["pdf"], accept_multiple_files=True)
+if uploaded_files and st.button("Upload & index"):
+    try:
+        jobs = upload(uploaded_files)
+    except requests.RequestException as e:
+        st.error(f"Upload failed: {e}")
+        st.stop()
+
+    # follow the ingestion jobs until they are all finished
+    bars = {}
+    for job in jobs:
+        if job["status"] == "rejected":
+            st.error(f"{job['filename']} : {job['error']}")
+        else:
+            bars[job["job_id"]] = (job["filename"], st.progress(0, text=f"{job['filename']} : queued"))
+
+    pending = set(bars)
+    while pending:
+        time.sleep(1)
+        for job_id in list(pending):
+            filename, bar = bars[job_id]
+            resp = requests.get(f"{FASTAPI_URL}/upload/jobs/{job_id}")
+            job = resp.json() if resp.ok else {}
+            status = job.get("status")
+            if status is None:
+                # unknown job (expired, or the API lost it): stop following it
+                bar.progress(1.0, text=f"{filename} : job not found")
+                st.error(f"{filename} : ingestion job {job_id} not found")
+                pending.discard(job_id)
+            elif status == "done":
+                bar.progress(1.0, text=f"{filename} : indexed ({job.get('chunks_added', 0)} chunks)")
+                pending.discard(job_id)
+            elif status == "failed":
+                bar.progress(1.0, text=f"{filename} : failed – {job.get('error')}")
+                pending.discard(job_id)
+            else:
+                total = job.get("chunks") or 0
+                done = job.get("chunks_done") or 0
+                bar.progress(done / total if total else 0.0, text=f"{filename} : {status} ({done}/{total} chunks)")
+    st.success("Upload finished.")
@@ -1,18 +1,10 @@
-import chromadb 
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-import paths
-from chromadb.config import Settings
+import clients
 
 
-embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
+embedding_model = clients.get_embedding_model()
 
-# 1) Connect to the running Chroma server
-client = chromadb.HttpClient(
-    host="localhost",
-    port=8010,
-    settings=Settings(anonymized_telemetry=False),
-)
+# 1) Connect to the running Chroma server (shared client)
+client = clients.get_chroma_client()
 
 # 2) Re-use or create the collection (server-side metadata knows if it exists)
 collection = client.get_or_create_collection(
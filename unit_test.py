@@ -1,52 +1,25 @@
+import os
 import pytest
-from unittest.mock import MagicMock
-from generator import get_query_type
-from preprocess import correct_accent, clean_text, remove_urls, remove_emails
+from unittest.mock import AsyncMock, MagicMock
 from retriever import get_best_files
 from redis_db import RedisChatMessageHistory
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
-# Test de get_query_type
-def test_get_query_type():
-    mock_model = MagicMock()
-    mock_tokenizer = MagicMock()
-    
-    mock_tokenizer.return_value = {"input_ids": [[1, 2, 3]], "attention_mask": [[1, 1, 1]]}
-    mock_model.return_value.logits = [[1.0, 2.0]]  # Mocked logits without TensorFlow
-    
-    result = get_query_type("example query", mock_model, mock_tokenizer)
-    assert result in ["simple", "complex"]
-
-# Test de correct_accent
-def test_correct_accent():
-    assert correct_accent("caf´e") == "café"
-    assert correct_accent("`e`a`u") == "èàù"
-    assert correct_accent("normal text") == "normal text"
-
-# Test de clean_text
-def test_clean_text():
-    assert clean_text("Hello!!  World!!") == "Hello!! World!!"
-    assert clean_text("This is a test.") == "This is a test."
-
-# Test de remove_urls
-def test_remove_urls():
-    assert remove_urls("Check this out: https://example.com") == "Check this out: "
-    assert remove_urls("No URL here.") == "No URL here."
-
-# Test de remove_emails
-def test_remove_emails():
-    assert remove_emails("Contact me at test@example.com") == "Contact me at "
-    assert remove_emails("No email here.") == "No email here."
-
 # Test de get_best_files
 def test_get_best_files():
+    import asyncio
+    import retriever
+
+    retriever.result_cache.clear()
     mock_retriever = MagicMock()
-    mock_retriever.invoke.return_value = [
+    mock_retriever.ainvoke = AsyncMock(return_value=[
         MagicMock(metadata={"source": "file1.pdf"}),
-        MagicMock(metadata={"source": "file2.pdf"})
-    ]
-    result = get_best_files("test query", mock_retriever, k=2)
-    assert result == ["file1.pdf", "file2.pdf"]
+        MagicMock(metadata={"source": "file2.pdf"}),
+        MagicMock(metadata={"source": "file3.pdf"}),
+    ])
+    paths, metas = asyncio.run(get_best_files("test query", mock_retriever, k=2))
+    assert paths == ["file1.pdf", "file2.pdf"]
+    assert metas == [{"source": "file1.pdf"}, {"source": "file2.pdf"}]
 
 # Tests pour RedisChatMessageHistory
 def test_redis_chat_message_history():
@@ -59,7 +32,8 @@ def test_redis_chat_message_history():
     chat_history.add_message(SystemMessage(content="System message"))
     chat_history.add_ai_message("AI response")
     
-    assert mock_redis.rpush.call_count == 3  # Vérifie que les messages sont bien stockés
+    assert mock_redis.rpush.call_count == 2  # Vérifie que les messages sont bien stockés
+    mock_redis.set.assert_called_once_with("chat_system:test_session", "System message")  # stocké à part
     
     # Simuler la récupération des messages
     mock_redis.lrange.return_value = [
@@ -73,3 +47,775 @@ def test_redis_chat_message_history():
     assert isinstance(messages[0], HumanMessage) and messages[0].content == "Hello"
     assert isinstance(messages[1], SystemMessage) and messages[1].content == "System message"
     assert isinstance(messages[2], AIMessage) and messages[2].content == "AI response"
+
+
+def test_redis_chat_message_history_window():
+    mock_redis = MagicMock()
+    chat_history = RedisChatMessageHistory("test_session", mock_redis, window=2)
+    mock_redis.get.return_value = "System message"
+    mock_redis.llen.return_value = 3
+    mock_redis.lrange.return_value = [
+        '{"role": "assistant", "content": "AI response"}',
+        '{"role": "user", "content": "Hello again"}',
+    ]
+
+    messages = chat_history.messages
+    mock_redis.lrange.assert_called_once_with("chat_history:test_session", -2, -1)  # seulement la fenêtre
+    assert [type(m) for m in messages] == [SystemMessage, AIMessage, HumanMessage]
+
+    # la liste n'a pas grandi : servi par le cache
+    chat_history.messages
+    assert mock_redis.lrange.call_count == 1
+
+    # notre propre ajout met le cache à jour sans relire Redis
+    mock_redis.rpush.return_value = 4
+    chat_history.add_message(AIMessage(content="Second answer"), duration=1.5)
+    mock_redis.llen.return_value = 4
+    assert chat_history.last_message().content == "Second answer"
+    assert chat_history.last_message().duration == 1.5
+    assert mock_redis.lrange.call_count == 1
+
+
+def test_run_job_records_ingest_duration(monkeypatch, tmp_path):
+    import contextlib
+    import ingest_jobs
+    from langchain_core.documents import Document
+
+    jobs = MagicMock()
+    state = {"jobs": jobs, "vectorstore": MagicMock(), "indexes": MagicMock()}
+    manifest = MagicMock()
+    manifest.classify.return_value = (ingest_jobs.NEW, None, None)
+    chunks = [Document(page_content=f"chunk {i}") for i in range(5)]
+    record = MagicMock()
+    monkeypatch.setattr(ingest_jobs, "_worker_state", lambda: state)
+    monkeypatch.setattr(ingest_jobs, "IngestManifest", MagicMock(return_value=manifest))
+    monkeypatch.setattr(ingest_jobs.preprocess, "iter_file_chunks", lambda *args, **kwargs: iter(chunks))
+    monkeypatch.setattr(ingest_jobs.preprocess, "EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(ingest_jobs.preprocess, "sync_files", lambda *args, **kwargs: 5)
+    monkeypatch.setattr(ingest_jobs.preprocess, "ingest_lock", contextlib.nullcontext)
+    monkeypatch.setattr(ingest_jobs.metrics, "record_ingest", record)
+
+    staged = tmp_path / "doc.pdf"
+    staged.write_bytes(b"%PDF-1.4")
+    assert ingest_jobs.run_job("job", str(staged), str(tmp_path / "data.pdf")) == 5
+
+    # durée du job, pas un timestamp (la boucle d'embedding ne doit pas écraser `start`)
+    _, chunks_added, seconds = record.call_args.args
+    assert chunks_added == 5
+    assert 0 <= seconds < 60
+
+
+def test_get_vectorizer_keeps_renamed_file_embeddings(monkeypatch, tmp_path):
+    import contextlib
+    import preprocess
+    from manifest import IngestManifest, file_hash
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    renamed = data_dir / "new_name.pdf"
+    renamed.write_bytes(b"%PDF-1.4 same content")
+    old_source = str(data_dir / "old_name.pdf")  # n'existe plus sur disque
+
+    manifest_path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest(path=manifest_path)
+    manifest.entries[old_source] = {
+        "sha256": file_hash(str(renamed)), "size": 1, "mtime": 0.0,
+        "chunk_ids": ["c1", "c2"], "model": manifest.model_id,
+    }
+    manifest.save()
+
+    vectorstore = MagicMock()
+    vectorstore._collection.count.return_value = 2
+    vectorstore._collection.get.return_value = {"ids": ["c1", "c2"], "metadatas": [{}, {}]}
+    add_in_batches = MagicMock(return_value=[])
+    monkeypatch.setattr(preprocess.clients, "get_embedding_model", MagicMock())
+    monkeypatch.setattr(preprocess, "load_vectorstore", lambda *args, **kwargs: vectorstore)
+    monkeypatch.setattr(preprocess, "LocalIndexes", MagicMock())
+    monkeypatch.setattr(preprocess, "IngestManifest", lambda: IngestManifest(path=manifest_path))
+    monkeypatch.setattr(preprocess, "get_all_files", lambda **kwargs: [str(renamed)])
+    monkeypatch.setattr(preprocess, "ingest_lock", contextlib.nullcontext)
+    monkeypatch.setattr(preprocess, "bump_index_version", lambda: None)
+    monkeypatch.setattr(preprocess, "add_in_batches", add_in_batches)
+    monkeypatch.setattr(preprocess, "report_ingest", lambda *args: None)
+
+    preprocess.get_vectorizer(workers=1)
+
+    # aucun embedding recalculé ni chunk supprimé : seule la source a changé
+    add_in_batches.assert_not_called()
+    vectorstore._collection.delete.assert_not_called()
+    entries = IngestManifest(path=manifest_path).entries
+    assert list(entries) == [os.path.abspath(str(renamed))]
+    assert entries[os.path.abspath(str(renamed))]["chunk_ids"] == ["c1", "c2"]
+
+
+def test_duplicate_inherits_chunks_when_owner_goes_away(monkeypatch, tmp_path):
+    import preprocess
+    from manifest import IngestManifest, file_hash
+
+    owner, duplicate = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    for f in (owner, duplicate):
+        f.write_bytes(b"%PDF-1.4 identical")
+    manifest = IngestManifest(path=str(tmp_path / "manifest.json"))
+    manifest.record(str(owner), str(owner), ["c1", "c2"])
+    manifest.record(str(duplicate), str(duplicate), [])  # DUPLICATE : pas de chunks propres
+    assert manifest.find_by_hash(file_hash(str(owner))) == str(owner)
+
+    owner.unlink()
+    collection, indexes = MagicMock(), MagicMock()
+    collection.get.return_value = {"ids": ["c1", "c2"], "metadatas": [{"source": str(owner)}] * 2}
+    monkeypatch.setattr(preprocess, "bump_index_version", lambda: None)
+
+    assert preprocess.release_source(collection, indexes, manifest, str(owner)) == 0
+    collection.delete.assert_not_called()
+    assert manifest.entries[str(duplicate)]["chunk_ids"] == ["c1", "c2"]
+    assert str(owner) not in manifest.entries
+    metadatas = collection.update.call_args.kwargs["metadatas"]
+    assert all(m["source"] == str(duplicate) for m in metadatas)
+
+
+def test_metrics_rollup_backfill_legacy_day():
+    import metrics_rollup
+
+    r = MagicMock()
+    r.scan_iter.side_effect = lambda match, count: ["responses:2025-03-14", "responses:not-a-date"] \
+        if match == "responses:*" else []
+    r.sadd.return_value = 1
+    r.get.side_effect = lambda key: {"responses:2025-03-14": "4", "feedback:positive:2025-03-14": "1"}.get(key)
+    r.smembers.return_value = {"session-a", "session-b"}
+    r.lrange.return_value = ["0.5", "1.5"]
+    pipe = r.pipeline.return_value
+
+    assert metrics_rollup.backfill(r) == 1
+    r.sadd.assert_called_once_with(metrics_rollup.BACKFILLED_KEY, "2025-03-14")
+    for label in ("2025-03-14", "2025-W11", "2025-03"):
+        pipe.hincrby.assert_any_call(f"rollup:{label}", "responses", 4)
+        pipe.hincrby.assert_any_call(f"rollup:{label}", "feedback_positive", 1)
+        pipe.pfadd.assert_any_call(f"rollup:users:{label}", *r.smembers.return_value)
+    assert pipe.hincrbyfloat.call_count == 2 * 3  # 2 durées x jour/semaine/mois
+
+    # déjà migré : rien n'est recompté
+    r.sadd.return_value = 0
+    pipe.reset_mock()
+    assert metrics_rollup.backfill(r) == 0
+    pipe.hincrby.assert_not_called()
+
+
+def test_run_job_failure_removes_staged_file(monkeypatch, tmp_path):
+    import ingest_jobs
+
+    jobs = MagicMock()
+    monkeypatch.setattr(ingest_jobs, "_worker_state",
+                        lambda: {"jobs": jobs, "vectorstore": MagicMock(), "indexes": MagicMock()})
+    monkeypatch.setattr(ingest_jobs, "IngestManifest", MagicMock(side_effect=RuntimeError("corrupt pdf")))
+
+    staged = tmp_path / "doc.pdf"
+    staged.write_bytes(b"%PDF-1.4")
+    with pytest.raises(RuntimeError):
+        ingest_jobs.run_job("job", str(staged), str(tmp_path / "data.pdf"))
+    assert not staged.exists()
+    assert jobs.update.call_args.kwargs["status"] == ingest_jobs.FAILED
+
+
+def test_prompt_budget_caches_message_tokens():
+    from prompt_budget import PromptBudget, MESSAGE_OVERHEAD_TOKENS
+
+    llm = MagicMock()
+    llm.client.tokenize.side_effect = lambda data, add_bos=False: data.split()
+    budget = PromptBudget(llm, "system {context}")
+    history = [HumanMessage(content="one two three"), AIMessage(content="four five")]
+
+    assert budget.count_messages(history) == 5 + 2 * MESSAGE_OVERHEAD_TOKENS
+    calls = llm.client.tokenize.call_count
+    budget.count_messages(history)  # trim_messages recompte les mêmes messages
+    assert llm.client.tokenize.call_count == calls
+
+
+def test_lexical_index_saves_only_the_delta(tmp_path, monkeypatch):
+    import lexical_index
+
+    monkeypatch.setattr(lexical_index, "LOG_COMPACT_RATIO", 10.0)  # pas de compaction ici
+    path = str(tmp_path / "bm25.pkl")
+    writer = lexical_index.BM25Index(path)
+    writer.add("a", "the quick brown fox", "a.pdf")
+    writer.save()  # premier save : snapshot complet
+    snapshot = os.stat(path)
+
+    reader = lexical_index.BM25Index(path)
+    writer.add("b", "the lazy dog", "b.pdf")
+    writer.remove(["a"])
+    writer.save()
+    # le snapshot n'est pas réécrit, seul le log grossit
+    assert (os.stat(path).st_mtime_ns, os.stat(path).st_ino) == (snapshot.st_mtime_ns, snapshot.st_ino)
+
+    reader.reload_if_changed()  # rejoue le log de l'autre process
+    assert reader.search("dog") and reader.search("fox") == []
+    assert len(lexical_index.BM25Index(path)) == 1
+
+
+def test_latency_histogram_percentiles():
+    import latency_histogram
+
+    raw = {}
+    pipe = MagicMock()
+    pipe.hincrby.side_effect = lambda key, field, n: raw.__setitem__(field, raw.get(field, 0) + n)
+    pipe.hincrbyfloat.side_effect = lambda key, field, v: raw.__setitem__(field, raw.get(field, 0) + v)
+    # 1 000 latences uniformes de 10 ms à 10 s
+    values = [0.01 * (i + 1) for i in range(1000)]
+    for seconds in values:
+        latency_histogram.record(pipe, "total", seconds, "2025-03-14")
+    pipe.hincrby.assert_any_call("latency:total:2025-03-14", "count", 1)
+
+    summary = latency_histogram.summarize({k: str(v) for k, v in raw.items()})  # HGETALL renvoie des str
+    assert summary["count"] == 1000
+    assert summary["mean"] == pytest.approx(sum(values) / 1000)
+    for q, expected in (("p50", 5.0), ("p90", 9.0), ("p99", 9.9)):
+        assert summary[q] == pytest.approx(expected, rel=0.1)  # ±10 % : un bucket
+
+    # fusion de deux jours identiques : mêmes percentiles, deux fois plus de mesures
+    merged = latency_histogram.merge([raw, raw])
+    assert latency_histogram.summarize(merged)["count"] == 2000
+    assert latency_histogram.percentile(merged, 0.5) == summary["p50"]
+    assert latency_histogram.summarize({})["p50"] is None
+
+
+class _FakeRollupRedis:
+    """Redis en mémoire : hashes et ensembles (à la place des HyperLogLog), pipeline async."""
+
+    def __init__(self):
+        self.hashes, self.sets = {}, {}
+
+    # écritures (pipeline synchrone des record_*)
+    def hincrby(self, key, field, n):
+        entry = self.hashes.setdefault(key, {})
+        entry[field] = str(int(entry.get(field, 0)) + n)
+
+    def hincrbyfloat(self, key, field, value):
+        entry = self.hashes.setdefault(key, {})
+        entry[field] = str(float(entry.get(field, 0)) + value)
+
+    def pfadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(values)
+
+    # lectures (pipeline async de read_summary)
+    def pipeline(self, transaction=True):
+        redis, queued = self, []
+
+        class Pipe:
+            def hmget(self, key, *fields):
+                queued.append(lambda: [redis.hashes.get(key, {}).get(f) for f in fields])
+
+            def hgetall(self, key):
+                queued.append(lambda: dict(redis.hashes.get(key, {})))
+
+            def pfcount(self, *keys):
+                queued.append(lambda: len(set().union(*(redis.sets.get(k, set()) for k in keys))))
+
+            async def execute(self):
+                return [reply() for reply in queued]
+
+        return Pipe()
+
+
+def _days_of(label):
+    from datetime import date, timedelta
+
+    if "-W" in label:
+        year, week = label.split("-W")
+        monday = date.fromisocalendar(int(year), int(week), 1)
+        return [monday + timedelta(days=i) for i in range(7)]
+    if label.count("-") == 1:
+        first = date.fromisoformat(label + "-01")
+        return [first + timedelta(days=i) for i in range(31) if (first + timedelta(days=i)).month == first.month]
+    return [date.fromisoformat(label)]
+
+
+def test_metrics_rollup_cover():
+    from datetime import date, timedelta
+    from metrics_rollup import cover
+
+    # 28 sept. (lundi) → 3 nov. : semaines entières, octobre n'est pas couvert en entier
+    assert cover(date(2026, 9, 28), date(2026, 11, 3)) == [
+        "2026-W40", "2026-W41", "2026-W42", "2026-W43", "2026-W44", "2026-11-02", "2026-11-03"]
+    assert cover(date(2026, 9, 1), date(2026, 11, 1)) == ["2026-09", "2026-10", "2026-11-01"]
+    # sur une année, chaque jour est couvert une et une seule fois, en ~30 clés
+    start, end = date(2025, 10, 19), date(2026, 10, 18)
+    labels = cover(start, end)
+    assert len(labels) < 40
+    covered = [day for label in labels for day in _days_of(label)]
+    assert covered == [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    assert cover(date(2026, 3, 14), date(2026, 3, 14)) == ["2026-03-14"]
+    assert cover(date(2026, 3, 15), date(2026, 3, 14)) == []
+
+
+@pytest.mark.parametrize("start, end, granularity, points", [
+    ((2026, 10, 12), (2026, 10, 18), "day", 7),
+    ((2026, 9, 1), (2026, 10, 18), "week", 7),
+    ((2025, 11, 1), (2026, 10, 18), "month", 12),
+])
+def test_metrics_rollup_read_summary(start, end, granularity, points):
+    import asyncio
+    from datetime import date, timedelta
+    import metrics_rollup
+
+    start, end = date(*start), date(*end)
+    redis = _FakeRollupRedis()
+    # une réponse et un utilisateur par jour, plus des jours hors de la plage
+    day = start - timedelta(days=40)
+    while day <= end + timedelta(days=40):
+        metrics_rollup.record_response(redis, day)
+        metrics_rollup.record_user(redis, "user-" + day.isoformat(), day)
+        metrics_rollup.record_latency(redis, "total", 0.5, day)
+        day += timedelta(days=1)
+    metrics_rollup.record_feedback(redis, True, end)
+
+    summary = asyncio.run(metrics_rollup.read_summary(redis, start, end))
+    days = (end - start).days + 1
+    assert summary["granularity"] == granularity
+    assert len(summary["series"]) == points
+    assert summary["total"]["responses"] == days
+    assert summary["total"]["users"] == days
+    assert summary["total"]["feedback_positive"] == 1
+    assert summary["total"]["latency"]["total"]["count"] == days
+    assert summary["total"]["latency"]["total"]["p50"] == pytest.approx(0.5, rel=0.1)
+    # la série recouvre exactement la plage
+    assert summary["series"][0]["from"] == start.isoformat() and summary["series"][-1]["to"] == end.isoformat()
+    assert sum(point["responses"] for point in summary["series"]) == days
+
+
+def test_bm25_ranking(tmp_path):
+    from lexical_index import BM25Index
+
+    index = BM25Index(str(tmp_path / "bm25.pkl"))
+    index.add("rare", "le contrat de bail est résilié", "a.pdf")
+    index.add("often", "bail bail bail : durée du bail", "b.pdf")
+    index.add("long", "bail " + "texte sans rapport " * 50, "c.pdf")
+    index.add("none", "procès-verbal de réunion", "d.pdf")
+
+    ranked = [chunk_id for chunk_id, _ in index.search("bail")]
+    # tf élevé d'abord, document long pénalisé, document sans le terme absent
+    assert ranked == ["often", "rare", "long"]
+    # un terme rare pèse plus qu'un terme présent partout
+    assert index.search("résilié bail")[0][0] == "rare"
+    assert index.search("inconnu") == []
+
+    index.remove(["often"])
+    assert [chunk_id for chunk_id, _ in index.search("bail", k=1)] == ["rare"]
+    index.save()
+    assert BM25Index(str(tmp_path / "bm25.pkl")).search("bail") == index.search("bail")
+
+
+def test_phrase_index_matches_adjacent_words(tmp_path):
+    from lexical_index import PhraseIndex
+
+    index = PhraseIndex(str(tmp_path / "phrases.pkl"))
+    index.add("twice", "Article 12 : le délai de préavis. Rappel : le délai de préavis court.", "a.pdf")
+    index.add("once", "Le délai de préavis est de trois mois.", "b.pdf")
+    index.add("scattered", "Le préavis et le délai de paiement.", "c.pdf")
+
+    # mots adjacents et dans l'ordre uniquement, classés par nombre d'occurrences
+    assert index.search("délai de préavis") == [("twice", 2), ("once", 1)]
+    assert index.search("préavis de délai") == []
+    assert index.search("DÉLAI") and len(index.search("délai")) == 3  # même analyseur que BM25
+    assert index.search("délai de congé") == []
+
+    index.set_source(["once"], "renamed.pdf")
+    index.remove(["twice"])
+    index.save()
+    reloaded = PhraseIndex(str(tmp_path / "phrases.pkl"))
+    assert reloaded.search("délai de préavis") == [("once", 1)]
+    assert reloaded.doc_source["once"] == "renamed.pdf"
+
+
+def test_embedding_cache_hits_and_misses(tmp_path):
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+    model = MagicMock()
+    model.embed_documents.side_effect = lambda texts: [[float(len(t)), 1.0] for t in texts]
+    model.embed_query.side_effect = lambda text: [float(len(text)), 2.0]
+    cache = EmbeddingCache(str(tmp_path / "cache" / "embeddings.db"))
+    embeddings = CachedEmbeddings(model, "bert", cache)
+
+    # premier passage : tout est calculé, les doublons une seule fois
+    assert embeddings.embed_documents(["abc", "de", "abc"]) == [[3.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    model.embed_documents.assert_called_once_with(["abc", "de"])
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    # second passage : seul le nouveau texte passe par le modèle
+    assert embeddings.embed_documents(["de", "fghi"]) == [[2.0, 1.0], [4.0, 1.0]]
+    model.embed_documents.assert_called_with(["fghi"])
+    assert embeddings.stats()["hits"] == 1 and embeddings.stats()["misses"] == 4
+
+    # requêtes et documents sont des entrées distinctes, comme deux modèles
+    assert embeddings.embed_query("abc") == [3.0, 2.0]
+    assert embeddings.embed_query("abc") == [3.0, 2.0]
+    model.embed_query.assert_called_once_with("abc")
+    assert CachedEmbeddings(model, "other-model", cache).cache.get_many("other-model", "doc", ["x"]) == {}
+
+    # le cache survit au redémarrage
+    reopened = EmbeddingCache(str(tmp_path / "cache" / "embeddings.db"))
+    assert CachedEmbeddings(MagicMock(), "bert", reopened).embed_documents(["fghi"]) == [[4.0, 1.0]]
+    assert reopened.hits == 1
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    from embedding_cache import EmbeddingCache, text_hash
+
+    vector = [0.0] * 16  # 64 octets en float32
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"), max_bytes=64 * 3)
+    cache.put_many("bert", "doc", [(text_hash("a"), vector), (text_hash("b"), vector), (text_hash("c"), vector)])
+    cache.get_many("bert", "doc", [text_hash("a")])  # "a" redevient récent
+    cache.put_many("bert", "doc", [(text_hash("d"), vector)])
+
+    assert cache.evictions == 2 and cache.stats()["size_bytes"] <= 64 * 3
+    assert set(cache.get_many("bert", "doc", [text_hash(t) for t in "abcd"])) == {text_hash("a"), text_hash("d")}
+
+
+def test_local_vector_index_compaction(tmp_path):
+    import numpy as np
+    from local_vectorstore import LocalVectorIndex
+
+    vectors = np.random.default_rng(0).standard_normal((200, 32)).astype(np.float32)
+    index = LocalVectorIndex(str(tmp_path), chunk_store=MagicMock())
+    index.upsert([f"c{n}" for n in range(200)], vectors)
+    reader = LocalVectorIndex(str(tmp_path), chunk_store=MagicMock())
+    assert reader.search(vectors[150], k=1)[0][0] == "c150"
+
+    # plus de 30 % de lignes mortes : delete() compacte
+    index.delete([f"c{n}" for n in range(0, 200, 2)])
+    assert sorted(os.listdir(tmp_path)) == ["rows.jsonl", "vectors-00001.f32"]
+    assert index.memory_stats()["rows"] == index.count() == 100
+
+    # l'autre process voit le nouveau log et ne renvoie que des lignes vivantes
+    assert reader.count() == 100
+    assert reader.search(vectors[151], k=1)[0][0] == "c151"
+    assert all(int(chunk_id[1:]) % 2 for chunk_id, _ in reader.search(vectors[150], k=20))
+    # une mise à jour après compaction repart de la nouvelle génération
+    index.upsert(["c151"], vectors[:1])
+    assert reader.search(vectors[0], k=1)[0][0] == "c151"
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8", "binary"])
+def test_local_vector_index_search(tmp_path, quantization):
+    import numpy as np
+    from local_vectorstore import LocalVectorIndex
+
+    vectors = np.random.default_rng(0).standard_normal((200, 64)).astype(np.float32)
+    index = LocalVectorIndex(str(tmp_path), chunk_store=MagicMock(), quantization=quantization)
+    index.upsert([f"c{n}" for n in range(200)], vectors)
+
+    # une requête proche d'une ligne la retrouve en tête, re-scorée exactement (cosinus)
+    query = vectors[17] + 0.05 * np.random.default_rng(1).standard_normal(64).astype(np.float32)
+    results = index.search(query, k=3)
+    assert results[0][0] == "c17" and len(results) == 3
+    assert results[0][1] == pytest.approx(
+        float(query @ vectors[17] / np.linalg.norm(query) / np.linalg.norm(vectors[17])), rel=1e-4)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+    stats = index.memory_stats()
+    assert stats["float32_bytes"] == 200 * 64 * 4
+    assert stats["codes_bytes"] == {"none": 0, "int8": 200 * 64 + 200 * 4, "binary": 200 * 64 // 8}[quantization]
+
+
+def test_job_store_fails_jobs_left_unfinished(monkeypatch, tmp_path):
+    import ingest_jobs
+
+    monkeypatch.setattr(ingest_jobs.paths, "ingest_staging_path", str(tmp_path))
+    jobs = {
+        "q": {"id": "q", "filename": "a.pdf", "status": ingest_jobs.QUEUED},
+        "e": {"id": "e", "filename": "b.pdf", "status": ingest_jobs.EMBEDDING},
+        "d": {"id": "d", "filename": "c.pdf", "status": ingest_jobs.DONE},
+    }
+    r = MagicMock()
+    r.lrange.return_value = list(jobs)
+    r.hgetall.side_effect = lambda key: jobs.get(key.rsplit(":", 1)[1], {})
+    for job in jobs.values():
+        open(ingest_jobs.staging_path(job["id"], job["filename"]), "wb").close()
+
+    # au démarrage de l'API, les jobs de l'ancien pool ne finiront jamais
+    assert ingest_jobs.JobStore(r).fail_unfinished("interrupted") == 2
+    failed = {c.args[0]: c.kwargs["mapping"] for c in r.hset.call_args_list}
+    assert set(failed) == {"ingest:job:q", "ingest:job:e"}
+    assert all(m["status"] == ingest_jobs.FAILED and m["error"] == "interrupted" for m in failed.values())
+    assert os.listdir(tmp_path) == ["d-c.pdf"]
+
+
+def test_chunk_store_reads_while_appending(tmp_path):
+    import threading
+    from langchain_core.documents import Document
+    from chunk_store import ChunkStore
+
+    store = ChunkStore(str(tmp_path))
+    store.append([Document(page_content="first", metadata={"source": "a.pdf"})], ["c0"])
+    errors, stop = [], threading.Event()
+
+    def read():
+        # chaque append agrandit le shard : get() remappe pendant que les autres lisent
+        while not stop.is_set():
+            try:
+                for chunk_id in store.ids():
+                    store.get(chunk_id)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for n in range(1, 300):
+        store.append([Document(page_content=f"chunk {n}", metadata={"source": "a.pdf"})], [f"c{n}"])
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert store.get("c299").page_content == "chunk 299"
+
+
+def test_chroma_heartbeat_does_not_block_other_clients(monkeypatch):
+    import threading
+    import clients
+
+    started, release = threading.Event(), threading.Event()
+    stale = MagicMock()
+    stale.heartbeat.side_effect = lambda: (started.set(), release.wait(5))
+    monkeypatch.setattr(clients, "_chroma_clients", {("chroma", 1): [stale, float("-inf")]})
+    monkeypatch.setattr(clients, "_embedding_models", {"bert": "model"})
+
+    checker = threading.Thread(target=clients.get_chroma_client, args=("chroma", 1))
+    checker.start()
+    assert started.wait(5)
+    # le heartbeat est bloqué sur le réseau : les autres getters répondent quand même
+    got = []
+    getter = threading.Thread(target=lambda: got.append(clients.get_embedding_model("bert")))
+    getter.start()
+    getter.join(1)
+    release.set()
+    checker.join(5)
+    assert got == ["model"]
+    assert clients._chroma_clients[("chroma", 1)][0] is stale
+
+
+def test_leg_latency_counts_concurrent_legs(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    import retriever
+
+    monkeypatch.setitem(retriever.leg_latency, "bm25", {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: retriever._timed_leg("bm25", lambda: None), range(4000)))
+    assert retriever.latency_stats()["bm25"]["count"] == 4000
+
+
+def test_leg_latency_async_leg(monkeypatch):
+    import asyncio
+    import retriever
+
+    monkeypatch.setitem(retriever.leg_latency, "vector", {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+    assert asyncio.run(retriever._atimed_leg("vector", asyncio.sleep(0.01, result="docs"))) == "docs"
+    stats = retriever.latency_stats()["vector"]
+    assert stats["count"] == 1 and stats["max"] == stats["last"] == stats["avg"] > 0
+
+
+def test_metrics_render_prometheus_text(monkeypatch):
+    import metrics
+
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    requests = metrics.Counter("t_requests_total", "Requests.", labels=("cached",))
+    depth = metrics.Gauge("t_queue_depth", "Queue depth.")
+    latency = metrics.Histogram("t_latency_seconds", "Latency.", buckets=(0.1, 1))
+    requests.inc(cached=True)
+    requests.inc(2, cached=True)
+    depth.set(3)
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    lines = metrics.render(metrics.render_ingest({"runs": "2", "chunks": "40"})).splitlines()
+    for name, kind in (("t_requests_total", "counter"), ("t_queue_depth", "gauge"),
+                       ("t_latency_seconds", "histogram"), ("rag_ingest_runs_total", "counter")):
+        assert f"# TYPE {name} {kind}" in lines
+    assert 't_requests_total{cached="True"} 3.0' in lines
+    assert "t_queue_depth 3.0" in lines
+    # buckets cumulés, +Inf compris, puis somme et nombre
+    assert 't_latency_seconds_bucket{le="0.1"} 1.0' in lines
+    assert 't_latency_seconds_bucket{le="1.0"} 2.0' in lines
+    assert 't_latency_seconds_bucket{le="+Inf"} 3.0' in lines
+    assert "t_latency_seconds_sum 5.55" in lines
+    assert "t_latency_seconds_count 3.0" in lines
+    assert "rag_ingest_chunks_total 40.0" in lines
+
+
+class _FakeSemanticRedis:
+    """Redis en mémoire (hashes, sets, zsets, TTL notés) pour le cache sémantique, client sync."""
+
+    def __init__(self):
+        self.data, self.ttls = {}, {}
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, *fields):
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(members)
+
+    def srem(self, key, *members):
+        self.data.get(key, set()).difference_update(members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(member, None)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def zpopmin(self, key, n):
+        zset = self.data.get(key, {})
+        popped = sorted(zset.items(), key=lambda item: item[1])[:n]
+        for member, _ in popped:
+            del zset[member]
+        return popped
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.ttls.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        redis, queued = self, []
+
+        class Pipe:
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: queued.append((name, args, kwargs))
+
+            def execute(self):
+                return [getattr(redis, name)(*args, **kwargs) for name, args, kwargs in queued]
+
+        return Pipe()
+
+
+class _FakeSemanticAsyncRedis:
+    """Le même stockage derrière l'API de redis.asyncio (comme sur le serveur)."""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            return getattr(self.redis, name)(*args, **kwargs)
+        return command
+
+    def pipeline(self, transaction=True):
+        pipe = self.redis.pipeline(transaction)
+
+        class Pipe:
+            def __getattr__(self, name):
+                return getattr(pipe, name)
+
+            async def execute(self):
+                return pipe.execute()
+
+        return Pipe()
+
+
+def test_semantic_cache_threshold_context_and_invalidation():
+    import asyncio
+    from types import SimpleNamespace
+    from semantic_cache import SemanticCache, invalidate_chunks, PREFIX
+
+    vectors = {
+        "Quel est le délai de préavis ?": [1.0, 0.0, 0.0],
+        "Combien de temps dure le préavis ?": [0.95, 0.3, 0.0],  # cosinus ≈ 0.95
+        "Qui signe le contrat ?": [0.0, 1.0, 0.0],
+    }
+
+    async def embed(question):
+        return vectors[question]
+
+    c1, c2, c3 = (SimpleNamespace(id=i, page_content=i) for i in ("c1", "c2", "c3"))
+    redis = _FakeSemanticRedis()
+    cache = SemanticCache(_FakeSemanticAsyncRedis(redis), embed, threshold=0.9, ttl=60)
+
+    async def scenario():
+        await cache.store("Quel est le délai de préavis ?", [c1, c2], "Trois mois.")
+        # paraphrase au-dessus du seuil, même contexte (dans un autre ordre) : hit
+        assert await cache.lookup("Combien de temps dure le préavis ?", [c2, c1]) == "Trois mois."
+        # sous le seuil, même contexte : miss
+        assert await cache.lookup("Qui signe le contrat ?", [c1, c2]) is None
+        # même question, contexte différent : miss
+        assert await cache.lookup("Quel est le délai de préavis ?", [c1, c3]) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        # entrée, contexte et index des chunks expirent avec le TTL
+        assert sorted(key.split(":")[1] for key, ttl in redis.ttls.items() if ttl == 60) == ["chunk", "chunk", "ctx", "entry"]
+        # entrée expirée : miss, et elle est retirée de son contexte
+        entry_key = next(key for key in redis.data if key.startswith(f"{PREFIX}:entry:"))
+        redis.delete(entry_key)
+        assert await cache.lookup("Quel est le délai de préavis ?", [c1, c2]) is None
+        assert await cache.stats() == {"entries": 0, "hits": 1, "misses": 3, "hit_rate": 0.25}
+
+        # un chunk remplacé invalide les réponses qui l'ont utilisé
+        await cache.store("Quel est le délai de préavis ?", [c1, c2], "Trois mois.")
+        assert await cache.lookup("Quel est le délai de préavis ?", [c1, c2]) == "Trois mois."
+        assert invalidate_chunks(redis, ["c2"]) == 1
+        assert await cache.lookup("Quel est le délai de préavis ?", [c1, c2]) is None
+
+    asyncio.run(scenario())
+
+
+def test_add_in_batches_overlaps_embedding_and_upserts():
+    import threading
+    from types import SimpleNamespace
+    import preprocess
+
+    docs = [SimpleNamespace(page_content=f"chunk {n}", metadata={"n": n}) for n in range(10)]
+    first_upsert_started, second_batch_embedded = threading.Event(), threading.Event()
+    upserts, embedded = [], []
+
+    def upsert(ids, documents, embeddings, metadatas):
+        if not upserts:
+            first_upsert_started.set()
+            # l'embedding du lot suivant tourne pendant cet upsert
+            assert second_batch_embedded.wait(5)
+        upserts.append((ids, documents, embeddings, metadatas))
+
+    def embed_documents(texts):
+        if embedded:
+            assert first_upsert_started.wait(5)
+            second_batch_embedded.set()
+        embedded.append(texts)
+        return [[float(t.split()[1])] for t in texts]
+
+    store = SimpleNamespace(_collection=SimpleNamespace(upsert=upsert),
+                            embeddings=SimpleNamespace(embed_documents=embed_documents))
+    ids = [f"id{n}" for n in range(10)]
+    assert preprocess.add_in_batches(store, docs, ids=ids, batch_size=4) == ids
+
+    # chaque lot une seule fois, dans l'ordre, avec ses vecteurs
+    assert [batch_ids for batch_ids, *_ in upserts] == [ids[0:4], ids[4:8], ids[8:10]]
+    assert [v for _, _, vectors, _ in upserts for v in vectors] == [[float(n)] for n in range(10)]
+    assert [m["n"] for *_, metadatas in upserts for m in metadatas] == list(range(10))
+
+    # un upsert en échec remonte à l'appelant
+    calls = []
+
+    def failing_upsert(ids, documents, embeddings, metadatas):
+        calls.append(ids)
+        if len(calls) == 2:
+            raise RuntimeError("chroma down")
+
+    store._collection.upsert = failing_upsert
+    store.embeddings.embed_documents = lambda texts: [[0.0]] * len(texts)
+    with pytest.raises(RuntimeError, match="chroma down"):
+        preprocess.add_in_batches(store, docs, batch_size=4)